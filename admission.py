@@ -0,0 +1,130 @@
+import math
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeout
+
+# CPU-heavy search work (decode + extract + score) runs on a bounded pool:
+# SEARCH_CONCURRENCY tasks at a time, up to SEARCH_QUEUE_DEPTH more waiting.
+# Anything beyond that, or a task still queued after SEARCH_QUEUE_TIMEOUT
+# seconds, is turned away at once (503 + Retry-After) instead of piling up.
+#
+# Every admitted search holds a gunicorn thread while it runs or waits, so
+# running + waiting is capped at the worker's threads (GUNICORN_THREADS, see
+# gunicorn.conf.py) minus SEARCH_RESERVED_THREADS: those threads are always
+# free for payments, /status and the other routes.
+WORKER_THREADS = int(os.environ.get('GUNICORN_THREADS', '8'))
+SEARCH_RESERVED_THREADS = int(os.environ.get('SEARCH_RESERVED_THREADS', '2'))
+SEARCH_MAX_ADMITTED = max(1, WORKER_THREADS - SEARCH_RESERVED_THREADS)
+SEARCH_CONCURRENCY = int(os.environ.get('SEARCH_CONCURRENCY',
+                                        min(os.cpu_count() or 1, SEARCH_MAX_ADMITTED)))
+SEARCH_QUEUE_DEPTH = int(os.environ.get('SEARCH_QUEUE_DEPTH',
+                                        max(0, SEARCH_MAX_ADMITTED - SEARCH_CONCURRENCY)))
+SEARCH_QUEUE_TIMEOUT = float(os.environ.get('SEARCH_QUEUE_TIMEOUT', '5'))
+RETRY_AFTER_MAX = 60
+
+
+class Saturated(RuntimeError):
+    """The pool is full ('full') or a task waited too long to start ('timeout').
+
+    `retry_after` is a whole number of seconds to wait.
+    """
+
+    def __init__(self, retry_after, reason, message):
+        super().__init__(message)
+        self.retry_after = retry_after
+        self.reason = reason
+
+
+class AdmissionPool:
+    """Bounded thread pool that rejects work instead of queueing it forever.
+
+    `pool.run(fn, *args)` blocks the calling (request) thread until `fn` has
+    run on the pool and returns its result or re-raises its exception. It
+    raises Saturated without running `fn` when `workers + queue_depth` tasks
+    (never more than `max_admitted`) are already admitted, or when `fn`
+    hasn't started within `queue_timeout`.
+    """
+
+    def __init__(self, workers=SEARCH_CONCURRENCY, queue_depth=SEARCH_QUEUE_DEPTH,
+                 queue_timeout=SEARCH_QUEUE_TIMEOUT, name='search',
+                 max_admitted=SEARCH_MAX_ADMITTED):
+        max_admitted = max(1, max_admitted)
+        self.workers = min(max(1, workers), max_admitted)
+        self.queue_depth = min(max(0, queue_depth), max_admitted - self.workers)
+        self.queue_timeout = queue_timeout
+        self.name = name
+        self.admitted = 0
+        self.completed = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self._inflight = 0
+        self._busy_seconds = 0.0
+        self._lock = threading.Lock()
+        self._executor = None
+        self._pid = None
+
+    def _ensure_executor(self):
+        # created lazily, and again in a forked gunicorn worker (threads don't survive fork)
+        if self._executor is not None and self._pid == os.getpid():
+            return self._executor
+        with self._lock:
+            if self._executor is None or self._pid != os.getpid():
+                self._inflight = 0
+                self._pid = os.getpid()
+                self._executor = ThreadPoolExecutor(self.workers, thread_name_prefix=f'{self.name}-pool')
+            return self._executor
+
+    def retry_after(self):
+        """Seconds until a slot is likely free: queued work x mean task time / workers."""
+        with self._lock:
+            mean = self._busy_seconds / self.completed if self.completed else 1.0
+            inflight = self._inflight
+        return max(1, min(RETRY_AFTER_MAX, math.ceil(mean * inflight / self.workers)))
+
+    def run(self, fn, *args, **kwargs):
+        executor = self._ensure_executor()
+        with self._lock:
+            full = self._inflight >= self.workers + self.queue_depth
+            if full:
+                self.rejected += 1
+            else:
+                self._inflight += 1
+                self.admitted += 1
+        if full:
+            raise Saturated(self.retry_after(), 'full', f'{self.name} queue is full')
+
+        def task():
+            t = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                with self._lock:
+                    self._inflight -= 1
+                    self.completed += 1
+                    self._busy_seconds += time.perf_counter() - t
+
+        future = executor.submit(task)
+        try:
+            return future.result(timeout=self.queue_timeout)
+        except FutureTimeout:
+            # still queued: give the slot back; already running: keep waiting
+            if future.cancel():
+                with self._lock:
+                    self._inflight -= 1
+                    self.timed_out += 1
+                raise Saturated(self.retry_after(), 'timeout', f'{self.name} queue wait exceeded')
+            return future.result()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'workers': self.workers,
+                'queue_depth': self.queue_depth,
+                'inflight': self._inflight,
+                'admitted': self.admitted,
+                'completed': self.completed,
+                'rejected': self.rejected,
+                'timed_out': self.timed_out,
+            }
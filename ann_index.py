@@ -0,0 +1,204 @@
+import hashlib
+import os
+import sys
+import time
+
+import numpy as np
+
+# Search backend: 'exact' scans every vector, 'ivf' probes a few k-means cells.
+SEARCH_BACKEND = os.environ.get('SEARCH_BACKEND', 'exact')
+IVF_NPROBE = int(os.environ.get('IVF_NPROBE', '8'))
+# below this many vectors an exact scan is both faster and exact
+ANN_MIN_SIZE = int(os.environ.get('ANN_MIN_SIZE', '20000'))
+ANN_SUFFIX = '.ivf.npz'
+
+
+def ann_path_for(features_file):
+    """`features.pkl` / `features.fidx` -> `features.ivf.npz`."""
+    return os.path.splitext(features_file)[0] + ANN_SUFFIX
+
+
+def paths_fingerprint(paths):
+    """Ties an IVF file to the exact corpus (and row order) it was built for."""
+    h = hashlib.sha1()
+    for p in paths:
+        h.update(p.encode('utf-8'))
+        h.update(b'\0')
+    return h.hexdigest()
+
+
+def default_nlist(n):
+    return max(1, min(n, int(4 * np.sqrt(n))))
+
+
+def _normalize_rows(x):
+    norms = np.linalg.norm(x, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return (x / norms).astype(np.float32)
+
+
+def _assign(vectors, centroids, chunk=65536):
+    """Index of the most similar centroid for every row (chunked matmul)."""
+    out = np.empty(len(vectors), dtype=np.int32)
+    for start in range(0, len(vectors), chunk):
+        block = np.asarray(vectors[start:start + chunk], dtype=np.float32)
+        out[start:start + chunk] = np.argmax(block @ centroids.T, axis=1)
+    return out
+
+
+def spherical_kmeans(vectors, nlist, iters=20, seed=0, sample_size=None):
+    """k-means on the unit sphere (cosine), trained on a random sample."""
+    rng = np.random.default_rng(seed)
+    n = len(vectors)
+    sample_size = min(n, sample_size or 256 * nlist)
+    rows = np.sort(rng.choice(n, sample_size, replace=False)) if sample_size < n else np.arange(n)
+    sample = np.asarray(vectors[rows], dtype=np.float32)
+    centroids = sample[rng.choice(len(sample), nlist, replace=False)].copy()
+    for _ in range(iters):
+        assign = _assign(sample, centroids)
+        order = np.argsort(assign, kind='stable')
+        sorted_assign = assign[order]
+        starts = np.flatnonzero(np.r_[True, sorted_assign[1:] != sorted_assign[:-1]])
+        sums = np.zeros_like(centroids)
+        sums[sorted_assign[starts]] = np.add.reduceat(sample[order], starts, axis=0)
+        empty = np.setdiff1d(np.arange(nlist), sorted_assign[starts])
+        if len(empty):
+            # re-seed dead cells with random points instead of leaving them empty
+            sums[empty] = sample[rng.choice(len(sample), len(empty))]
+        centroids = _normalize_rows(sums)
+    return centroids
+
+
+class IVFIndex:
+    """Inverted-file index: k-means cells with their member row ids (CSR layout).
+
+    Searching probes the `nprobe` cells whose centroids are closest to the
+    query and only scores their members; more probes = higher recall, slower.
+    """
+
+    def __init__(self, centroids, offsets, ids, fingerprint=''):
+        self.centroids = centroids
+        self.offsets = offsets
+        self.ids = ids
+        self.fingerprint = fingerprint
+
+    @property
+    def nlist(self):
+        return len(self.centroids)
+
+    @classmethod
+    def build(cls, matrix, nlist=None, iters=20, seed=0, centroids=None, fingerprint=''):
+        """Cluster the (L2-normalized) rows of `matrix`; reuse `centroids` if given."""
+        if centroids is None:
+            centroids = spherical_kmeans(matrix, nlist or default_nlist(len(matrix)), iters, seed)
+        assign = _assign(matrix, centroids)
+        offsets = np.zeros(len(centroids) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum(np.bincount(assign, minlength=len(centroids)))
+        ids = np.argsort(assign, kind='stable').astype(np.int64)
+        return cls(centroids, offsets, ids, fingerprint)
+
+    def candidates(self, query, nprobe=IVF_NPROBE):
+        """Sorted row ids in the `nprobe` cells closest to the unit-norm query."""
+        nprobe = max(1, min(nprobe, self.nlist))
+        cell_scores = self.centroids @ query
+        probe = np.argpartition(-cell_scores, nprobe - 1)[:nprobe]
+        parts = [self.ids[self.offsets[c]:self.offsets[c + 1]] for c in probe]
+        return np.sort(np.concatenate(parts))
+
+    def save(self, path):
+        tmp_file = path + '.tmp'
+        with open(tmp_file, 'wb') as f:
+            np.savez(f, centroids=self.centroids, offsets=self.offsets, ids=self.ids,
+                     fingerprint=np.array(self.fingerprint))
+        os.replace(tmp_file, path)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls(data['centroids'], data['offsets'], data['ids'], str(data['fingerprint']))
+
+
+def build_ann(index, ann_file, nlist=None, out_file=None):
+    """Build (or refresh) the IVF file for a FeatureIndex.
+
+    Centroids from an existing file are reused while the corpus size stays
+    within 2x of what they were trained for; only the cell lists are rebuilt.
+    The result goes to `out_file` when given (a temp name), else to `ann_file`.
+    """
+    fingerprint = paths_fingerprint(index.paths)
+    centroids = None
+    if nlist is None and os.path.exists(ann_file):
+        try:
+            old = IVFIndex.load(ann_file)
+            target = default_nlist(len(index))
+            if old.centroids.shape[1] == index.dim and target / 2 <= old.nlist <= target * 2:
+                centroids = old.centroids
+        except Exception:
+            centroids = None
+    ann = IVFIndex.build(index.vectors(), nlist=nlist, centroids=centroids, fingerprint=fingerprint)
+    ann.save(out_file or ann_file)
+    return ann
+
+
+def attach_ann(index, features_file):
+    """Use the persisted IVF for `index` when the backend asks for it.
+
+    Falls back to exact search (returns None) for small corpora or when the
+    file is missing / was built for a different corpus.
+    """
+    if SEARCH_BACKEND != 'ivf' or len(index) < ANN_MIN_SIZE:
+        return None
+    ann_file = ann_path_for(features_file)
+    try:
+        ann = IVFIndex.load(ann_file)
+    except (OSError, ValueError, KeyError):
+        print(f"⚠️  {ann_file} not found, using exact search")
+        return None
+    if ann.fingerprint != paths_fingerprint(index.paths):
+        print(f"⚠️  {ann_file} is stale, using exact search (rebuild with /train)")
+        return None
+    index.ann = ann
+    return ann
+
+
+def evaluate(index, ann, nprobes=(1, 2, 4, 8, 16, 32), n_queries=200, k=10, seed=0):
+    """recall@k and latency of IVF vs exact search, using corpus rows as queries."""
+    from feature_index import FeatureIndex
+    rng = np.random.default_rng(seed)
+    picks = rng.choice(len(index), min(n_queries, len(index)), replace=False)
+    queries = {i: index[index.paths[i]] for i in picks}
+    exact = FeatureIndex(index.paths, index.matrix, index.codec, index.dim)
+    truth = [{r['image_path'] for r in exact.search(queries[i], -1.0, k)} for i in picks]
+    start = time.perf_counter()
+    for i in picks:
+        exact.search(queries[i], -1.0, k)
+    exact_ms = (time.perf_counter() - start) * 1000 / len(picks)
+    print(f"exact: {exact_ms:.2f} ms/query")
+    approx = FeatureIndex(index.paths, index.matrix, index.codec, index.dim)
+    approx.ann = ann
+    for nprobe in nprobes:
+        approx.nprobe = nprobe
+        hits = 0
+        start = time.perf_counter()
+        for i, expected in zip(picks, truth):
+            found = approx.search(queries[i], -1.0, k)
+            hits += len(expected & {r['image_path'] for r in found})
+        ms = (time.perf_counter() - start) * 1000 / len(picks)
+        print(f"nprobe={nprobe:<3} recall@{k}={hits / (k * len(picks)):.3f}  {ms:.2f} ms/query")
+
+
+# Build / evaluate the IVF next to a feature file:
+#   python ann_index.py features.pkl [nlist]
+if __name__ == '__main__':
+    from feature_index import load_features
+    if len(sys.argv) < 2:
+        print('usage: python ann_index.py <features file> [nlist]')
+        sys.exit(1)
+    features_file = sys.argv[1]
+    index = load_features(features_file)
+    start = time.perf_counter()
+    ann = build_ann(index, ann_path_for(features_file),
+                    nlist=int(sys.argv[2]) if len(sys.argv) > 2 else None)
+    print(f"built IVF ({ann.nlist} cells) for {len(index)} vectors in "
+          f"{time.perf_counter() - start:.1f}s -> {ann_path_for(features_file)}")
+    evaluate(index, ann)
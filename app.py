@@ -1,9 +1,13 @@
-from flask import Flask, request, jsonify, render_template, send_file
+from flask import Flask, request, jsonify, render_template, send_file, url_for, g
 from flask_cors import CORS
+from werkzeug.utils import safe_join
 import os
 import json
-import requests
+import threading
+import time
+from collections import namedtuple
 from datetime import datetime
+import gzip
 import uuid
 
 # Load environment variables from .env file
@@ -18,11 +22,27 @@ USE_LIGHT = os.environ.get('LIGHT_MODE', '1') in ('1', 'true', 'True')
 
 if USE_LIGHT:
     # lightweight, OpenCV-based feature extractor (no TensorFlow)
-    from result_light import load_saved_features, find_similar_images
+    from result_light import (load_saved_features, decode_image, extract_features_from_array,
+                              extract_features_batch, find_similar_page, find_similar_batch)
+    query_batcher = None
 else:
-    from result import load_saved_features, find_similar_images
+    from result import (load_saved_features, decode_image, extract_features_from_array,
+                        extract_features_batch, find_similar_page, find_similar_batch,
+                        query_batcher)
+from feature_index import resolve_features_file
+from feature_manifest import content_hashes
+from training_jobs import TrainingJobs, TrainingInProgress
+from query_cache import QueryCache
+from order_store import OrderStore
+from stripe_client import STRIPE_API_URL, StripeClient, StripeError
+from thumbnails import ThumbnailCache, source_version
+import model_registry
+import metrics
+from profiler import Profiler, ProfilerBusy
+from admission import AdmissionPool, Saturated
+import hashlib
+import hmac
 import os
-from PIL import Image
 import subprocess
 
 app = Flask(__name__)
@@ -35,12 +55,159 @@ CORS(app, resources={
     }
 }) 
 # prefer light-weight features file when LIGHT_MODE is enabled
-features_file = os.environ.get('FEATURES_FILE') or ('features_light.pkl' if USE_LIGHT else 'features.pkl')
-features_dict = load_saved_features(features_file)
+configured_features_file = os.environ.get('FEATURES_FILE') or ('features_light.pkl' if USE_LIGHT else 'features.pkl')
+# The loaded index, the file + mtime it came from and the sha256 of each corpus
+# image -> its path in the index (stored in the .fidx next to the vectors, see
+# content_hashes). Replaced as a whole on reload, so a request always sees one
+# consistent snapshot.
+Corpus = namedtuple('Corpus', 'features file mtime hashes')
+
+def load_corpus(path):
+    mtime = os.stat(path).st_mtime_ns  # before loading: a newer file is never missed
+    features = load_saved_features(path)
+    return Corpus(features, path, mtime, content_hashes(path, features))
+
+# use the memory-mapped .fidx next to the pickle when it exists (shared by all workers)
+corpus = load_corpus(resolve_features_file(configured_features_file))
+metrics.INDEX_VECTORS.set(len(corpus.features))
+_reload_lock = threading.Lock()
+
+training_jobs = TrainingJobs()
+# query embeddings by upload hash, ranked result pages by (hash, search params)
+query_cache = QueryCache(on_event=metrics.cache_observer('query'))
+result_cache = QueryCache(on_event=metrics.cache_observer('result'))
+# resized /image variants on disk (bounded, LRU)
+thumbnail_cache = ThumbnailCache()
+# width of the thumbnail_url returned with search results
+THUMB_DEFAULT_WIDTH = int(os.environ.get('THUMB_DEFAULT_WIDTH', '256'))
+# Cache-Control for /image without a version token (with ?v= it is immutable)
+IMAGE_MAX_AGE = int(os.environ.get('IMAGE_MAX_AGE', '3600'))
+IMAGE_IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+# orders + checkout sessions (SQLite; imports orders.json / checkout_sessions.json once)
+order_store = OrderStore()
+
+if not USE_LIGHT and model_registry.PRELOAD_MODEL:
+    # build the model at import time; with `gunicorn --preload` that happens once
+    # in the master and the workers share it (warm-up runs per worker, see gunicorn.conf.py)
+    model_registry.get_model()
+
+# /payment/orders page size (default and maximum)
+ORDERS_PAGE_SIZE = int(os.environ.get('ORDERS_PAGE_SIZE', '50'))
+ORDERS_PAGE_MAX = int(os.environ.get('ORDERS_PAGE_MAX', '200'))
+# JSON bodies at least this big are gzipped for clients that accept it
+GZIP_MIN_SIZE = int(os.environ.get('GZIP_MIN_SIZE', '1024'))
+# bearer token for /admin/* (the admin routes answer 404 while it is unset)
+ADMIN_TOKEN = os.environ.get('ADMIN_TOKEN', '')
+# on-demand cProfile / stack sampling of this worker (/admin/profile)
+profiler = Profiler()
+# decode/extract/score run here, bounded; a full pool answers 503 (admission.py)
+search_pool = AdmissionPool()
+
+class ImageVerificationError(ValueError):
+    pass
+
+def offload(fn, *args, **kwargs):
+    """Run `fn` on search_pool; a request under /admin/profile is profiled there too."""
+    handle = g.get('profile_handle')
+    if handle is not None:
+        fn = profiler.follow(handle, fn)
+    return search_pool.run(fn, *args, **kwargs)
+
+def saturated_response(error):
+    """Fast 503 while the search pool is full; the client retries later."""
+    metrics.ADMISSION_REJECTED.labels(error.reason).inc()
+    response = jsonify({'error': 'Server busy, retry later', 'reason': str(error)})
+    response.headers['Retry-After'] = str(error.retry_after)
+    return response, 503
+
+def not_modified(etag):
+    """304 response when the client's copy is current (If-None-Match).
+
+    No Last-Modified / If-Modified-Since: timestamps here have one-second
+    resolution and don't move on every change, the ETags do.
+    """
+    if not request.if_none_match or not request.if_none_match.contains_weak(etag):
+        return None
+    return add_validators(app.response_class(status=304), etag)
+
+def add_validators(response, etag):
+    # weak: the same ETag is valid for the gzipped and the plain body
+    response.set_etag(etag, weak=True)
+    return response
+
+@app.before_request
+def start_timer():
+    g.request_start = time.perf_counter()
+
+@app.before_request
+def start_profiling():
+    # a single attribute check while no profile is running
+    if profiler.session is not None and request.endpoint != 'admin_profile':
+        g.profile_handle = profiler.begin(request.endpoint)
+
+@app.teardown_request
+def stop_profiling(exc):
+    handle = g.pop('profile_handle', None)
+    if handle is not None:
+        profiler.end(handle)
+
+@app.after_request
+def record_request(response):
+    # registered before gzip_response, so Flask runs it after: gzip time is included
+    start = g.pop('request_start', None)
+    if start is not None:
+        metrics.REQUEST_SECONDS.labels(request.endpoint or 'unmatched', request.method,
+                                       response.status_code).observe(time.perf_counter() - start)
+    return response
+
+@app.after_request
+def gzip_response(response):
+    """gzip large JSON bodies (order listings, search results, status)."""
+    if (response.status_code != 200 or response.direct_passthrough
+            or response.mimetype != 'application/json'
+            or 'Content-Encoding' in response.headers
+            or 'gzip' not in request.headers.get('Accept-Encoding', '')):
+        return response
+    body = response.get_data()
+    if len(body) < GZIP_MIN_SIZE:
+        return response
+    response.set_data(gzip.compress(body, compresslevel=6))
+    response.headers['Content-Encoding'] = 'gzip'
+    response.vary.add('Accept-Encoding')
+    return response
+
+def reload_features_if_changed():
+    """Swap in a rebuilt index (from /train in any worker) once it is on disk.
+
+    Builders replace the feature files atomically, so until the new file lands
+    this keeps serving the old index; the swap itself is a single assignment.
+    Only one thread loads: the others wait for it and then find it done.
+    """
+    global corpus
+    if not _corpus_changed(corpus):
+        return
+    with _reload_lock:
+        if not _corpus_changed(corpus):
+            return  # loaded by another request while this one waited
+        new_corpus = load_corpus(resolve_features_file(configured_features_file))
+        corpus = new_corpus
+        metrics.INDEX_VECTORS.set(len(new_corpus.features))
+        query_cache.invalidate()
+        result_cache.invalidate()
+        print(f"Reloaded {len(new_corpus.features)} features from {new_corpus.file}")
+
+def _corpus_changed(current):
+    path = resolve_features_file(configured_features_file)
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except OSError:
+        return False
+    return path != current.file or mtime != current.mtime
 
 # Stripe configuration
 STRIPE_SECRET_KEY = os.environ.get('STRIPE_SECRET_KEY', '')
-STRIPE_API_URL = "https://api.stripe.com/v1"
+# pooled session with timeouts/retries; STRIPE_API_URL can point at a mock server
+stripe = StripeClient(STRIPE_SECRET_KEY, STRIPE_API_URL, on_request=metrics.stripe_observer)
 
 if not STRIPE_SECRET_KEY:
     print("⚠️  WARNING: STRIPE_SECRET_KEY environment variable not set!")
@@ -53,135 +220,363 @@ def index():
 
 @app.route('/image/<path:filename>')
 def serve_image(filename):
+    """Original image, or a cached JPEG thumbnail with `?w=<width>`.
+
+    `?v=` is the version token from thumbnail_url(); URLs carrying the
+    current one are cached by clients for a year. Only images of the loaded
+    index are served, whatever their name (Firebase blobs may have no
+    extension); nothing else under the app directory is.
+    """
+    source = safe_join(app.root_path, filename)
+    if source is None or filename not in corpus.features or not os.path.isfile(source):
+        return "Image not found", 404
     try:
-        return send_file(filename)
-    except:
+        version = source_version(source)
+        width = request.args.get('w', type=int)
+        if width and width > 0:
+            path, etag = thumbnail_cache.get(source, width)
+        else:
+            path, etag = source, version
+    except Exception:
         return "Image not found", 404
+    immutable = request.args.get('v') == version
+    response = send_file(path, etag=etag, conditional=True,
+                         max_age=IMAGE_IMMUTABLE_MAX_AGE if immutable else IMAGE_MAX_AGE)
+    if immutable:
+        response.cache_control.immutable = True
+    return response
+
+def thumbnail_url(image_path, width=THUMB_DEFAULT_WIDTH):
+    try:
+        version = source_version(os.path.join(app.root_path, image_path))
+    except OSError:
+        version = None
+    return url_for('serve_image', filename=image_path, w=width, v=version)
+
+def with_thumbnails(results):
+    # new dicts: the result lists themselves live in result_cache
+    return [dict(r, thumbnail_url=thumbnail_url(r['image_path'])) for r in results]
+
+def embed_query(data, key, filename, current):
+    """Query embedding for uploaded bytes (cache miss path)."""
+    corpus_path = current.hashes.get(key)
+    if corpus_path is not None and corpus_path in current.features:
+        # byte-identical to a corpus image: reuse its stored vector
+        query_cache.record_corpus_hit()
+        return current.features[corpus_path]
+    # Kiểm tra ảnh (giải mã được nghĩa là ảnh hợp lệ)
+    try:
+        with metrics.stage('decode'):
+            img = decode_image(data)
+    except Exception as e:
+        raise ImageVerificationError(str(e))
+    print(f"Image {filename} verified successfully.")
+    with metrics.stage('extract'):
+        return extract_features_from_array(img)
+
+def search_param(name, cast, default, minimum):
+    """One numeric search parameter from the query string or form; ValueError if invalid."""
+    raw = request.args.get(name, request.form.get(name))
+    if raw in (None, ''):
+        return default
+    value = cast(raw)
+    if not value >= minimum:  # also rejects NaN
+        raise ValueError(f"{name} must be >= {minimum}")
+    return value
+
+def parse_search_params():
+    """threshold / k / offset / limit from the query string or form fields."""
+    # similarities of the (non-negative) feature vectors are never below 0
+    return {
+        'threshold': search_param('threshold', float, 0.6, 0.0),
+        'k': search_param('k', int, None, 1),
+        'offset': search_param('offset', int, 0, 0),
+        'limit': search_param('limit', int, None, 1),
+    }
 
 @app.route('/search', methods=['POST'])
 def search_image():
     try:
         if 'file' not in request.files:
             return jsonify({"error": "No file uploaded"}), 400
+        try:
+            params = parse_search_params()
+        except ValueError as e:
+            return jsonify({"error": f"Invalid search parameter: {str(e)}"}), 400
 
         file = request.files['file']
         print("Received file:", file.filename)  # In ra tên file nhận được
-        file_path = 'temp_image.jpg'
-        file.save(file_path)
+        # Đọc ảnh trực tiếp từ bộ nhớ: giải mã một lần, không ghi temp_image.jpg
+        data = file.read()
+        key = hashlib.sha256(data).hexdigest()
+        # from the start of the request: request.files above already read and
+        # parsed the whole multipart body, which is where slow uploads spend it
+        metrics.observe_stages({'receive': time.perf_counter() - g.request_start})
 
-        # Kiểm tra file đã được lưu không
-        if not os.path.isfile(file_path):
-            return jsonify({"error": "File not saved"}), 500
-
-        # Kiểm tra ảnh
+        # Tìm các ảnh tương đồng (cache theo nội dung file, xem query_cache.py):
+        # embedding theo hash của file, kết quả theo hash + tham số tìm kiếm
+        reload_features_if_changed()
+        current = corpus
         try:
-            img = Image.open(file_path)
-            img.verify()  # Kiểm tra tính hợp lệ của file ảnh
-            print(f"Image {file.filename} verified successfully.")
-        except Exception as e:
+            # chỉ khi cache miss mới chiếm chỗ trong search_pool (giới hạn đồng thời)
+            query_features = query_cache.get_or_compute(
+                key, lambda: offload(embed_query, data, key, file.filename, current))
+        except ImageVerificationError as e:
             return jsonify({"error": f"Image verification failed: {str(e)}"}), 500
-
-        # Tìm các ảnh tương đồng
-        similar_images = find_similar_images(file_path, features_dict)
+        result_key = (key, params['threshold'], params['k'], params['offset'], params['limit'])
+        timings = {}
+        similar_images, total = result_cache.get_or_compute(
+            result_key, lambda: offload(find_similar_page, query_features, current.features,
+                                        timings=timings, **params))
+        # scan/select are only timed on a result cache miss
+        metrics.observe_stages(timings)
 
         # Kiểm tra nếu không tìm thấy ảnh tương tự
-        if similar_images:
-            return jsonify({
-                "similar_images": similar_images  # Trả về toàn bộ danh sách ảnh tương tự
-            })
+        if total:
+            with metrics.stage('serialize'):
+                return jsonify({
+                    "similar_images": with_thumbnails(similar_images),  # trang kết quả (mặc định: toàn bộ danh sách)
+                    "total": total,                    # tổng số ảnh vượt ngưỡng (IVF: chỉ đếm trong các cell đã dò)
+                    "offset": params['offset'],
+                    "limit": params['limit'],
+                    "k": params['k']
+                })
         else:
             return jsonify({"message": "No similar images found"}), 404
-    
+
+    except Saturated as e:
+        return saturated_response(e)
     except Exception as e:
         print("Error occurred:", str(e))  # In ra thông báo lỗi
         return jsonify({"error": str(e)}), 500
 
-@app.route('/train', methods=['POST'])
-def train_features():
-    global features_dict  # Declare at the beginning
+# upper bound on files per /search/batch request
+MAX_BATCH_FILES = int(os.environ.get('MAX_BATCH_FILES', '64'))
+
+def search_uploads(uploads, index, threshold, k):
+    """Matches (or the decode error) per upload; runs on search_pool."""
+    # giải mã từng ảnh; ảnh lỗi được báo riêng, không làm hỏng cả batch
+    out = [None] * len(uploads)
+    images, positions = [], []
+    for i, data in enumerate(uploads):
+        try:
+            images.append(decode_image(data))
+            positions.append(i)
+        except Exception as e:
+            out[i] = e
+    if images:
+        query_features = extract_features_batch(images)
+        for i, similar in zip(positions, find_similar_batch(query_features, index, threshold, k)):
+            out[i] = similar
+    return out
+
+@app.route('/search/batch', methods=['POST'])
+def search_batch():
+    """Find similar images for many uploads in one pass (top-k per query)"""
     try:
-        if USE_LIGHT:
-            # Train light features (color histogram)
-            import subprocess
-            result = subprocess.run(['python', 'build_features_light.py'], 
-                                  capture_output=True, text=True, check=True)
-            
-            # Reload features
-            features_dict = load_saved_features('features_light.pkl')
-            
-            return jsonify({
-                'message': 'Light training completed!', 
-                'mode': 'LIGHT_MODE',
-                'features_count': len(features_dict),
-                'output': result.stdout
-            }), 200
-        else:
-            # Import TensorFlow-based feature extraction only when needed
-            from dactrung import extract_and_save_features
-            
-            # Tải toàn bộ ảnh mới nhất từ Firebase Storage về trước khi train
-            subprocess.run(['python', 'firebase_download.py'], check=True)
-            # Train lại đặc trưng cho toàn bộ ảnh trong data/
-            extract_and_save_features('data/', 'features.pkl')
-            features_dict = load_saved_features('features.pkl')
-            return jsonify({
-                'message': 'TensorFlow training completed!',
-                'mode': 'TENSORFLOW_MODE', 
-                'features_count': len(features_dict)
-            }), 200
+        files = request.files.getlist('files') or request.files.getlist('file')
+        if not files:
+            return jsonify({"error": "No files uploaded"}), 400
+        if len(files) > MAX_BATCH_FILES:
+            return jsonify({"error": f"Too many files (max {MAX_BATCH_FILES})"}), 400
+        try:
+            k = search_param('k', int, 10, 1)
+            threshold = search_param('threshold', float, 0.6, 0.0)
+        except ValueError as e:
+            return jsonify({"error": f"Invalid search parameter: {str(e)}"}), 400
+
+        results = [{"filename": f.filename} for f in files]
+        uploads = [f.read() for f in files]
+        reload_features_if_changed()
+        matches = offload(search_uploads, uploads, corpus.features, threshold, k)
+        for result, match in zip(results, matches):
+            if isinstance(match, Exception):
+                result["error"] = f"Image verification failed: {str(match)}"
+            elif match is not None:
+                result["similar_images"] = with_thumbnails(match)
+
+        return jsonify({"results": results})
+
+    except Saturated as e:
+        return saturated_response(e)
     except Exception as e:
-        return jsonify({'error': str(e), 'mode': 'LIGHT_MODE' if USE_LIGHT else 'TENSORFLOW_MODE'}), 500
+        print("Error occurred:", str(e))
+        return jsonify({"error": str(e)}), 500
+
+def run_light_build(progress):
+    progress('extracting')
+    result = subprocess.run(['python', 'build_features_light.py'],
+                            capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip() or f'build failed ({result.returncode})')
+    progress('reloading')
+    if USE_LIGHT:
+        # the reload already loaded the new index: count it, don't load it again
+        reload_features_if_changed()
+        count = len(corpus.features)
+    else:
+        from feature_index import load_features
+        count = len(load_features('features_light.pkl'))
+    return {
+        'features_count': count,
+        'output': result.stdout
+    }
+
+def run_tensorflow_build(progress):
+    # Import TensorFlow-based feature extraction only when needed
+    from dactrung import ingest_and_save_features
+    from firebase_download import get_bucket
+
+    # Tải ảnh mới/đã thay đổi từ Firebase Storage và trích xuất đặc trưng
+    # cùng lúc (tải -> giải mã -> embed chạy song song, xem ingest_pipeline.py)
+    progress('ingesting')
+    stats = ingest_and_save_features(get_bucket(), 'data/', 'features.pkl')
+    progress('reloading')
+    reload_features_if_changed()
+    return {'features_count': len(corpus.features), 'stats': stats}
+
+def measured_training(kind, target):
+    """`target` plus run count / duration metrics."""
+    def run(progress):
+        start = time.perf_counter()
+        status = 'failed'
+        try:
+            result = target(progress)
+            status = 'succeeded'
+            return result
+        finally:
+            metrics.TRAINING_RUNS.labels(kind, status).inc()
+            metrics.TRAINING_SECONDS.labels(kind).observe(time.perf_counter() - start)
+    return run
+
+def start_training_job(kind, target):
+    """Start a background build; ?wait=1 blocks until it finishes (old behaviour)."""
+    try:
+        job = training_jobs.start(kind, measured_training(kind, target))
+    except TrainingInProgress as e:
+        return jsonify({'error': 'Training already in progress', 'job_id': e.job_id}), 409
+    if request.args.get('wait') in ('1', 'true', 'True'):
+        job = training_jobs.wait(job['job_id'])
+        return jsonify(job), 200 if job['status'] == 'succeeded' else 500
+    job['status_url'] = f"/train/jobs/{job['job_id']}"
+    return jsonify(job), 202
+
+@app.route('/train', methods=['POST'])
+def train_features():
+    """Rebuild features for the current mode in the background"""
+    if USE_LIGHT:
+        # Train light features (color histogram)
+        return start_training_job('LIGHT_MODE', run_light_build)
+    return start_training_job('TENSORFLOW_MODE', run_tensorflow_build)
 
 @app.route('/train/light', methods=['POST'])
 def train_light_features():
     """Force train with light mode (color histogram) regardless of current mode"""
-    try:
-        import subprocess
-        result = subprocess.run(['python', 'build_features_light.py'], 
-                              capture_output=True, text=True, check=True)
-        
-        # Count features
-        import pickle
-        with open('features_light.pkl', 'rb') as f:
-            light_features = pickle.load(f)
-        
-        return jsonify({
-            'message': 'Light features training completed!',
-            'features_count': len(light_features),
-            'output': result.stdout
-        }), 200
-    except Exception as e:
-        return jsonify({'error': str(e)}), 500
+    return start_training_job('LIGHT_MODE', run_light_build)
+
+@app.route('/train/jobs/<job_id>', methods=['GET'])
+def get_training_job(job_id):
+    """Status / progress of a training job started by /train or /train/light"""
+    job = training_jobs.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(job), 200
 
 @app.route('/status', methods=['GET', 'OPTIONS'])
 def get_status():
     """Get current app status and features info"""
     try:
+        reload_features_if_changed()
+        current = corpus
         response_data = {
             'status': 'running',
             'mode': 'LIGHT_MODE' if USE_LIGHT else 'TENSORFLOW_MODE',
-            'features_file': features_file,
-            'features_count': len(features_dict),
-            'sample_images': list(features_dict.keys())[:5] if features_dict else [],
+            'features_file': current.file,
+            'features_count': len(current.features),
+            'index_encoding': getattr(current.features, 'encoding', 'float32'),
+            'query_cache': query_cache.stats(),
+            'result_cache': result_cache.stats(),
+            'thumbnail_cache': thumbnail_cache.stats(),
+            'worker': model_registry.model_stats(),
+            'query_batcher': query_batcher.stats() if query_batcher else None,
+            'search_pool': search_pool.stats(),
+            'sample_images': list(current.features.keys())[:5] if current.features else [],
             'cors_enabled': True,  # Debug info
-            'timestamp': datetime.now().isoformat()
         }
-        
-        response = jsonify(response_data)
+        # the ETag covers everything but the timestamp and the (always moving) RSS
+        stable = dict(response_data, worker={k: v for k, v in response_data['worker'].items()
+                                             if k != 'rss_mb'})
+        etag = hashlib.sha1(json.dumps(stable, sort_keys=True).encode('utf-8')).hexdigest()
+        # ETag only: no single timestamp changes with the cache / job / pool stats
+        response = not_modified(etag)
+        if response is None:
+            response_data['timestamp'] = datetime.now().isoformat()
+            response = add_validators(jsonify(response_data), etag)
         
         # Add explicit CORS headers
         response.headers['Access-Control-Allow-Origin'] = '*'
         response.headers['Access-Control-Allow-Methods'] = 'GET, POST, OPTIONS'
         response.headers['Access-Control-Allow-Headers'] = 'Content-Type, Authorization'
         
-        return response, 200
+        return response
     except Exception as e:
         error_response = jsonify({'error': str(e)})
         error_response.headers['Access-Control-Allow-Origin'] = '*'
         return error_response, 500
 
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    """Prometheus scrape endpoint (all workers when PROMETHEUS_MULTIPROC_DIR is set)."""
+    body, content_type = metrics.render()
+    return app.response_class(body, mimetype=None, content_type=content_type)
+
+# ============ ADMIN APIs ============
+
+def admin_denied():
+    """Error response unless the request carries `Authorization: Bearer <ADMIN_TOKEN>`."""
+    if not ADMIN_TOKEN:
+        return jsonify({'error': 'Not found'}), 404
+    supplied = request.headers.get('Authorization', '').removeprefix('Bearer ').strip()
+    if not hmac.compare_digest(supplied.encode(), ADMIN_TOKEN.encode()):
+        return jsonify({'error': 'Unauthorized'}), 401
+    return None
+
+@app.route('/admin/profile', methods=['GET', 'POST', 'DELETE'])
+def admin_profile():
+    """Profile the next N requests (or a time window) in the worker that answers.
+
+    POST {"mode": "sampling"|"cprofile", "requests": N | "seconds": T,
+    "endpoints": [...]} starts, GET shows status and finished profiles,
+    DELETE stops early. Output goes to PROFILE_DIR (see profiler.py).
+    """
+    denied = admin_denied()
+    if denied is not None:
+        return denied
+    if request.method == 'GET':
+        return jsonify(profiler.status())
+    if request.method == 'DELETE':
+        return jsonify({'stopped': profiler.stop(), **profiler.status()})
+    data = request.get_json(silent=True) or {}
+    try:
+        requests_count = data.get('requests')
+        seconds = data.get('seconds')
+        status = profiler.start(
+            mode=data.get('mode', 'sampling'),
+            requests=int(requests_count) if requests_count is not None else None,
+            seconds=float(seconds) if seconds is not None else None,
+            endpoints=data.get('endpoints'))
+    except ProfilerBusy as e:
+        return jsonify({'error': str(e), **profiler.status()}), 409
+    except (TypeError, ValueError) as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify(status), 202
+
 # ============ PAYMENT APIs ============
 
+def stripe_error_response(message, error):
+    """400 with Stripe's error body as before; 502 when Stripe was unreachable."""
+    return jsonify({'error': message, 'details': error.details}), 400 if error.status_code else 502
+
 @app.route('/payment/create-intent', methods=['POST'])
 def create_payment_intent():
     """Create Stripe Payment Intent"""
@@ -202,24 +597,12 @@ def create_payment_intent():
             "automatic_payment_methods[enabled]": "true"
         }
         
-        headers = {
-            "Authorization": f"Bearer {STRIPE_SECRET_KEY}",
-            "Content-Type": "application/x-www-form-urlencoded",
-        }
-        
-        response = requests.post(
-            f"{STRIPE_API_URL}/payment_intents",
-            data=stripe_data,
-            headers=headers
-        )
-        
-        if response.status_code != 200:
-            return jsonify({
-                'error': 'Failed to create payment intent',
-                'details': response.text
-            }), 400
-            
-        payment_intent = response.json()
+        try:
+            # a client retry with the same Idempotency-Key gets the same intent back
+            payment_intent = stripe.create_payment_intent(
+                stripe_data, request.headers.get('Idempotency-Key'))
+        except StripeError as e:
+            return stripe_error_response('Failed to create payment intent', e)
         
         return jsonify({
             'client_secret': payment_intent['client_secret'],
@@ -246,23 +629,11 @@ def confirm_payment():
         payment_intent_id = data['payment_intent_id']
         order_data = data['order_data']
         
-        # Verify payment with Stripe
-        headers = {
-            "Authorization": f"Bearer {STRIPE_SECRET_KEY}",
-        }
-        
-        stripe_response = requests.get(
-            f"{STRIPE_API_URL}/payment_intents/{payment_intent_id}",
-            headers=headers
-        )
-        
-        if stripe_response.status_code != 200:
-            return jsonify({
-                'error': 'Failed to verify payment',
-                'details': stripe_response.text
-            }), 400
-            
-        payment_intent = stripe_response.json()
+        # Verify payment with Stripe (succeeded intents are cached, no network on repeats)
+        try:
+            payment_intent = stripe.retrieve_payment_intent(payment_intent_id)
+        except StripeError as e:
+            return stripe_error_response('Failed to verify payment', e)
         
         # Check if payment is successful
         if payment_intent['status'] != 'succeeded':
@@ -289,21 +660,8 @@ def confirm_payment():
             'metadata': order_data.get('metadata', {})
         }
         
-        # Save order to file (you can replace this with database storage)
-        orders_file = 'orders.json'
-        orders = []
-        
-        if os.path.exists(orders_file):
-            try:
-                with open(orders_file, 'r', encoding='utf-8') as f:
-                    orders = json.load(f)
-            except:
-                orders = []
-        
-        orders.append(order_record)
-        
-        with open(orders_file, 'w', encoding='utf-8') as f:
-            json.dump(orders, f, indent=2, ensure_ascii=False)
+        # Save order (one indexed row, safe with concurrent confirms)
+        order_store.add_order(order_record)
         
         return jsonify({
             'success': True,
@@ -395,24 +753,11 @@ def create_checkout_session():
         for key, value in metadata.items():
             checkout_data[f"metadata[{key}]"] = str(value)
         
-        headers = {
-            "Authorization": f"Bearer {STRIPE_SECRET_KEY}",
-            "Content-Type": "application/x-www-form-urlencoded",
-        }
-        
-        response = requests.post(
-            f"{STRIPE_API_URL}/checkout/sessions",
-            data=checkout_data,
-            headers=headers
-        )
-        
-        if response.status_code != 200:
-            return jsonify({
-                'error': 'Failed to create checkout session',
-                'details': response.text
-            }), 400
-            
-        session = response.json()
+        try:
+            session = stripe.create_checkout_session(
+                checkout_data, request.headers.get('Idempotency-Key'))
+        except StripeError as e:
+            return stripe_error_response('Failed to create checkout session', e)
         
         # Save session info for later reference
         session_record = {
@@ -425,21 +770,8 @@ def create_checkout_session():
             'metadata': metadata
         }
         
-        # Save to sessions file
-        sessions_file = 'checkout_sessions.json'
-        sessions = []
-        
-        if os.path.exists(sessions_file):
-            try:
-                with open(sessions_file, 'r', encoding='utf-8') as f:
-                    sessions = json.load(f)
-            except:
-                sessions = []
-        
-        sessions.append(session_record)
-        
-        with open(sessions_file, 'w', encoding='utf-8') as f:
-            json.dump(sessions, f, indent=2, ensure_ascii=False)
+        # Save session
+        order_store.add_session(session_record)
         
         return jsonify({
             'checkout_url': session['url'],
@@ -451,22 +783,29 @@ def create_checkout_session():
 
 @app.route('/payment/orders', methods=['GET'])
 def get_orders():
-    """Get all orders"""
+    """Get orders, oldest first, one page at a time (`?limit=` and `?cursor=`)"""
     try:
-        orders_file = 'orders.json'
-        
-        if not os.path.exists(orders_file):
-            return jsonify({'orders': []}), 200
-            
-        with open(orders_file, 'r', encoding='utf-8') as f:
-            orders = json.load(f)
-            
-        # Optional: filter by email or user
+        # Optional: filter by email or user (indexed)
         email = request.args.get('email')
-        if email:
-            orders = [order for order in orders if order.get('customer_info', {}).get('email') == email]
-            
-        return jsonify({'orders': orders}), 200
+        cursor = request.args.get('cursor') or None
+        try:
+            limit = int(request.args.get('limit', ORDERS_PAGE_SIZE))
+            if cursor is not None:
+                int(cursor)
+        except ValueError:
+            return jsonify({'error': 'limit and cursor must be integers'}), 400
+        limit = max(1, min(limit, ORDERS_PAGE_MAX))
+
+        # orders are append-only, so (count, last position) identifies the listing
+        count, last = order_store.listing_version(email)
+        etag = hashlib.sha1(f'{count}:{last}:{email}:{cursor}:{limit}'.encode('utf-8')).hexdigest()
+        response = not_modified(etag)
+        if response is not None:
+            return response
+
+        orders, next_cursor = order_store.list_page(email, cursor, limit)
+        response = jsonify({'orders': orders, 'next_cursor': next_cursor, 'limit': limit})
+        return add_validators(response, etag), 200
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -475,15 +814,7 @@ def get_orders():
 def get_order(order_id):
     """Get specific order by ID"""
     try:
-        orders_file = 'orders.json'
-        
-        if not os.path.exists(orders_file):
-            return jsonify({'error': 'Order not found'}), 404
-            
-        with open(orders_file, 'r', encoding='utf-8') as f:
-            orders = json.load(f)
-            
-        order = next((o for o in orders if o['order_id'] == order_id), None)
+        order = order_store.get_order(order_id)
         
         if not order:
             return jsonify({'error': 'Order not found'}), 404
@@ -494,4 +825,7 @@ def get_order(order_id):
         return jsonify({'error': str(e)}), 500
 
 if __name__ == '__main__':
+    if not USE_LIGHT:
+        model_registry.warm_up()
+    model_registry.mark_ready()
     app.run(host='0.0.0.0', port=5000, debug=True)
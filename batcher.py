@@ -0,0 +1,94 @@
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+# Concurrent queries are run through the model together: a batch is sent as
+# soon as MICROBATCH_MAX_SIZE items are queued or the oldest one has waited
+# MICROBATCH_WAIT_MS. MICROBATCH_MAX_SIZE=1 turns batching off.
+MICROBATCH_MAX_SIZE = int(os.environ.get('MICROBATCH_MAX_SIZE', '16'))
+MICROBATCH_WAIT_MS = float(os.environ.get('MICROBATCH_WAIT_MS', '5'))
+
+
+class MicroBatcher:
+    """Collects single items from many threads and calls `fn` on whole batches.
+
+    `fn(items)` must return one result per item, in order. Each caller of
+    `batcher(item)` blocks until its own result is ready; an exception raised
+    by `fn` is re-raised in every caller of that batch.
+    """
+
+    def __init__(self, fn, max_batch=MICROBATCH_MAX_SIZE, max_wait_ms=MICROBATCH_WAIT_MS):
+        self.fn = fn
+        self.max_batch = max(1, max_batch)
+        self.max_wait = max(0.0, max_wait_ms) / 1000
+        self.batches = 0
+        self.items = 0
+        self.largest = 0
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+
+    def __call__(self, item):
+        if self.max_batch == 1:
+            return self._run([item])[0]
+        return self.submit(item).result()
+
+    def submit(self, item):
+        future = Future()
+        self._ensure_thread()
+        self._queue.put((item, future))
+        return future
+
+    def _ensure_thread(self):
+        # started lazily, and again in a forked gunicorn worker (threads don't survive fork)
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is None or self._pid != os.getpid():
+                self._queue = queue.Queue()
+                self._pid = os.getpid()
+                self._thread = threading.Thread(target=self._loop, name='micro-batcher', daemon=True)
+                self._thread.start()
+
+    def _loop(self):
+        q = self._queue
+        while True:
+            batch = [q.get()]
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                try:
+                    batch.append(q.get(timeout=remaining) if remaining > 0 else q.get_nowait())
+                except queue.Empty:
+                    break
+            futures = [f for _, f in batch]
+            try:
+                results = self._run([item for item, _ in batch])
+            except BaseException as e:
+                for f in futures:
+                    f.set_exception(e)
+                continue
+            for f, result in zip(futures, results):
+                f.set_result(result)
+
+    def _run(self, items):
+        results = self.fn(items)
+        with self._lock:
+            self.batches += 1
+            self.items += len(items)
+            self.largest = max(self.largest, len(items))
+        return results
+
+    def stats(self):
+        with self._lock:
+            return {
+                'max_batch': self.max_batch,
+                'max_wait_ms': self.max_wait * 1000,
+                'batches': self.batches,
+                'items': self.items,
+                'largest_batch': self.largest,
+                'mean_batch': round(self.items / self.batches, 2) if self.batches else 0,
+            }
@@ -0,0 +1,247 @@
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+# Micro-benchmarks for extraction, builds, index load and search.
+#   python benchmark.py                      # full run -> bench_results.json
+#   python benchmark.py --quick              # 1k/10k vectors only
+#   python benchmark.py --baseline bench_baseline.json [--fail-on-regression]
+#   python benchmark.py --save-baseline      # store this run as the baseline
+# Results are flat {metric: value}; metrics ending in _per_sec are better when
+# higher, everything else (seconds, ms, MB) when lower.
+
+SIZES = (1000, 10000, 100000, 1000000)
+QUICK_SIZES = (1000, 10000)
+DIMS = (512, 2048)
+RESULTS_FILE = 'bench_results.json'
+BASELINE_FILE = 'bench_baseline.json'
+
+
+def percentiles(samples_ms):
+    p50, p95, p99 = np.percentile(samples_ms, [50, 95, 99])
+    return {'p50_ms': round(float(p50), 3), 'p95_ms': round(float(p95), 3),
+            'p99_ms': round(float(p99), 3)}
+
+
+def peak_rss_mb():
+    # ru_maxrss is KB on Linux, bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024 * 1024) if sys.platform == 'darwin' else rss / 1024
+
+
+# ---- synthetic corpora ----
+
+def write_synthetic_index(index_file, n, dim, seed=0, chunk=65536):
+    """Random unit vectors written straight to a .fidx (built in chunks on disk)."""
+    from feature_index import FeatureIndex, l2_normalize, save_index
+    rng = np.random.default_rng(seed)
+    raw_file = index_file + '.raw'
+    matrix = np.memmap(raw_file, dtype=np.float32, mode='w+', shape=(n, dim))
+    for start in range(0, n, chunk):
+        stop = min(n, start + chunk)
+        matrix[start:stop] = l2_normalize(rng.standard_normal((stop - start, dim), dtype=np.float32))
+    matrix.flush()
+    index = FeatureIndex([f'data/synthetic_{i}.jpg' for i in range(n)], matrix)
+    start = time.perf_counter()
+    save_index(index, index_file, encoding='float32')
+    elapsed = time.perf_counter() - start
+    del index, matrix
+    os.remove(raw_file)
+    return elapsed
+
+
+def _search_worker(index_file, n_queries, seed, out):
+    # runs in a fresh process so load time and peak RSS belong to this corpus only
+    from feature_index import load_features
+    from result_light import find_similar_to_features
+    start = time.perf_counter()
+    index = load_features(index_file)
+    load_s = time.perf_counter() - start
+    rng = np.random.default_rng(seed)
+    rows = rng.choice(len(index), n_queries)
+    # a corpus row plus noise: realistic "near duplicate" queries with a few matches
+    queries = [index[index.paths[r]] + 0.05 * rng.standard_normal(index.dim, dtype=np.float32)
+               for r in rows]
+    find_similar_to_features(queries[0], index)  # fault the pages in
+    samples = []
+    for q in queries:
+        t = time.perf_counter()
+        find_similar_to_features(q, index, threshold=0.6)
+        samples.append((time.perf_counter() - t) * 1000)
+    out.put(dict(percentiles(samples), load_s=round(load_s, 4), peak_rss_mb=round(peak_rss_mb(), 1)))
+
+
+def bench_search(work_dir, n, dim, n_queries=200, seed=0):
+    index_file = os.path.join(work_dir, f'synthetic_{n}_{dim}.fidx')
+    write_s = write_synthetic_index(index_file, n, dim, seed)
+    ctx = multiprocessing.get_context('spawn')
+    out = ctx.Queue()
+    proc = ctx.Process(target=_search_worker, args=(index_file, n_queries, seed, out))
+    proc.start()
+    result = out.get()
+    proc.join()
+    os.remove(index_file)
+    result['index_write_s'] = round(write_s, 4)
+    return result
+
+
+# ---- extraction and builds on generated images ----
+
+def write_images(folder, count, size=(640, 480), seed=0, name='img_{:05d}.jpg'):
+    """`count` photo-like images in `folder` (format from `name`'s extension); their paths."""
+    import cv2
+    rng = np.random.default_rng(seed)
+    os.makedirs(folder, exist_ok=True)
+    paths = []
+    for i in range(count):
+        # smooth gradients + noise so JPEG sizes resemble photos, not pure noise
+        base = rng.integers(0, 255, (6, 8, 3), dtype=np.uint8)
+        img = cv2.resize(base, size, interpolation=cv2.INTER_CUBIC)
+        img = cv2.add(img, rng.integers(0, 20, img.shape, dtype=np.uint8))
+        path = os.path.join(folder, name.format(i))
+        cv2.imwrite(path, img)
+        paths.append(path)
+    return paths
+
+
+def load_extractors():
+    """{name: (extract_batch(paths), extractor_id)} for the extractors available here."""
+    from build_features_light import extract_batch as light_batch
+    from result_light import EXTRACTOR_ID as LIGHT_ID
+    extractors = {'light': (lambda paths: light_batch(paths, workers=1), LIGHT_ID)}
+    try:
+        import dactrung
+        extractors['tf'] = (dactrung.extract_batch, dactrung.EXTRACTOR_ID)
+    except ImportError as e:
+        print(f"TensorFlow extractor skipped: {e}")
+    return extractors
+
+
+def bench_extract_and_build(work_dir, n_images, changed_fraction=0.05):
+    from feature_manifest import update_features
+    data_dir = os.path.join(work_dir, 'images')
+    paths = write_images(data_dir, n_images)
+    results = {}
+    for name, (extract_batch, extractor_id) in load_extractors().items():
+        extract_batch(paths[:2])  # warm up (model load, imports)
+        start = time.perf_counter()
+        extract_batch(paths)
+        results[f'extract.{name}.images_per_sec'] = round(n_images / (time.perf_counter() - start), 2)
+
+        output = os.path.join(work_dir, f'features_{name}.pkl')
+        start = time.perf_counter()
+        update_features(data_dir, output, extract_batch, extractor_id, full=True)
+        results[f'build.{name}.full_s'] = round(time.perf_counter() - start, 3)
+
+        changed = paths[:max(1, int(n_images * changed_fraction))]
+        write_images_over(changed)
+        start = time.perf_counter()
+        update_features(data_dir, output, extract_batch, extractor_id)
+        results[f'build.{name}.incremental_s'] = round(time.perf_counter() - start, 3)
+    return results
+
+
+def write_images_over(paths):
+    import cv2
+    for path in paths:
+        img = cv2.imread(path)
+        cv2.imwrite(path, 255 - img)
+
+
+# ---- baseline comparison ----
+
+def compare(results, baseline, tolerance):
+    """[(metric, baseline, current, change)] for metrics worse than `tolerance`."""
+    regressions = []
+    for metric, old in sorted(baseline.items()):
+        new = results.get(metric)
+        if not isinstance(new, (int, float)) or not isinstance(old, (int, float)) or old <= 0:
+            continue
+        change = new / old - 1
+        worse = change < -tolerance if metric.endswith('_per_sec') else change > tolerance
+        if worse:
+            regressions.append((metric, old, new, change))
+    return regressions
+
+
+def run(sizes, dims, n_queries, n_images, max_gb, work_dir):
+    results = {}
+    results.update(bench_extract_and_build(work_dir, n_images))
+    for dim in dims:
+        for n in sizes:
+            gb = n * dim * 4 / 1e9
+            if gb > max_gb:
+                print(f"skip n={n} d={dim}: {gb:.1f} GB > --max-gb {max_gb}")
+                continue
+            res = bench_search(work_dir, n, dim, n_queries)
+            print(f"n={n:<8} d={dim:<5} load {res['load_s'] * 1000:.1f} ms, "
+                  f"search p50 {res['p50_ms']:.2f} / p95 {res['p95_ms']:.2f} / p99 {res['p99_ms']:.2f} ms, "
+                  f"peak RSS {res['peak_rss_mb']} MB")
+            for key, value in res.items():
+                results[f'search.n={n}.d={dim}.{key}'] = value
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Extraction / build / search benchmarks')
+    parser.add_argument('--sizes', default=None, help='comma separated corpus sizes')
+    parser.add_argument('--dims', default=','.join(map(str, DIMS)))
+    parser.add_argument('--quick', action='store_true', help=f'sizes {QUICK_SIZES} only')
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--images', type=int, default=200, help='generated images for extract/build')
+    parser.add_argument('--max-gb', type=float, default=4.0, help='skip corpora with bigger matrices')
+    parser.add_argument('--out', default=RESULTS_FILE)
+    parser.add_argument('--baseline', default=None, help=f'compare against this file (e.g. {BASELINE_FILE})')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='allowed relative change')
+    parser.add_argument('--fail-on-regression', action='store_true')
+    parser.add_argument('--save-baseline', action='store_true', help=f'also write {BASELINE_FILE}')
+    args = parser.parse_args()
+
+    sizes = [int(s) for s in args.sizes.split(',')] if args.sizes else (QUICK_SIZES if args.quick else SIZES)
+    dims = [int(d) for d in args.dims.split(',')]
+    work_dir = tempfile.mkdtemp(prefix='petbench-')
+    try:
+        results = run(sizes, dims, args.queries, args.images, args.max_gb, work_dir)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    report = {
+        'meta': {
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+        },
+        'results': results,
+    }
+    with open(args.out, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+    print(f"wrote {len(results)} metrics -> {args.out}")
+    if args.save_baseline:
+        shutil.copyfile(args.out, BASELINE_FILE)
+        print(f"baseline saved -> {BASELINE_FILE}")
+
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)['results']
+        regressions = compare(results, baseline, args.tolerance)
+        for metric, old, new, change in regressions:
+            print(f"REGRESSION {metric}: {old} -> {new} ({change:+.0%})")
+        if not regressions:
+            print(f"no regressions beyond {args.tolerance:.0%} vs {args.baseline}")
+        elif args.fail_on_regression:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,20 +1,55 @@
+import argparse
 import os
-import pickle
-from result_light import extract_features
+from concurrent.futures import ProcessPoolExecutor
+from result_light import extract_features, EXTRACTOR_ID
+from feature_index import index_path_for
+from feature_manifest import update_features
 
 DATA_DIR = 'data'
 OUT_FILE = 'features_light.pkl'
 
-features = {}
-for root, _, files in os.walk(DATA_DIR):
-    for fname in files:
-        path = os.path.join(root, fname)
-        try:
-            features[path] = extract_features(path)
-        except Exception as e:
-            print('skip', path, '->', e)
+# parallel build settings (overridable with --workers / --chunksize)
+WORKERS = int(os.environ.get('BUILD_WORKERS', os.cpu_count() or 1))
+CHUNKSIZE = int(os.environ.get('BUILD_CHUNKSIZE', '16'))
 
-with open(OUT_FILE, 'wb') as f:
-    pickle.dump(features, f)
+def _init_worker():
+    # one OpenCV thread per process, the pool already uses every core
+    import cv2
+    cv2.setNumThreads(1)
 
-print(f'built {len(features)} features -> {OUT_FILE}')
+def _extract_one(path):
+    try:
+        return path, extract_features(path), None
+    except Exception as e:
+        return path, None, e
+
+def extract_batch(paths, workers=1, chunksize=CHUNKSIZE):
+    if workers > 1 and len(paths) > 1:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as pool:
+            # map() yields in submission order, so the result is deterministic
+            results = list(pool.map(_extract_one, paths, chunksize=max(1, chunksize)))
+    else:
+        results = map(_extract_one, paths)
+    features = {}
+    for path, feat, error in results:
+        if error is not None:
+            print('skip', path, '->', error)
+        else:
+            features[path] = feat
+    return features
+
+# Incremental by default: only new/changed files are extracted (see the
+# .manifest.json next to OUT_FILE). Pass --full to re-extract everything.
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Build light (HSV histogram) features')
+    parser.add_argument('--full', action='store_true', help='re-extract every image')
+    parser.add_argument('--workers', type=int, default=WORKERS, help='extraction processes (1 = serial)')
+    parser.add_argument('--chunksize', type=int, default=CHUNKSIZE, help='files handed to a worker at a time')
+    args = parser.parse_args()
+
+    stats = update_features(DATA_DIR, OUT_FILE,
+                            lambda paths: extract_batch(paths, args.workers, args.chunksize),
+                            EXTRACTOR_ID, full=args.full)
+    print(f"built {stats['total']} features -> {OUT_FILE} (+ {index_path_for(OUT_FILE)})")
+    print(f"extracted {stats['extracted']}, reused {stats['reused']}, "
+          f"removed {stats['removed']}, failed {stats['failed']}")
@@ -0,0 +1,10 @@
+import pytest
+
+from benchmark import write_images
+
+
+@pytest.fixture(scope='session')
+def image_files():
+    """benchmark.write_images(folder, count, size=(640, 480), seed=0, name='img_{:05d}.jpg'),
+    the one generator of photo-like test images; returns their paths."""
+    return write_images
@@ -1,43 +1,103 @@
 import os
 import numpy as np
 from keras.preprocessing import image
-from tensorflow.keras.applications.resnet50 import ResNet50, preprocess_input
-import pickle
+from tensorflow.keras.applications.resnet50 import preprocess_input
+from feature_manifest import update_features
+from model_registry import get_model
+from image_decode import REDUCED_DECODE, pil_load
 import sys
 import io
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 # Set the default encoding to UTF-8
 sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8')
 
-# Load the pre-trained ResNet50 model
-model = ResNet50(weights='imagenet', include_top=False, pooling='avg')
+# bump when extraction changes so incremental builds re-extract everything
+EXTRACTOR_ID = 'resnet50-imagenet-avg-draft-v1' if REDUCED_DECODE else 'resnet50-imagenet-avg-v1'
+
+# batch pipeline settings
+BATCH_SIZE = int(os.environ.get('EMBED_BATCH_SIZE', '32'))
+DECODE_WORKERS = int(os.environ.get('DECODE_WORKERS', os.cpu_count() or 4))
+
+# Decode + resize one file into a 224x224x3 float array (runs in the decode pool)
+def load_image_array(img_path):
+    # JPEGs are DCT-scaled while decoding (image_decode.pil_load), then resized like load_img
+    return image.img_to_array(pil_load(img_path))
 
 # Function to extract features from an image using the pre-trained model
 def extract_features(img_path):
-    img = image.load_img(img_path, target_size=(224, 224))
-    img_array = image.img_to_array(img)
+    img_array = load_image_array(img_path)
     img_array = np.expand_dims(img_array, axis=0)
     img_array = preprocess_input(img_array)
     
-    features = model.predict(img_array)
+    features = get_model().predict(img_array, verbose=0)
     return features.flatten()
 
-# Extract and save features of the entire dataset
-def extract_and_save_features(dataset_dir, output_file):
+# preprocess_input + one predict call for a list of decoded 224x224x3 arrays
+def embed_arrays(arrays):
+    batch = preprocess_input(np.stack(arrays))
+    return get_model().predict(batch, batch_size=len(arrays), verbose=0)
+
+def _try_load(img_path):
+    try:
+        return load_image_array(img_path)
+    except Exception as e:
+        return e
+
+# Streaming batch pipeline: a thread pool decodes/resizes the next batch while
+# the model runs on the current one; preprocess_input + predict work per batch.
+def extract_batch(paths, batch_size=BATCH_SIZE, decode_workers=DECODE_WORKERS):
     features_dict = {}
-    
-    for root, _, files in os.walk(dataset_dir):
-        for file in files:
-            img_path = os.path.join(root, file)
-            try:
-                features = extract_features(img_path)
-                features_dict[img_path] = features
-            except Exception as e:
-                print(f"Error processing {img_path}: {e}")
-    
-    # Save the features to a file
-    with open(output_file, 'wb') as f:
-        pickle.dump(features_dict, f)
+    if not paths:
+        return features_dict
+    start = time.perf_counter()
+
+    def decode(batch_paths):
+        arrays, ok_paths = [], []
+        for img_path, result in zip(batch_paths, pool.map(_try_load, batch_paths)):
+            if isinstance(result, Exception):
+                print(f"Error processing {img_path}: {result}")
+            else:
+                arrays.append(result)
+                ok_paths.append(img_path)
+        return ok_paths, arrays
+
+    batches = [paths[i:i + batch_size] for i in range(0, len(paths), batch_size)]
+    with ThreadPoolExecutor(max_workers=decode_workers) as pool, \
+            ThreadPoolExecutor(max_workers=1) as prefetch:
+        pending = prefetch.submit(decode, batches[0])
+        for i in range(len(batches)):
+            ok_paths, arrays = pending.result()
+            if i + 1 < len(batches):
+                pending = prefetch.submit(decode, batches[i + 1])
+            if not arrays:
+                continue
+            features = embed_arrays(arrays)
+            for img_path, feat in zip(ok_paths, features):
+                features_dict[img_path] = feat.flatten()
+
+    elapsed = time.perf_counter() - start
+    print(f"embedded {len(features_dict)} images in {elapsed:.1f}s "
+          f"({len(features_dict) / max(elapsed, 1e-9):.1f} images/sec, batch_size={batch_size})")
+    return features_dict
+
+# Extract and save features of the dataset. Chỉ trích xuất ảnh mới/đã thay đổi
+# (dựa trên manifest cạnh output_file); full=True để trích xuất lại toàn bộ.
+def extract_and_save_features(dataset_dir, output_file, full=False, batch_size=BATCH_SIZE):
+    stats = update_features(dataset_dir, output_file,
+                            lambda paths: extract_batch(paths, batch_size=batch_size),
+                            EXTRACTOR_ID, full=full)
+    print(f"extracted {stats['extracted']}, reused {stats['reused']}, "
+          f"removed {stats['removed']}, failed {stats['failed']} -> {output_file}")
+    return stats
+
+# Đồng bộ ảnh từ bucket và trích xuất đặc trưng cùng lúc: ảnh được giải mã và
+# embed ngay khi tải xong (ingest_pipeline.py) thay vì chờ tải hết mới train.
+def ingest_and_save_features(bucket, dataset_dir, output_file, full=False, batch_size=BATCH_SIZE):
+    from ingest_pipeline import ingest
+    return ingest(bucket, dataset_dir, output_file, load_image_array, embed_arrays,
+                  EXTRACTOR_ID, full=full, batch_size=batch_size)
 
 # Path to the dataset directory
 # Đổi thành 'data/' để đồng bộ với script download
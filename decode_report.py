@@ -0,0 +1,100 @@
+import argparse
+import os
+import time
+
+import numpy as np
+
+from feature_index import FeatureIndex
+from image_decode import cv2_decode, pil_load
+
+# Compare full vs reduced-scale decoding on a dataset:
+#   python decode_report.py [data] [--mode light|tf] [--k 10]
+# prints decode+extract time per image and how much the rankings move.
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.webp', '.bmp')
+
+
+def list_images(dataset_dir):
+    paths = []
+    for root, _, files in os.walk(dataset_dir):
+        paths += [os.path.join(root, f) for f in files if f.lower().endswith(IMAGE_EXTENSIONS)]
+    return sorted(paths)
+
+
+def light_extractor(reduced):
+    from result_light import extract_features_from_array
+
+    def extract(path):
+        img = cv2_decode(path, reduced=reduced)
+        if img is None:
+            raise ValueError(f"Cannot read image: {path}")
+        return extract_features_from_array(img)
+    return extract
+
+
+def tf_extractor(reduced):
+    from keras.preprocessing import image
+    from result import extract_features_batch
+
+    def extract(path):
+        return extract_features_batch([image.img_to_array(pil_load(path, reduced=reduced))])[0]
+    return extract
+
+
+def extract_all(paths, extract, repeat):
+    features, best = {}, []
+    for path in paths:
+        times = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            try:
+                vector = extract(path)
+            except Exception as e:
+                print(f"skip {path} -> {e}")
+                break
+            times.append(time.perf_counter() - start)
+        else:
+            features[path] = vector
+            best.append(min(times))
+    return features, best
+
+
+def compare_rankings(full, reduced, k):
+    """Mean overlap@k and top-1 agreement (self excluded), plus vector drift."""
+    paths = [p for p in full.paths if p in reduced]
+    overlaps, top1, drift = [], [], []
+    for path in paths:
+        a = [r['image_path'] for r in full.search(full[path], -1.0, k + 1) if r['image_path'] != path][:k]
+        b = [r['image_path'] for r in reduced.search(reduced[path], -1.0, k + 1) if r['image_path'] != path][:k]
+        if a:
+            overlaps.append(len(set(a) & set(b)) / len(a))
+            top1.append(a[0] == b[0])
+        drift.append(float(full[path] @ reduced[path]))
+    return np.mean(overlaps), np.mean(top1), np.mean(drift), np.min(drift)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Full vs reduced-scale decoding report')
+    parser.add_argument('dataset_dir', nargs='?', default='data')
+    parser.add_argument('--mode', choices=('light', 'tf'), default='light')
+    parser.add_argument('--k', type=int, default=10)
+    parser.add_argument('--repeat', type=int, default=3, help='timing runs per image (best is kept)')
+    args = parser.parse_args()
+
+    make = light_extractor if args.mode == 'light' else tf_extractor
+    paths = list_images(args.dataset_dir)
+    full, full_times = extract_all(paths, make(False), args.repeat)
+    reduced, reduced_times = extract_all(paths, make(True), args.repeat)
+    full_ms, reduced_ms = np.mean(full_times) * 1000, np.mean(reduced_times) * 1000
+    overlap, top1, drift, worst = compare_rankings(
+        FeatureIndex.from_dict(full), FeatureIndex.from_dict(reduced), args.k)
+
+    print(f"{len(full)} images in {args.dataset_dir} ({args.mode} mode)")
+    print(f"decode+extract: full {full_ms:.2f} ms/img, reduced {reduced_ms:.2f} ms/img "
+          f"-> {full_ms / reduced_ms:.2f}x faster")
+    print(f"ranking: overlap@{args.k} {overlap:.3f}, top-1 agreement {top1:.3f}")
+    print(f"same-image cosine full vs reduced: mean {drift:.4f}, min {worst:.4f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -20,7 +20,7 @@ try {
 Write-Host "`n🚀 Test 2: Train (Current Mode)" -ForegroundColor Green
 try {
     Write-Host "Training... (this may take 30-60 seconds)" -ForegroundColor Yellow
-    $train = Invoke-RestMethod -Uri "$BaseUrl/train" -Method POST -TimeoutSec 120
+    $train = Invoke-RestMethod -Uri "$BaseUrl/train?wait=1" -Method POST -TimeoutSec 120
     Write-Host "✅ Training Response:" -ForegroundColor Green
     $train | ConvertTo-Json -Depth 3 | Write-Host
 } catch {
@@ -34,7 +34,7 @@ try {
 Write-Host "`n⚡ Test 3: Force Light Training" -ForegroundColor Green
 try {
     Write-Host "Light training... (faster, 10-30 seconds)" -ForegroundColor Yellow
-    $lightTrain = Invoke-RestMethod -Uri "$BaseUrl/train/light" -Method POST -TimeoutSec 60
+    $lightTrain = Invoke-RestMethod -Uri "$BaseUrl/train/light?wait=1" -Method POST -TimeoutSec 60
     Write-Host "✅ Light Training Response:" -ForegroundColor Green
     $lightTrain | ConvertTo-Json -Depth 3 | Write-Host
 } catch {
@@ -56,5 +56,6 @@ Write-Host "`nAvailable Endpoints:" -ForegroundColor Yellow
 Write-Host "  GET  /status           - Get app status and features info"
 Write-Host "  POST /train            - Train with current mode (LIGHT/TensorFlow)"  
 Write-Host "  POST /train/light      - Force train light features (color histogram)"
+Write-Host "  GET  /train/jobs/<id>  - Training job status (add ?wait=1 to /train to block)"
 Write-Host "  POST /search           - Search similar images (with file upload)"
 Write-Host "  GET  /                 - Beautiful homepage"
@@ -0,0 +1,370 @@
+import json
+import os
+import pickle
+import struct
+import time
+
+import numpy as np
+
+from ann_index import ANN_MIN_SIZE, IVF_NPROBE, SEARCH_BACKEND, ann_path_for, attach_ann, build_ann
+from quantization import INDEX_ENCODING, CODECS, make_codec
+
+# On-disk index layout (little endian):
+#   magic | uint32 header length | JSON header | path table [| hash table]
+#   | pad | vector block [| pad | codec parameter blocks]
+# The vector block is a raw row-major matrix aligned to INDEX_ALIGN bytes so it
+# can be memory-mapped; every worker then shares the same page-cache pages.
+# Version 2 adds `encoding` (float32/float16/int8/pq, see quantization.py) and
+# the `blocks` table for codec parameters; version 1 files are plain float32.
+# The optional hash table holds the sha256 of each image's bytes, in path
+# order, so the content hashes are swapped in together with the vectors.
+INDEX_MAGIC = b'PETFIDX\x00'
+INDEX_VERSION = 2
+INDEX_ALIGN = 64
+INDEX_SUFFIX = '.fidx'
+
+
+def l2_normalize(vectors):
+    """Return float32 rows scaled to unit length (zero rows stay zero)."""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+class FeatureIndex:
+    """Read-only path -> feature index backed by one contiguous matrix.
+
+    Rows are L2-normalized float32 at load time, so cosine similarity against
+    the whole corpus is a single matrix-vector product. The class also answers
+    the small part of the dict API the app relies on (len, keys, items, []).
+    With a `codec` the matrix holds compressed codes instead and scoring runs
+    on the codes directly (see quantization.py).
+    """
+
+    def __init__(self, paths, matrix, codec=None, dim=None):
+        self.paths = list(paths)
+        self.matrix = matrix
+        self.codec = codec
+        self._dim = dim
+        self._positions = None
+        # sha256 per row (same order as paths, '' if unknown); None if not stored
+        self.hashes = None
+        # optional IVF (see ann_index.py); None means exact search
+        self.ann = None
+        self.nprobe = IVF_NPROBE
+
+    @classmethod
+    def from_dict(cls, features_dict):
+        paths = list(features_dict.keys())
+        if not paths:
+            return cls([], np.zeros((0, 0), dtype=np.float32))
+        matrix = np.stack([np.asarray(features_dict[p]).ravel() for p in paths])
+        return cls(paths, np.ascontiguousarray(l2_normalize(matrix)))
+
+    @classmethod
+    def coerce(cls, features):
+        if isinstance(features, cls):
+            return features
+        return cls.from_dict(features)
+
+    @property
+    def dim(self):
+        if self._dim is not None:
+            return self._dim
+        return self.matrix.shape[1] if self.paths else 0
+
+    @property
+    def encoding(self):
+        return self.codec.name if self.codec is not None else 'float32'
+
+    def __len__(self):
+        return len(self.paths)
+
+    def __iter__(self):
+        return iter(self.paths)
+
+    def __contains__(self, path):
+        return path in self.positions
+
+    def __getitem__(self, path):
+        return self._decode(self.matrix[self.positions[path]])
+
+    def vectors(self):
+        """All rows as float32 (decoded when the index is compressed)."""
+        if not self.paths:
+            return np.zeros((0, 0), dtype=np.float32)
+        return self._decode(np.asarray(self.matrix))
+
+    def _decode(self, rows):
+        return rows if self.codec is None else self.codec.decode(rows)
+
+    def _score_rows(self, rows, q):
+        return rows @ q if self.codec is None else self.codec.scores(rows, q)
+
+    @property
+    def positions(self):
+        if self._positions is None:
+            self._positions = {p: i for i, p in enumerate(self.paths)}
+        return self._positions
+
+    def keys(self):
+        return list(self.paths)
+
+    def items(self):
+        return ((p, self._decode(row)) for p, row in zip(self.paths, self.matrix))
+
+    def scores(self, query):
+        """Cosine similarity of `query` against every row."""
+        q = l2_normalize(np.asarray(query).ravel())
+        return self._score_rows(self.matrix, q)
+
+    def search(self, query, threshold=0.6, k=None):
+        """Images with similarity >= threshold, best first (at most k of them)."""
+        if not self.paths:
+            return []
+        sims, ids = self._score_query(query)
+        return self._select(sims, ids, threshold, k)
+
+    def search_page(self, query, threshold=0.6, k=None, offset=0, limit=None, timings=None):
+        """One page of the ranking plus the total number of matches.
+
+        Only the best `offset + limit` matches (capped by k) are partially
+        selected and sorted; the rest are just counted. With an IVF attached
+        only the probed cells are scored, so the total is approximate: a lower
+        bound on the matches in the whole corpus. A `timings` dict gets the
+        seconds spent in 'scan' (scoring) and 'select' (ranking).
+        """
+        if not self.paths:
+            return [], 0
+        start = time.perf_counter()
+        sims, ids = self._score_query(query)
+        scanned = time.perf_counter()
+        # matches among the scored rows: all of them, or the probed IVF cells
+        total = int(np.count_nonzero(sims >= threshold))
+        end = total if limit is None else min(total, offset + limit)
+        if k is not None:
+            end = min(end, k)
+        page = self._select(sims, ids, threshold, end)[offset:] if offset < end else []
+        if timings is not None:
+            timings['scan'] = scanned - start
+            timings['select'] = time.perf_counter() - scanned
+        return page, total
+
+    def _score_query(self, query):
+        q = l2_normalize(np.asarray(query).ravel())
+        if self.ann is not None:
+            # approximate: only score the rows in the probed IVF cells
+            ids = self.ann.candidates(q, self.nprobe)
+            return self._score_rows(self.matrix[ids], q), ids
+        return self._score_rows(self.matrix, q), None
+
+    def search_batch(self, queries, threshold=0.6, k=None):
+        """`search` for many queries; exact float32 indexes score them all in
+        one (queries x corpus) matrix product."""
+        queries = np.asarray(queries)
+        if not self.paths or not len(queries):
+            return [[] for _ in range(len(queries))]
+        Q = l2_normalize(queries.reshape(len(queries), -1))
+        if self.ann is not None or self.codec is not None:
+            return [self.search(q, threshold, k) for q in Q]
+        results = []
+        # bound the (queries x corpus) score block to ~128 MB
+        step = max(1, (1 << 25) // len(self.paths))
+        for start in range(0, len(Q), step):
+            sims = Q[start:start + step] @ self.matrix.T
+            results.extend(self._select(row, None, threshold, k) for row in sims)
+        return results
+
+    def _select(self, sims, ids, threshold, k):
+        idx = np.flatnonzero(sims >= threshold)
+        if k is not None and k < len(idx):
+            # partial selection: only the k best matches get sorted
+            idx = np.sort(idx[np.argpartition(-sims[idx], k - 1)[:k]])
+        order = idx[np.argsort(-sims[idx], kind='stable')]
+        rows = order if ids is None else ids[order]
+        return [{"image_path": self.paths[r], "similarity": float(sims[i])}
+                for r, i in zip(rows, order)]
+
+
+def index_path_for(features_file):
+    """`features_light.pkl` -> `features_light.fidx`."""
+    return os.path.splitext(features_file)[0] + INDEX_SUFFIX
+
+
+def is_index_file(path):
+    try:
+        with open(path, 'rb') as f:
+            return f.read(len(INDEX_MAGIC)) == INDEX_MAGIC
+    except OSError:
+        return False
+
+
+def _align(offset):
+    return -(-offset // INDEX_ALIGN) * INDEX_ALIGN
+
+
+def save_index(index, index_file, encoding=None, hashes=None):
+    """Write `index` in the mmap-able format (atomically via a temp file).
+
+    `encoding` defaults to INDEX_ENCODING; anything but float32 trains the
+    codec on the vectors being written and stores its parameters alongside.
+    `hashes` ({path: sha256}) defaults to the ones the index already carries.
+    """
+    index = FeatureIndex.coerce(index)
+    if hashes is None and index.hashes is not None:
+        hashes = dict(zip(index.paths, index.hashes))
+    encoding = encoding or INDEX_ENCODING
+    if index.encoding == encoding:
+        codec, vectors = index.codec, np.ascontiguousarray(index.matrix)
+    else:
+        full = index.vectors()
+        codec = make_codec(encoding)
+        if codec is not None and len(index):
+            vectors = codec.fit(full).encode(full)
+        else:
+            codec, vectors = None, np.ascontiguousarray(full, dtype=np.float32)
+    blocks = [('vectors', vectors)]
+    if codec is not None:
+        blocks += sorted(codec.params().items())
+    paths = '\0'.join(index.paths).encode('utf-8')
+    hash_table = '\0'.join(hashes.get(p, '') for p in index.paths).encode('ascii') if hashes else b''
+    header = {
+        'version': INDEX_VERSION,
+        'encoding': codec.name if codec is not None else 'float32',
+        'dtype': str(vectors.dtype),
+        'count': len(index),
+        'dim': index.dim,
+        'normalized': True,
+        'paths_length': len(paths),
+    }
+    if hashes:
+        header['hashes_length'] = len(hash_table)
+    # offsets depend on the header size, so grow the header until it fits
+    header_length = 0
+    while True:
+        header['paths_offset'] = len(INDEX_MAGIC) + 4 + header_length
+        offset = header['paths_offset'] + len(paths)
+        if hashes:
+            header['hashes_offset'] = offset
+            offset += len(hash_table)
+        header['blocks'] = {}
+        for name, array in blocks:
+            offset = _align(offset)
+            header['blocks'][name] = {'offset': offset, 'dtype': str(array.dtype),
+                                      'shape': list(array.shape)}
+            offset += array.nbytes
+        header['vectors_offset'] = header['blocks']['vectors']['offset']
+        header_bytes = json.dumps(header).encode('utf-8')
+        if len(header_bytes) <= header_length:
+            header_bytes = header_bytes.ljust(header_length)
+            break
+        header_length = _align(len(header_bytes))
+
+    tmp_file = index_file + '.tmp'
+    with open(tmp_file, 'wb') as f:
+        f.write(INDEX_MAGIC)
+        f.write(struct.pack('<I', len(header_bytes)))
+        f.write(header_bytes)
+        f.write(paths)
+        f.write(hash_table)
+        for name, array in blocks:
+            f.write(b'\0' * (header['blocks'][name]['offset'] - f.tell()))
+            np.ascontiguousarray(array).tofile(f)
+    os.replace(tmp_file, index_file)
+
+
+def save_features(features, output_file, hashes=None):
+    """Write the legacy pickle plus the .fidx index the app actually loads.
+
+    The slow part (pickling, the IVF build, codec training) writes temp files
+    only; they are swapped in back to back at the end with os.replace, so a
+    worker reloading mid-build keeps resolving to the old .fidx. The pickle
+    goes in last: it was written first, so its mtime stays older than the
+    .fidx and resolve_features_file never picks it over the new index.
+    `hashes` ({path: sha256}) are stored in the .fidx (see save_index).
+    """
+    if isinstance(features, FeatureIndex):
+        if hashes is None and features.hashes is not None:
+            hashes = dict(zip(features.paths, features.hashes))
+        features = {p: np.array(v) for p, v in features.items()}
+    index_file = index_path_for(output_file)
+    tmp_file = output_file + '.tmp'
+    with open(tmp_file, 'wb') as f:
+        pickle.dump(features, f)
+    swaps = []
+    if SEARCH_BACKEND == 'ivf' and len(features) >= ANN_MIN_SIZE:
+        # in before the .fidx, so a worker reloading the new index finds a matching IVF
+        ann_file = ann_path_for(output_file)
+        build_ann(FeatureIndex.from_dict(features), ann_file, out_file=ann_file + '.new')
+        swaps.append((ann_file + '.new', ann_file))
+    save_index(features, index_file + '.new', hashes=hashes)
+    swaps += [(index_file + '.new', index_file), (tmp_file, output_file)]
+    for src, dst in swaps:
+        os.replace(src, dst)
+
+
+def read_index_header(index_file):
+    with open(index_file, 'rb') as f:
+        if f.read(len(INDEX_MAGIC)) != INDEX_MAGIC:
+            raise ValueError(f"Not a feature index file: {index_file}")
+        (length,) = struct.unpack('<I', f.read(4))
+        header = json.loads(f.read(length).decode('utf-8'))
+    if header.get('version') not in (1, INDEX_VERSION):
+        raise ValueError(f"Unsupported index version {header.get('version')} in {index_file}")
+    return header
+
+
+def open_index(index_file):
+    """Memory-map an index written by `save_index` (no vector data is copied)."""
+    header = read_index_header(index_file)
+    with open(index_file, 'rb') as f:
+        f.seek(header['paths_offset'])
+        table = f.read(header['paths_length']).decode('utf-8')
+        hash_table = None
+        if 'hashes_offset' in header:
+            f.seek(header['hashes_offset'])
+            hash_table = f.read(header['hashes_length']).decode('ascii')
+    count, dim = header['count'], header['dim']
+    paths = table.split('\0') if count else []
+    if not count:
+        return FeatureIndex([], np.zeros((0, 0), dtype=np.float32))
+    blocks = header.get('blocks') or {'vectors': {
+        'offset': header['vectors_offset'], 'dtype': header['dtype'], 'shape': [count, dim]}}
+    arrays = {name: np.memmap(index_file, dtype=b['dtype'], mode='r',
+                              offset=b['offset'], shape=tuple(b['shape']))
+              for name, b in blocks.items()}
+    matrix = arrays.pop('vectors')
+    encoding = header.get('encoding', 'float32')
+    codec = None
+    if encoding != 'float32':
+        # codec parameters are tiny; keep them as regular arrays
+        codec = CODECS[encoding].from_params({k: np.array(v) for k, v in arrays.items()})
+    index = FeatureIndex(paths, matrix, codec, dim)
+    if hash_table is not None:
+        index.hashes = hash_table.split('\0')
+    return index
+
+
+def resolve_features_file(features_file):
+    """Prefer the mmap index next to a pickle when it is at least as new."""
+    if features_file.endswith('.pkl'):
+        index_file = index_path_for(features_file)
+        if os.path.exists(index_file) and (
+                not os.path.exists(features_file)
+                or os.path.getmtime(index_file) >= os.path.getmtime(features_file)):
+            return index_file
+    return features_file
+
+
+def load_features(features_file, prefer_index=True):
+    """Load either format: the mmap index or a legacy pickled dict."""
+    if prefer_index:
+        features_file = resolve_features_file(features_file)
+    if is_index_file(features_file):
+        index = open_index(features_file)
+    else:
+        with open(features_file, 'rb') as f:
+            index = FeatureIndex.from_dict(pickle.load(f))
+    attach_ann(index, features_file)
+    return index
@@ -0,0 +1,153 @@
+import hashlib
+import json
+import os
+
+import numpy as np
+
+from feature_index import l2_normalize, load_features, save_features
+
+# The manifest lives next to the feature file and records, for every indexed
+# image, the size / mtime / content hash it had when its vector was extracted:
+#   {"version": 1, "extractor": "...", "files": {path: {size, mtime_ns, sha256}}}
+MANIFEST_VERSION = 1
+
+
+def manifest_path_for(features_file):
+    """`features_light.pkl` -> `features_light.manifest.json`."""
+    return os.path.splitext(features_file)[0] + '.manifest.json'
+
+
+def file_sha256(path, chunk_size=1 << 20):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def load_manifest(manifest_file):
+    try:
+        with open(manifest_file, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if manifest.get('version') != MANIFEST_VERSION:
+        return None
+    return manifest
+
+
+def save_manifest(manifest, manifest_file):
+    tmp_file = manifest_file + '.tmp'
+    with open(tmp_file, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False)
+    os.replace(tmp_file, manifest_file)
+
+
+def content_hashes(features_file, index):
+    """sha256 -> path for every image in `index`.
+
+    Taken from the index itself when it stores them: they were written with
+    its vectors, so they can't describe a different build. Indexes without
+    them (pickles, older .fidx files) fall back to the manifest.
+    """
+    if getattr(index, 'hashes', None) is not None:
+        return {h: p for p, h in zip(index.paths, index.hashes) if h}
+    manifest = load_manifest(manifest_path_for(features_file))
+    if not manifest:
+        return {}
+    return {entry['sha256']: path for path, entry in manifest['files'].items() if path in index}
+
+
+def scan_dataset(dataset_dir):
+    """Every file under `dataset_dir`, in a stable walk order."""
+    paths = []
+    for root, dirs, files in os.walk(dataset_dir):
+        dirs.sort()
+        for fname in sorted(files):
+            paths.append(os.path.join(root, fname))
+    return paths
+
+
+def plan_update(paths, manifest, indexed):
+    """Split `paths` into (reuse, extract, entries) against the old manifest.
+
+    A file is reused when its size and mtime are unchanged, or when they changed
+    but the content hash did not. `indexed` is the set of paths that still have
+    a vector in the existing index.
+    """
+    old_files = manifest['files'] if manifest else {}
+    reuse, extract, entries = [], [], {}
+    for path in paths:
+        st = os.stat(path)
+        old = old_files.get(path)
+        entry = {'size': st.st_size, 'mtime_ns': st.st_mtime_ns}
+        if old and path in indexed:
+            if old['size'] == st.st_size and old['mtime_ns'] == st.st_mtime_ns:
+                entries[path] = dict(entry, sha256=old['sha256'])
+                reuse.append(path)
+                continue
+            entry['sha256'] = file_sha256(path)
+            if entry['sha256'] == old['sha256']:
+                entries[path] = entry
+                reuse.append(path)
+                continue
+        else:
+            entry['sha256'] = file_sha256(path)
+        entries[path] = entry
+        extract.append(path)
+    return reuse, extract, entries
+
+
+def update_features(dataset_dir, output_file, extract_batch, extractor_id, full=False):
+    """Bring `output_file` up to date with `dataset_dir`, extracting only deltas.
+
+    `extract_batch(paths)` must return {path: vector} for the files it managed
+    to process (and report the ones it skipped). Files that failed are left out
+    of the manifest so the next run retries them. Returns a stats dict.
+    """
+    manifest_file = manifest_path_for(output_file)
+    manifest = None if full else load_manifest(manifest_file)
+    if manifest and manifest.get('extractor') != extractor_id:
+        # extractor changed: old vectors are not comparable, rebuild everything
+        manifest = None
+
+    existing = {}
+    if manifest and os.path.exists(output_file):
+        try:
+            # the pickle keeps full precision even when the .fidx is compressed
+            existing = load_features(output_file, prefer_index=False)
+        except Exception as e:
+            print('cannot read existing features, rebuilding:', e)
+            manifest = None
+
+    paths = scan_dataset(dataset_dir)
+    reuse, extract, entries = plan_update(paths, manifest, existing if manifest else ())
+    new_vectors = extract_batch(extract) if extract else {}
+
+    # everything is stored L2-normalized, matching the rows reused from the index
+    features = {}
+    for path in paths:
+        if path in new_vectors:
+            features[path] = l2_normalize(np.asarray(new_vectors[path]).ravel())
+        elif path in entries and path not in extract:
+            features[path] = np.array(existing[path])
+        else:
+            entries.pop(path, None)
+
+    unchanged = (manifest is not None and not new_vectors
+                 and list(features) == list(existing.keys()))
+    if not unchanged:
+        # untouched files keep their mtime, so workers don't reload for nothing
+        save_features(features, output_file,
+                      hashes={path: entries[path]['sha256'] for path in features})
+    save_manifest({'version': MANIFEST_VERSION, 'extractor': extractor_id, 'files': entries},
+                  manifest_file)
+
+    old_paths = set(manifest['files']) if manifest else set()
+    return {
+        'total': len(features),
+        'reused': len(reuse),
+        'extracted': len(new_vectors),
+        'failed': len(extract) - len(new_vectors),
+        'removed': len(old_paths - set(paths)),
+    }
@@ -1,37 +1,158 @@
-import firebase_admin
-from firebase_admin import credentials, storage
+import argparse
+import json
 import os
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 # Đường dẫn tới file serviceAccountKey.json (bạn cần tải từ Firebase Console)
 SERVICE_ACCOUNT_PATH = 'serviceAccountKey.json'  # Đặt file này vào TrainImagePet/
 BUCKET_NAME = 'adopt-pet-d1c88.appspot.com'  # Thay bằng tên bucket của bạn
 LOCAL_FOLDER = 'data/'
+# generation / md5 of every blob we downloaded, to skip unchanged ones next time
+SYNC_STATE_FILE = os.environ.get('FIREBASE_SYNC_STATE', 'firebase_sync_state.json')
+SYNC_WORKERS = int(os.environ.get('FIREBASE_SYNC_WORKERS', '8'))
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.gif', '.webp')
 
 def init_firebase():
+    import firebase_admin
+    from firebase_admin import credentials
     if not firebase_admin._apps:
         cred = credentials.Certificate(SERVICE_ACCOUNT_PATH)
         firebase_admin.initialize_app(cred, {
             'storageBucket': BUCKET_NAME
         })
 
-def download_all_images():
+def get_bucket():
+    from firebase_admin import storage
     init_firebase()
-    bucket = storage.bucket()
-    blobs = bucket.list_blobs()
-    os.makedirs(LOCAL_FOLDER, exist_ok=True)
-    for blob in blobs:
-        # Kiểm tra content_type để nhận diện file ảnh (kể cả khi không có đuôi .png)
-        is_image = False
-        if blob.content_type and blob.content_type.startswith('image/'):
-            is_image = True
-        elif blob.name.lower().endswith(('.jpg', '.jpeg', '.png', '.bmp', '.gif', '.webp')):
-            is_image = True
-        if is_image:
-            local_path = os.path.join(LOCAL_FOLDER, blob.name)
-            os.makedirs(os.path.dirname(local_path), exist_ok=True)
-            print(f"Downloading {blob.name} to {local_path}")
-            blob.download_to_filename(local_path)
+    return storage.bucket()
+
+def is_image_blob(blob):
+    # Kiểm tra content_type để nhận diện file ảnh (kể cả khi không có đuôi .png)
+    if blob.content_type and blob.content_type.startswith('image/'):
+        return True
+    return blob.name.lower().endswith(IMAGE_EXTENSIONS)
+
+def load_state(state_file):
+    try:
+        with open(state_file, 'r', encoding='utf-8') as f:
+            return json.load(f).get('blobs', {})
+    except (OSError, ValueError):
+        return {}
+
+def save_state(state_file, blobs):
+    tmp_file = state_file + '.tmp'
+    with open(tmp_file, 'w', encoding='utf-8') as f:
+        json.dump({'version': 1, 'blobs': blobs}, f, indent=1, sort_keys=True)
+    os.replace(tmp_file, state_file)
+
+def _blob_state(blob):
+    return {'generation': str(blob.generation), 'md5_hash': blob.md5_hash, 'size': blob.size}
+
+def _local_path(local_folder, name):
+    path = os.path.normpath(os.path.join(local_folder, name))
+    root = os.path.normpath(local_folder)
+    # never write outside the data folder ("../" in a blob name)
+    return path if path.startswith(root + os.sep) else None
+
+def _download(blob, local_path):
+    os.makedirs(os.path.dirname(local_path), exist_ok=True)
+    tmp_file = local_path + '.part'
+    try:
+        blob.download_to_filename(tmp_file)
+        os.replace(tmp_file, local_path)
+    except BaseException:
+        # never leave a partial file in data/ (builds would try to extract it)
+        try:
+            os.remove(tmp_file)
+        except OSError:
+            pass
+        raise
+    return os.path.getsize(local_path)
+
+def plan_sync(bucket, local_folder, state, full=False):
+    """(remote, todo, unchanged): remote image blob states, the (blob, local
+    path) pairs that need downloading and how many are already up to date."""
+    remote, todo, unchanged = {}, [], 0
+    for blob in bucket.list_blobs():
+        local_path = _local_path(local_folder, blob.name)
+        if local_path is None or not is_image_blob(blob):
+            continue
+        remote[blob.name] = _blob_state(blob)
+        if not full and state.get(blob.name) == remote[blob.name] and os.path.exists(local_path):
+            unchanged += 1
+        else:
+            todo.append((blob, local_path))
+    return remote, todo, unchanged
+
+def finish_sync(state, remote, downloaded, local_folder, state_file):
+    """Record the blobs in `downloaded`, delete local copies of removed blobs
+    and save the new state. Returns the number of deleted files."""
+    new_state = {name: entry for name, entry in state.items() if name in remote}
+    for name in downloaded:
+        new_state[name] = remote[name]
+    deleted = 0
+    for name in set(state) - set(remote):
+        local_path = _local_path(local_folder, name)
+        if local_path and os.path.exists(local_path):
+            os.remove(local_path)
+            deleted += 1
+    save_state(state_file, new_state)
+    return deleted
+
+def sync_images(bucket=None, local_folder=LOCAL_FOLDER, state_file=SYNC_STATE_FILE,
+                workers=SYNC_WORKERS, full=False):
+    """Mirror the bucket's images into `local_folder`.
+
+    Only blobs whose generation/md5 changed since the last sync (or whose
+    local copy is missing) are downloaded, `workers` at a time; files we
+    downloaded earlier whose blob is gone are deleted. Returns the stats.
+    """
+    start = time.perf_counter()
+    bucket = bucket if bucket is not None else get_bucket()
+    state = load_state(state_file)
+    os.makedirs(local_folder, exist_ok=True)
+    remote, todo, unchanged = plan_sync(bucket, local_folder, state, full)
+
+    downloaded, failed, total_bytes = [], 0, 0
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        futures = [(blob, pool.submit(_download, blob, path)) for blob, path in todo]
+        for blob, future in futures:
+            try:
+                total_bytes += future.result()
+            except Exception as e:
+                failed += 1
+                print(f"skip {blob.name} -> {e}")
+                continue
+            downloaded.append(blob.name)
+    # a blob that failed keeps no state entry, so the next sync retries it
+    for blob, _ in todo:
+        if blob.name not in downloaded:
+            state.pop(blob.name, None)
+    deleted = finish_sync(state, remote, downloaded, local_folder, state_file)
+
+    seconds = time.perf_counter() - start
+    stats = {
+        'listed': len(remote), 'downloaded': len(downloaded), 'unchanged': unchanged,
+        'deleted': deleted, 'failed': failed, 'bytes': total_bytes,
+        'seconds': round(seconds, 3),
+        'files_per_sec': round(len(downloaded) / seconds, 2) if seconds else 0.0,
+        'mb_per_sec': round(total_bytes / 1e6 / seconds, 2) if seconds else 0.0,
+    }
+    print(f"Synced {len(remote)} images: {len(downloaded)} downloaded ({total_bytes / 1e6:.1f} MB), "
+          f"{unchanged} unchanged, {deleted} deleted, {failed} failed in {seconds:.1f}s "
+          f"({stats['files_per_sec']} files/s, {stats['mb_per_sec']} MB/s)")
+    return stats
+
+def download_all_images():
+    # re-download everything (ignores the sync state)
+    return sync_images(full=True)
 
 if __name__ == '__main__':
-    download_all_images()
+    parser = argparse.ArgumentParser(description='Sync Firebase Storage images into data/')
+    parser.add_argument('--full', action='store_true', help='re-download every image')
+    parser.add_argument('--workers', type=int, default=SYNC_WORKERS)
+    args = parser.parse_args()
+    sync_images(workers=args.workers, full=args.full)
     print('Download completed!')
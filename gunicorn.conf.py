@@ -0,0 +1,30 @@
+# Picked up automatically by `gunicorn app:app` (gunicorn >= 20).
+import os
+
+# Threaded workers: while searches wait for the bounded search pool
+# (admission.py), the other threads keep answering payments and /status.
+# CLI flags (-k, --threads) still override these; set GUNICORN_THREADS instead
+# of --threads so the search admission limit follows it.
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gthread')
+threads = int(os.environ.get('GUNICORN_THREADS', '8'))
+
+def on_starting(server):
+    # start /metrics from zero: drop per-worker samples of the previous run
+    import metrics
+    metrics.reset_multiproc_dir()
+
+def post_worker_init(worker):
+    # Load + warm up the model before this worker starts accepting requests,
+    # so no user request pays the cold start.
+    import model_registry
+    if os.environ.get('LIGHT_MODE', '1') not in ('1', 'true', 'True'):
+        model_registry.warm_up()
+    model_registry.mark_ready()
+    stats = model_registry.model_stats()
+    worker.log.info("worker %s ready in %ss, RSS %s MB", stats['pid'],
+                    stats['ready_seconds'], stats['rss_mb'])
+
+def child_exit(server, worker):
+    # stop reporting the live gauges of a worker that is gone
+    import metrics
+    metrics.mark_worker_dead(worker.pid)
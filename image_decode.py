@@ -0,0 +1,75 @@
+import io
+import os
+
+import cv2
+import numpy as np
+from PIL import Image
+
+# Decode JPEGs at a reduced scale (libjpeg DCT scaling) when the extractor
+# only needs a small image anyway; a 12 MP photo then costs a fraction of a
+# full decode. Off by default: the shipped indexes were built from full
+# decodes, and queries must be decoded the same way as the corpus. Set
+# REDUCED_DECODE=1 and rebuild the index (the extractor id changes, so the
+# next build re-extracts everything) to switch.
+REDUCED_DECODE = os.environ.get('REDUCED_DECODE', '0') in ('1', 'true', 'True')
+# shortest side kept for the HSV histogram (light mode)
+HIST_DECODE_SIZE = int(os.environ.get('HIST_DECODE_SIZE', '256'))
+
+_CV2_FLAGS = {
+    1: cv2.IMREAD_COLOR,
+    2: cv2.IMREAD_REDUCED_COLOR_2,
+    4: cv2.IMREAD_REDUCED_COLOR_4,
+    8: cv2.IMREAD_REDUCED_COLOR_8,
+}
+
+
+def _open(source):
+    # source is a file path or the raw bytes of an upload
+    return Image.open(source if isinstance(source, str) else io.BytesIO(source))
+
+
+def reduction_for(size, target):
+    """Largest JPEG scale factor (8/4/2) that keeps the shortest side >= target."""
+    shortest = min(size)
+    for factor in (8, 4, 2):
+        if shortest // factor >= target:
+            return factor
+    return 1
+
+
+def cv2_decode(source, target=HIST_DECODE_SIZE, reduced=None):
+    """BGR array of an image file or bytes (None if OpenCV cannot decode it).
+
+    JPEGs are decoded at 1/2, 1/4 or 1/8 scale as long as the result keeps at
+    least `target` pixels on its shortest side; only the header is parsed to
+    choose the factor.
+    """
+    reduced = REDUCED_DECODE if reduced is None else reduced
+    flag = cv2.IMREAD_COLOR
+    if reduced and target:
+        try:
+            with _open(source) as img:
+                if img.format == 'JPEG':
+                    flag = _CV2_FLAGS[reduction_for(img.size, target)]
+        except Exception:
+            pass  # let OpenCV decide whether it is an image
+    if isinstance(source, str):
+        return cv2.imread(source, flag)
+    return cv2.imdecode(np.frombuffer(source, dtype=np.uint8), flag)
+
+
+def pil_load(source, size=(224, 224), reduced=None):
+    """RGB PIL image resized to `size` like keras `load_img` (nearest neighbour).
+
+    For JPEGs `draft()` first lets the decoder scale down by up to 8x while
+    staying at least `size`, so the full-resolution image is never built.
+    """
+    reduced = REDUCED_DECODE if reduced is None else reduced
+    img = _open(source)
+    if reduced and img.format == 'JPEG':
+        img.draft('RGB', size)
+    if img.mode != 'RGB':
+        img = img.convert('RGB')
+    if img.size != tuple(size):
+        img = img.resize(size, Image.NEAREST)
+    return img
@@ -0,0 +1,245 @@
+import os
+import queue
+import shutil
+import threading
+import time
+
+from feature_manifest import update_features
+from firebase_download import (SYNC_STATE_FILE, SYNC_WORKERS, _download, finish_sync,
+                               load_state, plan_sync)
+
+# fetch -> decode -> embed, connected by bounded queues: a slow stage makes the
+# one before it wait (backpressure) instead of piling decoded images in memory
+INGEST_QUEUE_SIZE = int(os.environ.get('INGEST_QUEUE_SIZE', '64'))
+DECODE_WORKERS = int(os.environ.get('INGEST_DECODE_WORKERS', min(4, os.cpu_count() or 1)))
+EMBED_BATCH_SIZE = int(os.environ.get('EMBED_BATCH_SIZE', '32'))
+
+_DONE = object()
+
+
+class StageStats:
+    """Items, errors, busy time and time blocked on a full queue for one stage."""
+
+    def __init__(self, name):
+        self.name = name
+        self.items = 0
+        self.errors = 0
+        self.busy = 0.0
+        self.blocked = 0.0
+        self.first = None
+        self.last = None
+        self._lock = threading.Lock()
+
+    def record(self, seconds, ok=True, blocked=0.0):
+        now = time.perf_counter()
+        with self._lock:
+            if self.first is None:
+                self.first = now - seconds
+            self.last = now
+            self.busy += seconds
+            self.blocked += blocked
+            if ok:
+                self.items += 1
+            else:
+                self.errors += 1
+
+    def as_dict(self):
+        span = (self.last - self.first) if self.first is not None else 0.0
+        return {
+            'items': self.items,
+            'errors': self.errors,
+            'busy_seconds': round(self.busy, 3),
+            'blocked_seconds': round(self.blocked, 3),
+            'items_per_sec': round(self.items / span, 2) if span > 0 else 0.0,
+        }
+
+
+def _put(q, item):
+    # time spent here is backpressure from the next stage
+    start = time.perf_counter()
+    q.put(item)
+    return time.perf_counter() - start
+
+
+def run_pipeline(items, fetch, decode, embed_batch, fetch_workers=SYNC_WORKERS,
+                 decode_workers=DECODE_WORKERS, batch_size=EMBED_BATCH_SIZE,
+                 queue_size=INGEST_QUEUE_SIZE):
+    """Stream `items` through fetch (-> local path), decode (-> array) and
+    batched embed (-> vectors) concurrently.
+
+    Items that fail in any stage are reported and left out. Returns
+    ({path: vector}, {'fetch': ..., 'decode': ..., 'embed': ..., 'seconds': ...}).
+    """
+    start = time.perf_counter()
+    items = list(items)
+    fetch_workers = max(1, min(fetch_workers, len(items) or 1))
+    decode_workers = max(1, decode_workers)
+    todo = queue.Queue()
+    for item in items:
+        todo.put(item)
+    fetched = queue.Queue(maxsize=queue_size)
+    decoded = queue.Queue(maxsize=queue_size)
+    stats = {name: StageStats(name) for name in ('fetch', 'decode', 'embed')}
+    remaining = {'fetch': fetch_workers, 'decode': decode_workers}
+    lock = threading.Lock()
+
+    def finished(stage, downstream, count):
+        # the last worker of a stage tells every worker of the next one to stop
+        with lock:
+            remaining[stage] -= 1
+            last = remaining[stage] == 0
+        if last:
+            for _ in range(count):
+                downstream.put(_DONE)
+
+    def fetch_loop():
+        while True:
+            try:
+                item = todo.get_nowait()
+            except queue.Empty:
+                break
+            t = time.perf_counter()
+            try:
+                path = fetch(item)
+            except Exception as e:
+                stats['fetch'].record(time.perf_counter() - t, ok=False)
+                print(f"skip {item} -> {e}")
+                continue
+            took = time.perf_counter() - t
+            stats['fetch'].record(took, blocked=_put(fetched, path))
+        finished('fetch', fetched, decode_workers)
+
+    def decode_loop():
+        while True:
+            path = fetched.get()
+            if path is _DONE:
+                break
+            t = time.perf_counter()
+            try:
+                array = decode(path)
+            except Exception as e:
+                stats['decode'].record(time.perf_counter() - t, ok=False)
+                print(f"skip {path} -> {e}")
+                continue
+            took = time.perf_counter() - t
+            stats['decode'].record(took, blocked=_put(decoded, (path, array)))
+        finished('decode', decoded, 1)
+
+    threads = [threading.Thread(target=fetch_loop, daemon=True) for _ in range(fetch_workers)]
+    threads += [threading.Thread(target=decode_loop, daemon=True) for _ in range(decode_workers)]
+    for t in threads:
+        t.start()
+
+    vectors = {}
+
+    def flush(batch):
+        t = time.perf_counter()
+        try:
+            out = embed_batch([array for _, array in batch])
+        except Exception as e:
+            for path, _ in batch:
+                print(f"skip {path} -> {e}")
+            stats['embed'].errors += len(batch)
+            return
+        took = time.perf_counter() - t
+        for i, (path, _) in enumerate(batch):
+            vectors[path] = out[i]
+            stats['embed'].record(took / len(batch))
+
+    # embed in this thread: a batch runs when full, or as soon as the queue
+    # runs dry, so compute never waits for the network to deliver a full batch
+    batch = []
+    while True:
+        try:
+            entry = decoded.get(timeout=0.05) if batch else decoded.get()
+        except queue.Empty:
+            flush(batch)
+            batch = []
+            continue
+        if entry is _DONE:
+            break
+        batch.append(entry)
+        if len(batch) >= batch_size:
+            flush(batch)
+            batch = []
+    if batch:
+        flush(batch)
+    for t in threads:
+        t.join()
+
+    report = {name: s.as_dict() for name, s in stats.items()}
+    report['seconds'] = round(time.perf_counter() - start, 3)
+    return vectors, report
+
+
+class DirectoryBucket:
+    """A local folder that looks like a storage bucket (for tests / offline runs).
+
+    Blobs carry the file's mtime as their generation, and downloading one is
+    a file copy.
+    """
+
+    class Blob:
+        def __init__(self, root, name):
+            self.name = name
+            self._path = os.path.join(root, name)
+            st = os.stat(self._path)
+            self.generation = st.st_mtime_ns
+            self.size = st.st_size
+            self.md5_hash = None
+            self.content_type = None
+
+        def download_to_filename(self, path):
+            shutil.copyfile(self._path, path)
+
+    def __init__(self, root):
+        self.root = root
+
+    def list_blobs(self):
+        for dirpath, dirs, files in os.walk(self.root):
+            dirs.sort()
+            for fname in sorted(files):
+                name = os.path.relpath(os.path.join(dirpath, fname), self.root)
+                yield self.Blob(self.root, name.replace(os.sep, '/'))
+
+
+def ingest(bucket, dataset_dir, output_file, decode, embed_batch, extractor_id,
+           state_file=SYNC_STATE_FILE, full=False, **pipeline_options):
+    """Sync `bucket` into `dataset_dir` and update `output_file`, embedding
+    images while they are still being downloaded.
+
+    New or changed blobs go through the fetch -> decode -> embed pipeline;
+    local files that changed without a download are embedded by the same
+    pipeline (fetch is a no-op) when update_features asks for them.
+    """
+    state = load_state(state_file)
+    os.makedirs(dataset_dir, exist_ok=True)
+    remote, todo, unchanged = plan_sync(bucket, dataset_dir, state, full)
+    names = {path: blob.name for blob, path in todo}
+
+    def fetch(item):
+        blob, path = item
+        _download(blob, path)
+        return path
+
+    vectors, report = run_pipeline(todo, fetch, decode, embed_batch, **pipeline_options)
+    for blob, path in todo:
+        if path not in vectors:
+            state.pop(blob.name, None)  # retried next time
+    finish_sync(state, remote, [names[p] for p in vectors], dataset_dir, state_file)
+
+    def extract_batch(paths):
+        found = {p: vectors[os.path.normpath(p)] for p in paths if os.path.normpath(p) in vectors}
+        missing = [p for p in paths if p not in found]
+        if missing:
+            extra, report['local'] = run_pipeline(missing, lambda p: p, decode, embed_batch,
+                                                  **pipeline_options)
+            found.update(extra)
+        return found
+
+    stats = update_features(dataset_dir, output_file, extract_batch, extractor_id, full=full)
+    report.update(downloaded=report['fetch']['items'], unchanged=unchanged, features=stats)
+    print(f"ingested {len(todo)} new/changed images in {report['seconds']}s "
+          f"(fetch {report['fetch']['items_per_sec']}/s, decode {report['decode']['items_per_sec']}/s, "
+          f"embed {report['embed']['items_per_sec']}/s)")
+    return report
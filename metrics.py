@@ -0,0 +1,86 @@
+import os
+import shutil
+import time
+from contextlib import contextmanager
+
+# Prometheus metrics for /metrics. Under gunicorn set PROMETHEUS_MULTIPROC_DIR
+# (a writable directory, cleared on server start) so every worker writes its
+# samples there and /metrics, whichever worker answers it, reports the sum.
+MULTIPROC_DIR = os.environ.get('PROMETHEUS_MULTIPROC_DIR')
+if MULTIPROC_DIR:
+    os.makedirs(MULTIPROC_DIR, exist_ok=True)
+
+from prometheus_client import (CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge,  # noqa: E402
+                               Histogram, generate_latest, multiprocess)
+
+# request stages are mostly sub-millisecond to a few seconds (TF extraction)
+STAGE_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+REQUEST_SECONDS = Histogram(
+    'petsearch_request_seconds', 'HTTP request latency by endpoint',
+    ['endpoint', 'method', 'status'], buckets=STAGE_BUCKETS)
+SEARCH_STAGE_SECONDS = Histogram(
+    'petsearch_search_stage_seconds',
+    'Time per /search stage: receive, decode (= verification), extract, scan, select, serialize',
+    ['stage'], buckets=STAGE_BUCKETS)
+CACHE_EVENTS = Counter(
+    'petsearch_cache_events_total', 'Query/result cache lookups by outcome', ['cache', 'outcome'])
+TRAINING_RUNS = Counter(
+    'petsearch_training_runs_total', 'Training jobs by kind and final status', ['kind', 'status'])
+TRAINING_SECONDS = Histogram(
+    'petsearch_training_seconds', 'Training job duration', ['kind'],
+    buckets=(1, 5, 15, 60, 300, 900, 3600))
+INDEX_VECTORS = Gauge(
+    'petsearch_index_vectors', 'Vectors in the loaded feature index', multiprocess_mode='livemax')
+ADMISSION_REJECTED = Counter(
+    'petsearch_admission_rejected_total', 'Searches answered 503 because the search pool was full',
+    ['reason'])
+STRIPE_SECONDS = Histogram(
+    'petsearch_stripe_request_seconds', 'Stripe API call latency (including retries)',
+    ['operation', 'outcome'], buckets=(0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30))
+
+
+@contextmanager
+def stage(name):
+    """Time the enclosed block as one /search stage."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        SEARCH_STAGE_SECONDS.labels(name).observe(time.perf_counter() - start)
+
+
+def observe_stages(timings):
+    # stages timed inside the index (see FeatureIndex.search_page)
+    for name, seconds in timings.items():
+        SEARCH_STAGE_SECONDS.labels(name).observe(seconds)
+
+
+def cache_observer(cache):
+    return lambda outcome: CACHE_EVENTS.labels(cache, outcome).inc()
+
+
+def stripe_observer(operation, seconds, outcome):
+    STRIPE_SECONDS.labels(operation, outcome).observe(seconds)
+
+
+def render():
+    """(body, content type) of every metric, summed over workers in multiprocess mode."""
+    if MULTIPROC_DIR:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
+
+
+def reset_multiproc_dir():
+    """Clear samples left by a previous server run (call once, before workers start)."""
+    if MULTIPROC_DIR:
+        shutil.rmtree(MULTIPROC_DIR, ignore_errors=True)
+        os.makedirs(MULTIPROC_DIR, exist_ok=True)
+
+
+def mark_worker_dead(pid):
+    if MULTIPROC_DIR:
+        multiprocess.mark_process_dead(pid)
@@ -0,0 +1,86 @@
+import os
+import threading
+import time
+
+import numpy as np
+
+# One ResNet50 per process, shared by result.py (queries) and dactrung.py
+# (training). Built on first use, or eagerly with PRELOAD_MODEL=1 / from the
+# gunicorn post_worker_init hook (see gunicorn.conf.py).
+PRELOAD_MODEL = os.environ.get('PRELOAD_MODEL', '0') in ('1', 'true', 'True')
+
+
+def _process_start():
+    """monotonic() timestamp of when this process (or forked worker) started."""
+    try:
+        with open('/proc/self/stat') as f:
+            # field 22, after the parenthesised command name
+            started = int(f.read().rsplit(')', 1)[1].split()[19]) / os.sysconf('SC_CLK_TCK')
+        with open('/proc/uptime') as f:
+            uptime = float(f.read().split()[0])
+        return time.monotonic() - max(0.0, uptime - started)
+    except (OSError, ValueError, IndexError, AttributeError):
+        return time.monotonic()
+
+
+PROCESS_START = _process_start()
+
+_model = None
+_lock = threading.Lock()
+_stats = {'load_seconds': None, 'warmup_seconds': None, 'ready_seconds': None}
+
+
+def current_rss_mb():
+    """Resident set size of this process in MB (Linux /proc, else peak RSS)."""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    try:
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    except (ImportError, AttributeError):
+        return None
+
+
+def get_model():
+    """The process-wide ResNet50 backbone, loaded once (thread-safe)."""
+    global _model
+    if _model is None:
+        with _lock:
+            if _model is None:
+                from tensorflow.keras.applications.resnet50 import ResNet50
+                rss_before = current_rss_mb()
+                start = time.perf_counter()
+                _model = ResNet50(weights='imagenet', include_top=False, pooling='avg')
+                _stats['load_seconds'] = round(time.perf_counter() - start, 3)
+                rss_after = current_rss_mb()
+                if rss_before is not None and rss_after is not None:
+                    _stats['model_rss_mb'] = round(rss_after - rss_before, 1)
+    return _model
+
+
+def warm_up():
+    """Run one dummy inference so the first real query doesn't pay graph tracing."""
+    model = get_model()
+    if _stats['warmup_seconds'] is None:
+        start = time.perf_counter()
+        model.predict(np.zeros((1, 224, 224, 3), dtype=np.float32), verbose=0)
+        _stats['warmup_seconds'] = round(time.perf_counter() - start, 3)
+    return model
+
+
+def mark_ready():
+    """Record the cold-start time (process start -> ready to serve), once."""
+    if _stats['ready_seconds'] is None:
+        _stats['ready_seconds'] = round(time.monotonic() - PROCESS_START, 3)
+
+
+def model_stats():
+    stats = dict(_stats, loaded=_model is not None, pid=os.getpid())
+    rss = current_rss_mb()
+    stats['rss_mb'] = round(rss, 1) if rss is not None else None
+    return stats
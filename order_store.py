@@ -0,0 +1,183 @@
+import json
+import os
+import sqlite3
+import threading
+import uuid
+
+ORDERS_DB = os.environ.get('ORDERS_DB', 'orders.db')
+# legacy JSON files imported into the database the first time it is opened
+LEGACY_ORDERS_FILE = 'orders.json'
+LEGACY_SESSIONS_FILE = 'checkout_sessions.json'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS orders (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    order_id TEXT NOT NULL UNIQUE,
+    payment_intent_id TEXT,
+    email TEXT,
+    created_at TEXT,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS orders_payment_intent ON orders (payment_intent_id);
+CREATE INDEX IF NOT EXISTS orders_email ON orders (email);
+CREATE TABLE IF NOT EXISTS checkout_sessions (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    session_id TEXT NOT NULL UNIQUE,
+    email TEXT,
+    created_at TEXT,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS checkout_sessions_email ON checkout_sessions (email);
+CREATE TABLE IF NOT EXISTS migrations (
+    name TEXT PRIMARY KEY,
+    rows INTEGER NOT NULL
+);
+"""
+
+
+def _email(record):
+    return (record.get('customer_info') or {}).get('email')
+
+
+class OrderStore:
+    """Orders and checkout sessions in SQLite (WAL mode).
+
+    Every insert is a single-row transaction, so concurrent confirms in any
+    gunicorn worker never overwrite each other; lookups by order id, payment
+    intent id and customer email use indexes. Records are kept as the same
+    JSON documents the API returns.
+    """
+
+    def __init__(self, db_file=ORDERS_DB, orders_file=LEGACY_ORDERS_FILE,
+                 sessions_file=LEGACY_SESSIONS_FILE):
+        self.db_file = db_file
+        self._local = threading.local()
+        conn = self._conn()
+        conn.executescript(SCHEMA)
+        self.migrate_json('orders', orders_file)
+        self.migrate_json('checkout_sessions', sessions_file)
+
+    def _conn(self):
+        # one connection per thread (and per process after a fork)
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.db_file, timeout=30, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn, self._local.pid = conn, os.getpid()
+        return conn
+
+    def migrate_json(self, table, json_file):
+        """Import a legacy JSON list once; returns the number of rows added."""
+        if not json_file or not os.path.exists(json_file):
+            return 0
+        conn = self._conn()
+        name = f'{table}:{os.path.abspath(json_file)}'
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            if conn.execute('SELECT 1 FROM migrations WHERE name = ?', (name,)).fetchone():
+                conn.execute('COMMIT')
+                return 0
+            try:
+                with open(json_file, 'r', encoding='utf-8') as f:
+                    records = json.load(f)
+            except (OSError, ValueError):
+                records = []
+            before = conn.total_changes
+            for record in records:
+                if not isinstance(record, dict):
+                    continue
+                if table == 'orders':
+                    self._insert_order(conn, record, ignore_existing=True)
+                elif record.get('session_id'):
+                    self._insert_session(conn, record, ignore_existing=True)
+            added = conn.total_changes - before
+            conn.execute('INSERT INTO migrations (name, rows) VALUES (?, ?)', (name, added))
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        if added:
+            print(f"Imported {added} {table} from {json_file} into {self.db_file}")
+        return added
+
+    # ---- orders ----
+
+    def _insert_order(self, conn, record, ignore_existing=False):
+        record.setdefault('order_id', str(uuid.uuid4()))
+        conn.execute(
+            f"INSERT {'OR IGNORE ' if ignore_existing else ''}INTO orders "
+            "(order_id, payment_intent_id, email, created_at, data) VALUES (?, ?, ?, ?, ?)",
+            (record['order_id'], record.get('payment_intent_id'), _email(record),
+             record.get('created_at'), json.dumps(record, ensure_ascii=False)))
+
+    def add_order(self, record):
+        self._insert_order(self._conn(), record)
+        return record['order_id']
+
+    def get_order(self, order_id):
+        row = self._conn().execute('SELECT data FROM orders WHERE order_id = ?', (order_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def find_by_payment_intent(self, payment_intent_id):
+        rows = self._conn().execute(
+            'SELECT data FROM orders WHERE payment_intent_id = ? ORDER BY seq', (payment_intent_id,))
+        return [json.loads(r[0]) for r in rows]
+
+    def list_orders(self, email=None):
+        """All orders in insertion order, optionally only one customer's."""
+        if email:
+            rows = self._conn().execute('SELECT data FROM orders WHERE email = ? ORDER BY seq', (email,))
+        else:
+            rows = self._conn().execute('SELECT data FROM orders ORDER BY seq')
+        return [json.loads(r[0]) for r in rows]
+
+    def list_page(self, email=None, cursor=None, limit=100):
+        """One page of orders after `cursor`; returns (orders, next_cursor or None).
+
+        The cursor is the position of the last order returned, so pages stay
+        stable while new orders are appended.
+        """
+        after = int(cursor) if cursor else 0
+        where, args = 'seq > ?', [after]
+        if email:
+            where, args = where + ' AND email = ?', args + [email]
+        rows = self._conn().execute(
+            f'SELECT seq, data FROM orders WHERE {where} ORDER BY seq LIMIT ?', args + [limit + 1]).fetchall()
+        next_cursor = str(rows[limit - 1][0]) if len(rows) > limit else None
+        return [json.loads(r[1]) for r in rows[:limit]], next_cursor
+
+    def listing_version(self, email=None):
+        """(count, last position) of a listing; orders are append-only, so this is its ETag."""
+        if email:
+            row = self._conn().execute(
+                'SELECT COUNT(*), MAX(seq) FROM orders WHERE email = ?', (email,)).fetchone()
+        else:
+            row = self._conn().execute('SELECT COUNT(*), MAX(seq) FROM orders').fetchone()
+        return row[0], row[1] or 0
+
+    # ---- checkout sessions ----
+
+    def _insert_session(self, conn, record, ignore_existing=False):
+        conn.execute(
+            f"INSERT {'OR IGNORE ' if ignore_existing else ''}INTO checkout_sessions "
+            "(session_id, email, created_at, data) VALUES (?, ?, ?, ?)",
+            (record['session_id'], _email(record), record.get('created_at'),
+             json.dumps(record, ensure_ascii=False)))
+
+    def add_session(self, record):
+        self._insert_session(self._conn(), record)
+        return record['session_id']
+
+    def get_session(self, session_id):
+        row = self._conn().execute(
+            'SELECT data FROM checkout_sessions WHERE session_id = ?', (session_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+
+# Import orders.json / checkout_sessions.json into the database by hand:
+#   python order_store.py [orders.db]
+if __name__ == '__main__':
+    import sys
+    store = OrderStore(sys.argv[1] if len(sys.argv) > 1 else ORDERS_DB)
+    print(f"{store.db_file}: {len(store.list_orders())} orders")
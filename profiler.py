@@ -0,0 +1,254 @@
+import cProfile
+import os
+import pstats
+import sys
+import threading
+import time
+from collections import Counter
+
+# On-demand profiling of one worker (see /admin/profile in app.py). Output:
+#   cprofile -> <PROFILE_DIR>/<pid>-<start>-cprofile.prof (pstats; snakeviz, flameprof)
+#   sampling -> <PROFILE_DIR>/<pid>-<start>-sampling.collapsed
+#               ("frame;frame;frame count", for flamegraph.pl / speedscope)
+PROFILE_DIR = os.environ.get('PROFILE_DIR', 'profiles')
+PROFILE_SAMPLE_MS = float(os.environ.get('PROFILE_SAMPLE_MS', '5'))
+PROFILE_MAX_REQUESTS = int(os.environ.get('PROFILE_MAX_REQUESTS', '1000'))
+PROFILE_MAX_SECONDS = float(os.environ.get('PROFILE_MAX_SECONDS', '300'))
+MODES = ('cprofile', 'sampling')
+
+
+class ProfilerBusy(RuntimeError):
+    pass
+
+
+def collapse(frame):
+    """One stack, root first, in collapsed ("folded") format."""
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f'{code.co_name} ({code.co_filename}:{code.co_firstlineno})')
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+
+class StackSampler(threading.Thread):
+    """Samples the stacks of `threads` (or of every other thread) every `interval` s."""
+
+    def __init__(self, interval, all_threads=False):
+        super().__init__(daemon=True, name='profile-sampler')
+        self.interval = interval
+        self.all_threads = all_threads
+        self.threads = set()
+        self.counts = Counter()
+        self.samples = 0
+        self._stop_event = threading.Event()
+
+    def run(self):
+        me = threading.get_ident()
+        while not self._stop_event.wait(self.interval):
+            frames = sys._current_frames()
+            idents = frames.keys() if self.all_threads else list(self.threads)
+            for ident in idents:
+                frame = frames.get(ident)
+                if frame is not None and ident != me:
+                    self.counts[collapse(frame)] += 1
+            self.samples += 1
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+    def write(self, path):
+        with open(path, 'w', encoding='utf-8') as f:
+            for stack, count in self.counts.most_common():
+                f.write(f'{stack} {count}\n')
+
+
+class ProfileSession:
+    """Profiles the next `requests` requests or every request for `seconds`.
+
+    cprofile profiles each request in its own thread and merges them into one
+    pstats file. sampling snapshots stacks every PROFILE_SAMPLE_MS: the
+    threads serving requests in request mode, every thread (including
+    background /train jobs) in a time window. Work a request hands to another
+    thread (the search pool) is profiled too when it goes through `follow`.
+    """
+
+    def __init__(self, mode, requests=None, seconds=None, endpoints=None,
+                 out_dir=PROFILE_DIR, interval_ms=PROFILE_SAMPLE_MS):
+        self.mode = mode
+        self.max_requests = requests
+        self.deadline = time.monotonic() + seconds if seconds else None
+        self.endpoints = set(endpoints) if endpoints else None
+        self.out_dir = out_dir
+        now = time.time()
+        self.started_at = time.strftime('%Y%m%d-%H%M%S', time.localtime(now)) + f'{now % 1:.3f}'[1:]
+        self.started = 0
+        self.finished = 0
+        self.skipped = 0
+        self._stats = None
+        self._lock = threading.Lock()
+        self.sampler = None
+        if mode == 'sampling':
+            self.sampler = StackSampler(interval_ms / 1000, all_threads=requests is None)
+            self.sampler.start()
+
+    def expired(self):
+        if self.deadline is not None and time.monotonic() >= self.deadline:
+            return True
+        return self.max_requests is not None and self.finished >= self.max_requests
+
+    def begin(self, endpoint):
+        """Token for a request that gets profiled, None for one that doesn't."""
+        if self.endpoints is not None and endpoint not in self.endpoints:
+            return None
+        with self._lock:
+            if self.max_requests is not None and self.started >= self.max_requests:
+                return None
+            self.started += 1
+        token = self._attach()
+        if token is None:
+            with self._lock:
+                self.started -= 1
+                self.skipped += 1
+        return token
+
+    def end(self, token):
+        self._detach(token)
+        with self._lock:
+            self.finished += 1
+
+    def follow(self, fn):
+        """`fn`, profiled as part of this session on whichever thread runs it."""
+        def run(*args, **kwargs):
+            token = self._attach()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                if token is not None:
+                    self._detach(token)
+        return run
+
+    def _attach(self):
+        # start watching the calling thread; None if it can't be profiled
+        if self.sampler is not None:
+            self.sampler.threads.add(threading.get_ident())
+            return threading.get_ident()
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # Python 3.12+: only one cProfile can run at a time (concurrent request)
+            return None
+        return profile
+
+    def _detach(self, token):
+        if self.sampler is not None:
+            self.sampler.threads.discard(token)
+            return
+        token.disable()
+        with self._lock:
+            if self._stats is None:
+                self._stats = pstats.Stats(token)
+            else:
+                self._stats.add(token)
+
+    def write(self):
+        """Stop sampling and write the output file; returns a summary."""
+        os.makedirs(self.out_dir, exist_ok=True)
+        path = os.path.join(self.out_dir, f'{os.getpid()}-{self.started_at}-{self.mode}')
+        summary = {'mode': self.mode, 'pid': os.getpid(), 'requests': self.finished,
+                   'skipped': self.skipped, 'file': None}
+        if self.sampler is not None:
+            self.sampler.stop()
+            summary['samples'] = self.sampler.samples
+            if self.sampler.counts:
+                summary['file'] = path + '.collapsed'
+                self.sampler.write(summary['file'])
+        elif self._stats is not None:
+            summary['file'] = path + '.prof'
+            self._stats.dump_stats(summary['file'])
+        return summary
+
+
+class Profiler:
+    """At most one ProfileSession per worker process.
+
+    The request hooks only look at `session`, so nothing is profiled (and
+    nothing is measured) while it is None.
+    """
+
+    def __init__(self, out_dir=PROFILE_DIR):
+        self.out_dir = out_dir
+        self.session = None
+        self.history = []
+        self._lock = threading.Lock()
+        self._timer = None
+
+    def start(self, mode='sampling', requests=None, seconds=None, endpoints=None):
+        if mode not in MODES:
+            raise ValueError(f"mode must be one of {', '.join(MODES)}")
+        if (requests is None) == (seconds is None):
+            raise ValueError('give either requests or seconds')
+        if requests is not None and not 1 <= requests <= PROFILE_MAX_REQUESTS:
+            raise ValueError(f'requests must be between 1 and {PROFILE_MAX_REQUESTS}')
+        if seconds is not None and not 0 < seconds <= PROFILE_MAX_SECONDS:
+            raise ValueError(f'seconds must be > 0 and <= {PROFILE_MAX_SECONDS}')
+        with self._lock:
+            if self.session is not None:
+                raise ProfilerBusy('a profile is already running in this worker')
+            session = ProfileSession(mode, requests, seconds, endpoints, self.out_dir)
+            self.session = session
+            if seconds is not None:
+                # the window ends on time even if no request arrives
+                self._timer = threading.Timer(seconds, self._finish, args=(session,))
+                self._timer.daemon = True
+                self._timer.start()
+        return self.status()
+
+    def begin(self, endpoint):
+        session = self.session
+        if session is None:
+            return None
+        token = session.begin(endpoint)
+        return None if token is None else (session, token)
+
+    def follow(self, handle, fn):
+        """`fn` profiled with the request `handle` belongs to (for work run on a pool)."""
+        session, _ = handle
+        return session.follow(fn)
+
+    def end(self, handle):
+        session, token = handle
+        session.end(token)
+        if session.expired():
+            self._finish(session)
+
+    def stop(self):
+        """End the running session now; returns its summary (None if idle)."""
+        session = self.session
+        return self._finish(session) if session is not None else None
+
+    def _finish(self, session):
+        with self._lock:
+            if self.session is not session:
+                return None  # already finished
+            self.session = None
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+        summary = session.write()
+        self.history = (self.history + [summary])[-10:]
+        print(f"profile finished: {summary}")
+        return summary
+
+    def status(self):
+        session = self.session
+        active = None
+        if session is not None:
+            active = {'mode': session.mode, 'requests': session.finished,
+                      'max_requests': session.max_requests,
+                      'seconds_left': (round(max(0.0, session.deadline - time.monotonic()), 1)
+                                       if session.deadline is not None else None),
+                      'endpoints': sorted(session.endpoints) if session.endpoints else None}
+        return {'pid': os.getpid(), 'active': active, 'finished': list(self.history)}
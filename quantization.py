@@ -0,0 +1,190 @@
+import os
+
+import numpy as np
+
+# Encoding of the vector block in the .fidx index:
+#   float32 (exact), float16 (2x smaller), int8 (per-dimension scalar
+#   quantization, 4x) or pq (product quantization, ~32x by default).
+INDEX_ENCODING = os.environ.get('INDEX_ENCODING', 'float32')
+# PQ: dimensions per sub-quantizer (8 dims -> 1 byte instead of 32)
+PQ_SUBVECTOR_DIM = int(os.environ.get('PQ_SUBVECTOR_DIM', '8'))
+# codes are widened to float32 this many values at a time (~4 MB, cache sized)
+SCORE_CHUNK_VALUES = 1 << 20
+
+
+def _chunks(codes):
+    step = max(1, SCORE_CHUNK_VALUES // max(1, codes.shape[1]))
+    for start in range(0, len(codes), step):
+        yield start, codes[start:start + step]
+
+
+class Float16Codec:
+    name = 'float16'
+
+    def fit(self, matrix):
+        return self
+
+    def encode(self, matrix):
+        return np.asarray(matrix, dtype=np.float16)
+
+    def decode(self, codes):
+        return np.asarray(codes, dtype=np.float32)
+
+    def scores(self, codes, query):
+        out = np.empty(len(codes), dtype=np.float32)
+        for start, block in _chunks(codes):
+            out[start:start + len(block)] = block.astype(np.float32) @ query
+        return out
+
+    def params(self):
+        return {}
+
+    @classmethod
+    def from_params(cls, params):
+        return cls()
+
+
+class Int8Codec:
+    """Per-dimension scalar quantization: x ~ offset + scale * code, code in 0..255."""
+    name = 'int8'
+
+    def __init__(self, offset=None, scale=None):
+        self.offset = offset
+        self.scale = scale
+
+    def fit(self, matrix):
+        matrix = np.asarray(matrix, dtype=np.float32)
+        lo, hi = matrix.min(axis=0), matrix.max(axis=0)
+        self.offset = lo.astype(np.float32)
+        self.scale = np.where(hi > lo, (hi - lo) / 255.0, 1.0).astype(np.float32)
+        return self
+
+    def encode(self, matrix):
+        codes = np.rint((np.asarray(matrix, dtype=np.float32) - self.offset) / self.scale)
+        return np.clip(codes, 0, 255).astype(np.uint8)
+
+    def decode(self, codes):
+        return self.offset + self.scale * np.asarray(codes, dtype=np.float32)
+
+    def scores(self, codes, query):
+        # (offset + scale*c) . q == c . (scale*q) + offset . q  -- no decode needed
+        scaled = self.scale * query
+        bias = float(self.offset @ query)
+        out = np.empty(len(codes), dtype=np.float32)
+        for start, block in _chunks(codes):
+            out[start:start + len(block)] = block.astype(np.float32) @ scaled + bias
+        return out
+
+    def params(self):
+        return {'offset': self.offset, 'scale': self.scale}
+
+    @classmethod
+    def from_params(cls, params):
+        return cls(params['offset'], params['scale'])
+
+
+def _kmeans(x, k, iters=10, seed=0):
+    """Plain (Euclidean) k-means used to train PQ codebooks."""
+    rng = np.random.default_rng(seed)
+    centroids = x[rng.choice(len(x), k, replace=False)].copy()
+    for _ in range(iters):
+        assign = _nearest(x, centroids)
+        counts = np.bincount(assign, minlength=k)
+        sums = np.stack([np.bincount(assign, weights=x[:, d], minlength=k)
+                         for d in range(x.shape[1])], axis=1)
+        filled = counts > 0
+        centroids[filled] = (sums[filled] / counts[filled, None]).astype(np.float32)
+        if (~filled).any():
+            centroids[~filled] = x[rng.choice(len(x), int((~filled).sum()))]
+    return centroids
+
+
+def _nearest(x, centroids):
+    # argmin ||x - c||^2 == argmin (||c||^2 - 2 x.c)
+    return np.argmin((centroids ** 2).sum(axis=1) - 2 * x @ centroids.T, axis=1)
+
+
+class PQCodec:
+    """Product quantization with asymmetric distance computation (ADC).
+
+    Vectors are cut into `m` sub-vectors, each replaced by the id of its
+    nearest of 256 sub-centroids. A query is scored against the codes through
+    an (m x 256) table of sub-query . sub-centroid dot products.
+    """
+    name = 'pq'
+
+    def __init__(self, codebooks=None, sample_size=8192):
+        self.codebooks = codebooks
+        self.sample_size = sample_size
+
+    def fit(self, matrix):
+        matrix = np.asarray(matrix, dtype=np.float32)
+        n, dim = matrix.shape
+        dsub = PQ_SUBVECTOR_DIM if dim % PQ_SUBVECTOR_DIM == 0 else 1
+        m = dim // dsub
+        ksub = min(256, n)
+        rng = np.random.default_rng(0)
+        sample = matrix[rng.choice(n, min(n, self.sample_size), replace=False)]
+        self.codebooks = np.stack([
+            _kmeans(sample[:, j * dsub:(j + 1) * dsub], ksub) for j in range(m)
+        ]).astype(np.float32)
+        return self
+
+    @property
+    def m(self):
+        return self.codebooks.shape[0]
+
+    def encode(self, matrix):
+        matrix = np.asarray(matrix, dtype=np.float32)
+        dsub = self.codebooks.shape[2]
+        codes = np.empty((len(matrix), self.m), dtype=np.uint8)
+        for j in range(self.m):
+            codes[:, j] = _nearest(matrix[:, j * dsub:(j + 1) * dsub], self.codebooks[j])
+        return codes
+
+    def decode(self, codes):
+        codes = np.asarray(codes)
+        parts = [self.codebooks[j][codes[..., j]] for j in range(self.m)]
+        return np.concatenate(parts, axis=-1)
+
+    def scores(self, codes, query):
+        dsub = self.codebooks.shape[2]
+        table = np.einsum('jkd,jd->jk', self.codebooks, query.reshape(self.m, dsub))
+        cols = np.arange(self.m)
+        out = np.empty(len(codes), dtype=np.float32)
+        for start, block in _chunks(codes):
+            out[start:start + len(block)] = table[cols, block].sum(axis=1)
+        return out
+
+    def params(self):
+        return {'codebooks': self.codebooks}
+
+    @classmethod
+    def from_params(cls, params):
+        return cls(params['codebooks'])
+
+
+CODECS = {c.name: c for c in (Float16Codec, Int8Codec, PQCodec)}
+
+
+def make_codec(encoding):
+    """Codec for an encoding name; None means plain float32."""
+    if encoding in (None, 'float32'):
+        return None
+    if encoding not in CODECS:
+        raise ValueError(f"Unknown index encoding '{encoding}' (use float32, {', '.join(CODECS)})")
+    return CODECS[encoding]()
+
+
+def measure_recall(exact, approx, queries=200, k=10, seed=0):
+    """recall@k of `approx` against `exact` (two FeatureIndex over one corpus)."""
+    if not len(exact):
+        return 1.0
+    rng = np.random.default_rng(seed)
+    picks = rng.choice(len(exact), min(queries, len(exact)), replace=False)
+    hits = 0
+    for i in picks:
+        q = exact.matrix[i]
+        expected = {r['image_path'] for r in exact.search(q, -1.0, k)}
+        hits += len(expected & {r['image_path'] for r in approx.search(q, -1.0, k)})
+    return hits / (len(picks) * min(k, len(exact)))
@@ -0,0 +1,107 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+QUERY_CACHE_SIZE = int(os.environ.get('QUERY_CACHE_SIZE', '256'))
+QUERY_CACHE_TTL = float(os.environ.get('QUERY_CACHE_TTL', '600'))
+
+
+class QueryCache:
+    """LRU + TTL cache for /search, keyed by the content hash of the upload.
+
+    Concurrent lookups of a key that is still being computed wait for that
+    computation instead of starting their own. `invalidate()` (called when the
+    feature index is reloaded) drops everything, including in-flight work, so
+    later lookups start a fresh computation; a generation counter keeps
+    results computed against the old index from being stored.
+    """
+
+    def __init__(self, max_entries=QUERY_CACHE_SIZE, ttl=QUERY_CACHE_TTL, on_event=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        # optional callback('hit' | 'miss' | 'coalesced' | 'corpus_hit'), e.g. metrics
+        self.on_event = on_event
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.corpus_hits = 0
+        self._entries = OrderedDict()
+        self._inflight = {}
+        self._lock = threading.Lock()
+
+    def get_or_compute(self, key, compute):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires, value = entry
+                if expires > time.monotonic():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    self._event('hit')
+                    return value
+                del self._entries[key]
+            waiting = self._inflight.get(key)
+            if waiting is None:
+                self.misses += 1
+                self._event('miss')
+                future = self._inflight[key] = Future()
+                generation = self.generation
+            else:
+                self.coalesced += 1
+                self._event('coalesced')
+        if waiting is not None:
+            return waiting.result()
+
+        try:
+            value = compute()
+        except BaseException as e:
+            with self._lock:
+                self._forget(key, future)
+            future.set_exception(e)
+            raise
+        with self._lock:
+            self._forget(key, future)
+            if generation == self.generation and self.max_entries > 0:
+                self._entries[key] = (time.monotonic() + self.ttl, value)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+        future.set_result(value)
+        return value
+
+    def _forget(self, key, future):
+        # after an invalidate() the key may already belong to a newer computation
+        if self._inflight.get(key) is future:
+            del self._inflight[key]
+
+    def _event(self, outcome):
+        if self.on_event is not None:
+            self.on_event(outcome)
+
+    def record_corpus_hit(self):
+        with self._lock:
+            self.corpus_hits += 1
+            self._event('corpus_hit')
+
+    def invalidate(self):
+        with self._lock:
+            self.generation += 1
+            self._entries.clear()
+            # callers already waiting on in-flight work still get its (old
+            # index) answer; new callers no longer join it
+            self._inflight.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'ttl_seconds': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'coalesced': self.coalesced,
+                'corpus_hits': self.corpus_hits,
+                'generation': self.generation,
+            }
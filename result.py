@@ -1,51 +1,58 @@
-import pickle
 import numpy as np
-from sklearn.metrics.pairwise import cosine_similarity
 from keras.preprocessing import image
-from tensorflow.keras.applications import ResNet50
 from tensorflow.keras.applications.resnet50 import preprocess_input
 import sys
+from feature_index import FeatureIndex, load_features
+from model_registry import get_model
+from batcher import MicroBatcher
+from image_decode import pil_load
 
 # Đặt mã hóa UTF-8 cho đầu ra
 sys.stdout.reconfigure(encoding='utf-8')
 
-# Load pre-trained ResNet50 model
-model = ResNet50(weights='imagenet', include_top=False, pooling='avg')
+# Pre-trained ResNet50 comes from model_registry: one copy per process, shared
+# with dactrung.py, built on first use (or at startup with PRELOAD_MODEL=1)
 
 # Function to extract features from an image using the pre-trained model
 def extract_features(img_path):
-    img = image.load_img(img_path, target_size=(224, 224))
-    img_array = image.img_to_array(img)
-    img_array = np.expand_dims(img_array, axis=0)
-    img_array = preprocess_input(img_array)
-    
-    features = model.predict(img_array)
-    return features.flatten()
+    return extract_features_from_array(image.img_to_array(pil_load(img_path)))
+
+# Giải mã ảnh upload trực tiếp từ bộ nhớ (không ghi file tạm), resize như load_img
+def decode_image(data):
+    return image.img_to_array(pil_load(data))
+
+# Function to extract features for many decoded images with one batched predict
+def extract_features_batch(img_arrays):
+    batch = preprocess_input(np.stack(img_arrays))
+    return get_model().predict(batch, batch_size=len(img_arrays), verbose=0)
+
+# Concurrent queries (threaded workers) share one predict call, see batcher.py
+query_batcher = MicroBatcher(extract_features_batch)
+
+# Function to extract features from an already decoded 224x224x3 array
+def extract_features_from_array(img_array):
+    return np.asarray(query_batcher(img_array)).flatten()
 
 # Function to load saved features
+# (.fidx is memory-mapped and shared between workers; .pkl is the legacy format)
 def load_saved_features(features_file):
-    with open(features_file, 'rb') as f:
-        features_dict = pickle.load(f)
-    return features_dict
+    return load_features(features_file)
 
-# Function to find all similar images with a similarity score >= threshold (0.65 by default)
+# Function to find all similar images with a similarity score >= threshold (0.6 by default)
 def find_similar_images(query_image_path, features_dict, threshold=0.6):
     query_features = extract_features(query_image_path)
-    
-    similar_images = []
-    
-    for img_path, data_features in features_dict.items():
-        similarity = cosine_similarity([query_features], [data_features])[0][0]
-        # Chuyển similarity từ float32 sang float
-        similarity = float(similarity)  # Chuyển đổi float32 sang float
-        if similarity >= threshold:
-            similar_images.append({
-                "image_path": img_path,
-                "similarity": similarity
-            })
-    
-    # Sắp xếp theo độ tương đồng giảm dần
-    similar_images.sort(key=lambda x: x["similarity"], reverse=True)
-    
-    return similar_images
+    return find_similar_to_features(query_features, features_dict, threshold)
+
+def find_similar_to_features(query_features, features_dict, threshold=0.6):
+    # One matrix-vector product over the pre-normalized corpus, sorted by similarity
+    return FeatureIndex.coerce(features_dict).search(query_features, threshold)
+
+# One page (offset/limit, capped at k) of the ranking plus the total match count
+def find_similar_page(query_features, features_dict, threshold=0.6, k=None, offset=0, limit=None,
+                      timings=None):
+    return FeatureIndex.coerce(features_dict).search_page(query_features, threshold, k, offset, limit,
+                                                          timings)
 
+# Scores every query against the corpus in one (queries x corpus) matrix product
+def find_similar_batch(query_features, features_dict, threshold=0.6, k=None):
+    return FeatureIndex.coerce(features_dict).search_batch(query_features, threshold, k)
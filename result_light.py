@@ -1,29 +1,49 @@
-import pickle
 import cv2
 import numpy as np
-from sklearn.metrics.pairwise import cosine_similarity
+from feature_index import FeatureIndex, load_features
+from image_decode import HIST_DECODE_SIZE, REDUCED_DECODE, cv2_decode
+
+# bump when extraction changes so incremental builds re-extract everything
+# (reduced-scale decoding gives slightly different histograms)
+EXTRACTOR_ID = f'hsv-hist-8x8x8-r{HIST_DECODE_SIZE}-v1' if REDUCED_DECODE else 'hsv-hist-8x8x8-v1'
 
 # simple color-histogram based features to avoid heavy TF models
 def extract_features(img_path, bins=(8, 8, 8)):
-    img = cv2.imread(img_path)
+    img = cv2_decode(img_path)
     if img is None:
         raise ValueError(f"Cannot read image: {img_path}")
+    return extract_features_from_array(img, bins)
+
+# decode uploaded bytes in memory (no temp file); raises if they are not an image
+def decode_image(data):
+    img = cv2_decode(data)
+    if img is None:
+        raise ValueError("Cannot decode image data")
+    return img
+
+# same features as extract_features, from an already decoded BGR array
+def extract_features_from_array(img, bins=(8, 8, 8)):
     hsv = cv2.cvtColor(img, cv2.COLOR_BGR2HSV)
     hist = cv2.calcHist([hsv], [0, 1, 2], None, bins, [0, 180, 0, 256, 0, 256])
     cv2.normalize(hist, hist)
     return hist.flatten()
 
+# histograms for a list of decoded images (no batching gain for OpenCV)
+def extract_features_batch(images, bins=(8, 8, 8)):
+    return np.stack([extract_features_from_array(img, bins) for img in images])
+
 def load_saved_features(features_file):
-    with open(features_file, 'rb') as f:
-        return pickle.load(f)
+    # accepts the mmap index (.fidx) or a legacy pickle
+    return load_features(features_file)
 
 def find_similar_images(query_image_path, features_dict, threshold=0.6):
-    q = extract_features(query_image_path)
-    similar = []
-    for img_path, feat in features_dict.items():
-        sim = cosine_similarity([q], [feat])[0][0]
-        sim = float(sim)
-        if sim >= threshold:
-            similar.append({"image_path": img_path, "similarity": sim})
-    similar.sort(key=lambda x: x['similarity'], reverse=True)
-    return similar
+    return find_similar_to_features(extract_features(query_image_path), features_dict, threshold)
+
+def find_similar_to_features(q, features_dict, threshold=0.6):
+    return FeatureIndex.coerce(features_dict).search(q, threshold)
+
+def find_similar_page(q, features_dict, threshold=0.6, k=None, offset=0, limit=None, timings=None):
+    return FeatureIndex.coerce(features_dict).search_page(q, threshold, k, offset, limit, timings)
+
+def find_similar_batch(queries, features_dict, threshold=0.6, k=None):
+    return FeatureIndex.coerce(features_dict).search_batch(queries, threshold, k)
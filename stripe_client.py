@@ -0,0 +1,141 @@
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+import requests
+from requests.adapters import HTTPAdapter
+
+STRIPE_API_URL = os.environ.get('STRIPE_API_URL', 'https://api.stripe.com/v1')
+# (connect, read) seconds for one attempt
+STRIPE_CONNECT_TIMEOUT = float(os.environ.get('STRIPE_CONNECT_TIMEOUT', '3.05'))
+STRIPE_READ_TIMEOUT = float(os.environ.get('STRIPE_READ_TIMEOUT', '20'))
+STRIPE_MAX_RETRIES = int(os.environ.get('STRIPE_MAX_RETRIES', '2'))
+# a whole call (every attempt, backoff and Retry-After wait) gives up after about
+# this many seconds; this, not the per-attempt timeouts, bounds how long a slow
+# or failing Stripe holds a worker thread
+STRIPE_CALL_DEADLINE = float(os.environ.get('STRIPE_CALL_DEADLINE', '25'))
+# longest Retry-After (seconds) honoured before retrying
+STRIPE_RETRY_AFTER_MAX = float(os.environ.get('STRIPE_RETRY_AFTER_MAX', '5'))
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+STRIPE_POOL_SIZE = int(os.environ.get('STRIPE_POOL_SIZE', '10'))
+# payment intents in these states never change again, so their lookups are cached
+TERMINAL_INTENT_STATUSES = ('succeeded', 'canceled')
+INTENT_CACHE_SIZE = 1024
+INTENT_CACHE_TTL = float(os.environ.get('STRIPE_INTENT_CACHE_TTL', '3600'))
+
+
+class StripeError(Exception):
+    """A Stripe call failed; `status_code` is None when Stripe was unreachable."""
+
+    def __init__(self, status_code, details):
+        super().__init__(details)
+        self.status_code = status_code
+        self.details = details
+
+
+class StripeClient:
+    """Thin Stripe REST client shared by the payment routes.
+
+    One pooled keep-alive session, (connect, read) timeouts on every attempt
+    and bounded retries with exponential backoff on connection errors, 429
+    and 5xx, all within one `deadline` per call. POSTs always carry an
+    Idempotency-Key, which is what makes retrying them safe. Terminal payment
+    intent lookups are cached in memory.
+    """
+
+    def __init__(self, secret_key, api_url=STRIPE_API_URL,
+                 timeout=(STRIPE_CONNECT_TIMEOUT, STRIPE_READ_TIMEOUT),
+                 max_retries=STRIPE_MAX_RETRIES, backoff_factor=0.5, pool_size=STRIPE_POOL_SIZE,
+                 on_request=None, deadline=STRIPE_CALL_DEADLINE,
+                 retry_after_max=STRIPE_RETRY_AFTER_MAX):
+        self.api_url = api_url.rstrip('/')
+        # optional callback(operation, seconds, outcome) for every call, e.g. metrics
+        self.on_request = on_request
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self.deadline = deadline
+        self.retry_after_max = retry_after_max
+        self.session = requests.Session()
+        self.session.headers['Authorization'] = f'Bearer {secret_key}'
+        # retries happen in _request, where they can be held to the deadline
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.intent_cache_hits = 0
+        self._intents = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _retry_wait(self, attempt, response):
+        """Seconds to sleep before retry number `attempt + 1`."""
+        wait = self.backoff_factor * 2 ** attempt
+        if response is not None and response.headers.get('Retry-After'):
+            try:
+                wait = max(wait, float(response.headers['Retry-After']))
+            except ValueError:
+                pass  # HTTP-date form: keep the backoff
+        return min(wait, self.retry_after_max) if response is not None else wait
+
+    def _request(self, method, path, operation, **kwargs):
+        start = time.perf_counter()
+        deadline = time.monotonic() + self.deadline
+        outcome = 'error'
+        try:
+            for attempt in range(self.max_retries + 1):
+                # each attempt only gets what is left of the call's deadline
+                left = max(0.01, deadline - time.monotonic())
+                timeout = tuple(min(t, left) for t in self.timeout)
+                response, error = None, None
+                try:
+                    response = self.session.request(method, f'{self.api_url}{path}',
+                                                    timeout=timeout, **kwargs)
+                    outcome = str(response.status_code)
+                except (requests.ConnectionError, requests.Timeout) as e:
+                    outcome, error = 'error', e
+                except requests.RequestException as e:
+                    raise StripeError(None, str(e))
+                if response is not None and response.status_code not in RETRY_STATUSES:
+                    break
+                wait = self._retry_wait(attempt, response)
+                if attempt == self.max_retries or time.monotonic() + wait >= deadline:
+                    break
+                time.sleep(wait)
+            if error is not None:
+                raise StripeError(None, str(error))
+        finally:
+            if self.on_request is not None:
+                self.on_request(operation, time.perf_counter() - start, outcome)
+        if response.status_code != 200:
+            raise StripeError(response.status_code, response.text)
+        return response.json()
+
+    def post(self, path, data, idempotency_key=None, operation='post'):
+        # the same key on every retry: Stripe runs the request at most once
+        headers = {'Idempotency-Key': idempotency_key or str(uuid.uuid4())}
+        return self._request('POST', path, operation, data=data, headers=headers)
+
+    def get(self, path, operation='get'):
+        return self._request('GET', path, operation)
+
+    def create_payment_intent(self, data, idempotency_key=None):
+        return self.post('/payment_intents', data, idempotency_key, 'create_payment_intent')
+
+    def create_checkout_session(self, data, idempotency_key=None):
+        return self.post('/checkout/sessions', data, idempotency_key, 'create_checkout_session')
+
+    def retrieve_payment_intent(self, intent_id):
+        with self._lock:
+            cached = self._intents.get(intent_id)
+            if cached is not None and cached[0] > time.monotonic():
+                self._intents.move_to_end(intent_id)
+                self.intent_cache_hits += 1
+                return cached[1]
+        intent = self.get(f'/payment_intents/{intent_id}', 'retrieve_payment_intent')
+        if intent.get('status') in TERMINAL_INTENT_STATUSES:
+            with self._lock:
+                self._intents[intent_id] = (time.monotonic() + INTENT_CACHE_TTL, intent)
+                while len(self._intents) > INTENT_CACHE_SIZE:
+                    self._intents.popitem(last=False)
+        return intent
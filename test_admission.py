@@ -0,0 +1,55 @@
+import threading
+import time
+
+import pytest
+
+from admission import AdmissionPool, Saturated
+
+
+def test_runs_on_pool_and_reraises():
+    pool = AdmissionPool(workers=2, queue_depth=2)
+    assert pool.run(lambda x: threading.current_thread().name.startswith('search-pool') and x, 7) == 7
+    with pytest.raises(ZeroDivisionError):
+        pool.run(lambda: 1 / 0)
+    assert pool.stats()['completed'] == 2 and pool.stats()['inflight'] == 0
+
+
+def test_rejects_beyond_concurrency_plus_queue():
+    pool = AdmissionPool(workers=1, queue_depth=1, queue_timeout=10)
+    release = threading.Event()
+    threads = [threading.Thread(target=pool.run, args=(release.wait,)) for _ in range(2)]
+    for t in threads:
+        t.start()
+    while pool.stats()['inflight'] < 2:
+        time.sleep(0.01)
+    start = time.perf_counter()
+    with pytest.raises(Saturated) as e:
+        pool.run(lambda: None)
+    assert time.perf_counter() - start < 0.1  # rejected at once, not queued
+    assert e.value.reason == 'full' and e.value.retry_after >= 1
+    release.set()
+    for t in threads:
+        t.join()
+    assert pool.stats()['rejected'] == 1 and pool.stats()['inflight'] == 0
+    assert pool.run(lambda: 'ok') == 'ok'
+
+
+def test_queued_task_times_out_without_running():
+    pool = AdmissionPool(workers=1, queue_depth=4, queue_timeout=0.1)
+    release = threading.Event()
+    blocker = threading.Thread(target=pool.run, args=(release.wait,))
+    blocker.start()
+    while pool.stats()['inflight'] < 1:
+        time.sleep(0.01)
+    ran = []
+    with pytest.raises(Saturated) as e:
+        pool.run(ran.append, 1)
+    assert e.value.reason == 'timeout'
+    release.set()
+    blocker.join()
+    assert not ran and pool.stats()['timed_out'] == 1 and pool.stats()['inflight'] == 0
+
+
+def test_running_task_is_not_cut_off():
+    pool = AdmissionPool(workers=1, queue_depth=0, queue_timeout=0.05)
+    assert pool.run(lambda: time.sleep(0.2) or 'done') == 'done'
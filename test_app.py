@@ -0,0 +1,302 @@
+import importlib
+import io
+import os
+import sys
+import threading
+import time
+
+import cv2
+import numpy as np
+import pytest
+
+from admission import AdmissionPool
+
+
+@pytest.fixture(scope='module')
+def app_module(tmp_path_factory, image_files):
+    """The Flask app, imported in a scratch directory with a small light index."""
+    from build_features_light import extract_batch
+    from feature_manifest import update_features
+    from result_light import EXTRACTOR_ID
+
+    root = tmp_path_factory.mktemp('app')
+    cwd = os.getcwd()
+    env = {'LIGHT_MODE': '1', 'FEATURES_FILE': 'features_light.pkl', 'ADMIN_TOKEN': 'test-token',
+           'ORDERS_DB': str(root / 'orders.db'), 'THUMB_CACHE_DIR': str(root / '.thumbs'),
+           'PROFILE_DIR': str(root / 'profiles')}
+    saved = {name: os.environ.get(name) for name in env}
+    os.environ.update(env)
+    os.chdir(root)
+    try:
+        image_files('data', 12, size=(320, 240))
+        update_features('data', 'features_light.pkl', extract_batch, EXTRACTOR_ID, full=True)
+        sys.modules.pop('app', None)
+        module = importlib.import_module('app')
+        yield module
+    finally:
+        os.chdir(cwd)
+        for name, value in saved.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+
+
+def upload(path):
+    img = cv2.imread(path)
+    return cv2.imencode('.jpg', img[2:, 2:])[1].tobytes()
+
+
+def test_default_pool_leaves_threads_for_other_routes():
+    import admission
+    pool = AdmissionPool()
+    assert pool.workers + pool.queue_depth <= admission.WORKER_THREADS - admission.SEARCH_RESERVED_THREADS
+    # explicit settings are capped as well
+    pool = AdmissionPool(workers=64, queue_depth=64, max_admitted=6)
+    assert pool.workers + pool.queue_depth == 6
+
+
+def test_full_search_pool_answers_503_and_other_routes_still_answer(app_module, monkeypatch):
+    pool = AdmissionPool(workers=1, queue_depth=0, max_admitted=1)
+    monkeypatch.setattr(app_module, 'search_pool', pool)
+    release = threading.Event()
+    original = app_module.embed_query
+    monkeypatch.setattr(app_module, 'embed_query',
+                        lambda *args: release.wait(10) and original(*args))
+    images = sorted(os.listdir('data'))
+    client = app_module.app.test_client()
+    slow = {}
+
+    def first_search():
+        slow['status'] = app_module.app.test_client().post(
+            '/search', data={'file': (io.BytesIO(upload(os.path.join('data', images[0]))), 'a.jpg')}
+        ).status_code
+
+    thread = threading.Thread(target=first_search)
+    thread.start()
+    try:
+        while pool.stats()['inflight'] < 1:
+            time.sleep(0.01)
+        start = time.perf_counter()
+        response = client.post(
+            '/search', data={'file': (io.BytesIO(upload(os.path.join('data', images[1]))), 'b.jpg')})
+        assert response.status_code == 503
+        assert int(response.headers['Retry-After']) >= 1
+        assert time.perf_counter() - start < 1
+        assert client.get('/status').status_code == 200
+        assert client.get('/payment/orders').status_code == 200
+    finally:
+        release.set()
+        thread.join()
+    assert slow['status'] == 200
+
+
+def test_profiler_follows_search_onto_the_pool(app_module):
+    import pstats
+    client = app_module.app.test_client()
+    auth = {'Authorization': 'Bearer test-token'}
+    response = client.post('/admin/profile', json={'mode': 'cprofile', 'requests': 1,
+                                                    'endpoints': ['search_image']}, headers=auth)
+    assert response.status_code == 202
+    image = sorted(os.listdir('data'))[3]
+    response = client.post('/search?threshold=0',
+                           data={'file': (io.BytesIO(upload(os.path.join('data', image))), 'c.jpg')})
+    assert response.status_code == 200
+    summary = client.get('/admin/profile', headers=auth).get_json()['finished'][-1]
+    functions = {func[2] for func in pstats.Stats(summary['file']).stats}
+    # run on search_pool threads, not on the request thread
+    assert {'embed_query', 'search_page'} <= functions
+
+
+def test_concurrent_requests_reload_the_index_once(app_module, monkeypatch):
+    loads = []
+    original = app_module.load_saved_features
+
+    def slow_load(path):
+        loads.append(path)
+        time.sleep(0.2)
+        return original(path)
+
+    monkeypatch.setattr(app_module, 'load_saved_features', slow_load)
+    old = app_module.corpus
+    st = os.stat(old.file)
+    os.utime(old.file, ns=(st.st_atime_ns, st.st_mtime_ns + 10 ** 9))
+    threads = [threading.Thread(target=app_module.reload_features_if_changed) for _ in range(6)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len(loads) == 1
+    new = app_module.corpus
+    assert new is not old and new.mtime == os.stat(new.file).st_mtime_ns
+    assert len(new.features) == len(old.features)
+
+
+def test_status_revalidates_by_etag_only(app_module):
+    client = app_module.app.test_client()
+    first = client.get('/status')
+    assert first.status_code == 200 and 'Last-Modified' not in first.headers
+    # If-Modified-Since alone can't vouch for the stats in the body
+    later = client.get('/status', headers={'If-Modified-Since': 'Fri, 01 Jan 2100 00:00:00 GMT'})
+    assert later.status_code == 200
+
+
+def test_orders_revalidate_by_etag_only(app_module):
+    client = app_module.app.test_client()
+    first = client.get('/payment/orders')
+    assert 'Last-Modified' not in first.headers
+    assert client.get('/payment/orders', headers={'If-None-Match': first.headers['ETag']}).status_code == 304
+    # an order added in the same second as the newest one must not be hidden
+    app_module.order_store.add_order({'order_id': 'o-etag', 'payment_intent_id': 'pi_etag',
+                                      'email': 'a@example.com', 'created_at': '2100-01-01T00:00:00'})
+    again = client.get('/payment/orders', headers={'If-None-Match': first.headers['ETag'],
+                                                   'If-Modified-Since': 'Fri, 01 Jan 2100 00:00:00 GMT'})
+    assert again.status_code == 200
+    assert [o['order_id'] for o in again.get_json()['orders']][-1] == 'o-etag'
+
+
+@pytest.mark.parametrize('query', ['k=abc', 'k=0', 'threshold=-0.5', 'threshold=nan', 'threshold=x'])
+def test_batch_search_rejects_invalid_parameters(app_module, query):
+    image = os.path.join('data', sorted(os.listdir('data'))[0])
+    response = app_module.app.test_client().post(
+        f'/search/batch?{query}', data={'files': [(io.BytesIO(upload(image)), 'a.jpg')]})
+    assert response.status_code == 400
+    assert 'Invalid search parameter' in response.get_json()['error']
+
+
+def test_batch_search_defaults(app_module):
+    images = [os.path.join('data', name) for name in sorted(os.listdir('data'))[:2]]
+    response = app_module.app.test_client().post(
+        '/search/batch?k=3&threshold=0',
+        data={'files': [(io.BytesIO(upload(p)), os.path.basename(p)) for p in images]})
+    assert response.status_code == 200
+    assert [len(r['similar_images']) for r in response.get_json()['results']] == [3, 3]
+
+
+class SlowStream(io.BytesIO):
+    """A request body that arrives slowly (a client on a bad connection)."""
+
+    def read(self, *args):
+        time.sleep(0.02)
+        return super().read(*args)
+
+    def readline(self, *args):
+        time.sleep(0.02)
+        return super().readline(*args)
+
+    def readinto(self, buffer):
+        time.sleep(0.02)
+        return super().readinto(memoryview(buffer)[:512])
+
+
+def test_receive_stage_includes_reading_the_upload(app_module):
+    from prometheus_client import REGISTRY
+    image = upload(os.path.join('data', sorted(os.listdir('data'))[5]))
+    boundary = 'slowboundary'
+    body = (f'--{boundary}\r\nContent-Disposition: form-data; name="file"; filename="s.jpg"\r\n'
+            f'Content-Type: image/jpeg\r\n\r\n').encode() + image + f'\r\n--{boundary}--\r\n'.encode()
+    stream = SlowStream(body)
+
+    def receive_sum():
+        return REGISTRY.get_sample_value('petsearch_search_stage_seconds_sum', {'stage': 'receive'}) or 0.0
+
+    before = receive_sum()
+    start = time.perf_counter()
+    response = app_module.app.test_client().post(
+        '/search', environ_overrides={'wsgi.input': stream, 'CONTENT_LENGTH': str(len(body)),
+                                      'CONTENT_TYPE': f'multipart/form-data; boundary={boundary}'})
+    elapsed = time.perf_counter() - start
+    assert response.status_code in (200, 404)
+    assert stream.tell() == len(body)
+    # most of the request was spent receiving the body, and that is what gets reported
+    assert receive_sum() - before >= 0.5 * elapsed
+
+
+def test_reload_during_a_build_keeps_the_old_index(app_module, monkeypatch):
+    import ann_index
+    import feature_index
+    for module in (ann_index, feature_index):
+        monkeypatch.setattr(module, 'SEARCH_BACKEND', 'ivf')
+        monkeypatch.setattr(module, 'ANN_MIN_SIZE', 1)
+    loads = []
+    original_load = app_module.load_saved_features
+    monkeypatch.setattr(app_module, 'load_saved_features',
+                        lambda path: loads.append(path) or original_load(path))
+    old = app_module.corpus
+    seen = []
+
+    def reload_then(fn):
+        def run(*args, **kwargs):
+            app_module.reload_features_if_changed()
+            seen.append(app_module.corpus)
+            return fn(*args, **kwargs)
+        return run
+
+    monkeypatch.setattr(feature_index, 'build_ann', reload_then(feature_index.build_ann))
+    monkeypatch.setattr(feature_index, 'save_index', reload_then(feature_index.save_index))
+    time.sleep(0.01)
+    feature_index.save_features({p: np.array(v) for p, v in old.features.items()}, 'features_light.pkl')
+    # mid-build every reload check still found the old .fidx
+    assert seen == [old, old] and not loads
+    app_module.reload_features_if_changed()
+    new = app_module.corpus
+    assert loads == ['features_light.fidx'] and new.file == 'features_light.fidx'
+    assert new.features.ann is not None
+
+
+@pytest.fixture
+def served_from_here(app_module, monkeypatch):
+    # /image resolves paths against the app directory; here that is the scratch dir
+    monkeypatch.setattr(app_module.app, 'root_path', os.getcwd())
+    return app_module.app.test_client()
+
+
+@pytest.mark.parametrize('path', ['orders.db', 'features_light.pkl', '../outside.jpg',
+                                  'data/../../outside.jpg', 'data/missing.jpg'])
+def test_image_serves_nothing_but_corpus_images(app_module, served_from_here, path):
+    with open(os.path.join('..', 'outside.jpg'), 'wb') as f:
+        f.write(upload(os.path.join('data', sorted(os.listdir('data'))[0])))
+    assert served_from_here.get(f'/image/{path}').status_code == 404
+
+
+def test_image_revalidates_with_etag(app_module, served_from_here):
+    path = app_module.corpus.features.paths[0]
+    for query in ('', '?w=64'):
+        first = served_from_here.get(f'/image/{path}{query}')
+        assert first.status_code == 200 and first.headers['ETag']
+        again = served_from_here.get(f'/image/{path}{query}', headers={'If-None-Match': first.headers['ETag']})
+        assert again.status_code == 304
+
+
+def test_image_thumbnail_for_an_extensionless_corpus_image(app_module, served_from_here, monkeypatch):
+    from PIL import Image
+    from feature_index import FeatureIndex
+    os.makedirs('blobs', exist_ok=True)
+    with open(os.path.join('blobs', 'firebaseblob123'), 'wb') as f:
+        f.write(upload(os.path.join('data', sorted(os.listdir('data'))[0])))
+    current = app_module.corpus
+    features = FeatureIndex.from_dict({'blobs/firebaseblob123': current.features.vectors()[0]})
+    monkeypatch.setattr(app_module, 'corpus', current._replace(features=features))
+    response = served_from_here.get('/image/blobs/firebaseblob123?w=64')
+    assert response.status_code == 200 and response.mimetype == 'image/jpeg'
+    assert Image.open(io.BytesIO(response.data)).width == 64
+
+
+def test_light_build_counts_the_reloaded_index_without_loading_it_again(app_module, monkeypatch):
+    import subprocess
+    import feature_index
+
+    def fake_build(*args, **kwargs):
+        st = os.stat(app_module.corpus.file)
+        os.utime(app_module.corpus.file, ns=(st.st_atime_ns, st.st_mtime_ns + 10 ** 9))
+        return subprocess.CompletedProcess(args, 0, stdout='built\n', stderr='')
+
+    loads = []
+    original_load = app_module.load_saved_features
+    monkeypatch.setattr(app_module.subprocess, 'run', fake_build)
+    monkeypatch.setattr(app_module, 'load_saved_features',
+                        lambda path: loads.append(path) or original_load(path))
+    monkeypatch.setattr(feature_index, 'load_features', None)  # must not be called
+    result = app_module.run_light_build(lambda stage: None)
+    assert result == {'features_count': len(os.listdir('data')), 'output': 'built\n'}
+    assert len(loads) == 1
@@ -0,0 +1,48 @@
+import threading
+
+import pytest
+
+from batcher import MicroBatcher
+
+
+def run_concurrently(batcher, items):
+    results = [None] * len(items)
+    barrier = threading.Barrier(len(items))
+
+    def worker(i):
+        barrier.wait()
+        results[i] = batcher(items[i])
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(len(items))]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return results
+
+
+def test_concurrent_calls_are_batched_and_get_their_own_result():
+    sizes = []
+
+    def square_all(items):
+        sizes.append(len(items))
+        return [x * x for x in items]
+
+    batcher = MicroBatcher(square_all, max_batch=4, max_wait_ms=50)
+    assert run_concurrently(batcher, list(range(10))) == [x * x for x in range(10)]
+    assert sum(sizes) == 10 and max(sizes) <= 4 and len(sizes) < 10
+    assert batcher(3) == 9
+    assert batcher.stats()['items'] == 11
+
+
+def test_errors_reach_every_caller_and_batching_can_be_disabled():
+    def fail(items):
+        raise RuntimeError('model failed')
+
+    with pytest.raises(RuntimeError):
+        MicroBatcher(fail, max_batch=8, max_wait_ms=1)(1)
+
+    calls = []
+    direct = MicroBatcher(lambda items: calls.append(items) or items, max_batch=1)
+    assert run_concurrently(direct, [1, 2, 3]) == [1, 2, 3]
+    assert sorted(len(c) for c in calls) == [1, 1, 1]
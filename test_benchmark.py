@@ -0,0 +1,22 @@
+import numpy as np
+
+from benchmark import compare, write_synthetic_index
+from feature_index import load_features
+
+
+def test_compare_flags_slower_latency_and_lower_throughput():
+    baseline = {'search.n=1000.d=512.p50_ms': 1.0, 'extract.light.images_per_sec': 100.0,
+                'build.light.full_s': 2.0, 'only.in.baseline_ms': 1.0}
+    results = {'search.n=1000.d=512.p50_ms': 1.5, 'extract.light.images_per_sec': 70.0,
+               'build.light.full_s': 2.1}
+    assert [r[0] for r in compare(results, baseline, 0.2)] == [
+        'extract.light.images_per_sec', 'search.n=1000.d=512.p50_ms']
+    assert compare(results, baseline, 0.6) == []
+
+
+def test_synthetic_index_is_unit_norm_and_loadable(tmp_path):
+    index_file = str(tmp_path / 'synthetic.fidx')
+    write_synthetic_index(index_file, 300, 32, chunk=128)
+    index = load_features(index_file)
+    assert len(index) == 300 and index.dim == 32
+    assert np.allclose(np.linalg.norm(index.vectors(), axis=1), 1.0, atol=1e-5)
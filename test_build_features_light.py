@@ -0,0 +1,20 @@
+import numpy as np
+
+from build_features_light import extract_batch
+
+
+def test_parallel_build_matches_serial_and_skips_bad_images(tmp_path, image_files):
+    paths = image_files(str(tmp_path / 'data'), 9, size=(96, 64))
+    bad = str(tmp_path / 'data' / 'broken.jpg')
+    with open(bad, 'wb') as f:
+        f.write(b'not a jpeg')
+    paths.insert(4, bad)
+
+    serial = extract_batch(paths, workers=1)
+    parallel = extract_batch(paths, workers=3, chunksize=2)
+
+    expected = [p for p in paths if p != bad]
+    assert list(serial) == expected
+    assert list(parallel) == expected
+    for path in expected:
+        np.testing.assert_array_equal(parallel[path], serial[path])
@@ -0,0 +1,146 @@
+import pickle
+
+import numpy as np
+
+from ann_index import IVFIndex, build_ann
+from feature_index import FeatureIndex, index_path_for, load_features, save_index
+from quantization import measure_recall
+
+
+def make_features(n=50, dim=16, seed=0):
+    rng = np.random.default_rng(seed)
+    return {f'data/img_{i}.jpg': rng.random(dim, dtype=np.float32) for i in range(n)}
+
+
+def brute_force(query, features, threshold):
+    q = query / np.linalg.norm(query)
+    results = []
+    for path, feat in features.items():
+        sim = float(np.dot(q, feat / np.linalg.norm(feat)))
+        if sim >= threshold:
+            results.append((path, sim))
+    results.sort(key=lambda x: x[1], reverse=True)
+    return results
+
+
+def test_search_matches_brute_force():
+    features = make_features()
+    index = FeatureIndex.from_dict(features)
+    query = features['data/img_3.jpg']
+    expected = brute_force(query, features, 0.7)
+    got = index.search(query, threshold=0.7)
+    assert [r['image_path'] for r in got] == [p for p, _ in expected]
+    assert np.allclose([r['similarity'] for r in got], [s for _, s in expected], atol=1e-5)
+    assert got[0]['image_path'] == 'data/img_3.jpg'
+
+
+def test_top_k_is_prefix_of_full_ranking():
+    features = make_features()
+    index = FeatureIndex.from_dict(features)
+    query = features['data/img_7.jpg']
+    full = index.search(query, threshold=0.0)
+    assert index.search(query, threshold=0.0, k=5) == full[:5]
+
+
+def test_dict_compatible_api_and_empty_index():
+    features = make_features(n=3)
+    index = FeatureIndex.from_dict(features)
+    assert len(index) == 3
+    assert list(index.keys()) == list(features.keys())
+    assert 'data/img_1.jpg' in index
+    assert index['data/img_1.jpg'].dtype == np.float32
+    assert FeatureIndex.from_dict({}).search(np.ones(4), threshold=0.0) == []
+
+
+def test_index_file_roundtrip_is_memory_mapped(tmp_path):
+    features = make_features(n=20, dim=8)
+    index_file = str(tmp_path / 'features.fidx')
+    save_index(features, index_file)
+
+    loaded = load_features(index_file)
+    assert isinstance(loaded.matrix, np.memmap)
+    assert loaded.keys() == list(features.keys())
+    query = features['data/img_2.jpg']
+    assert loaded.search(query, threshold=0.5) == FeatureIndex.from_dict(features).search(query, threshold=0.5)
+
+
+def test_pickle_prefers_newer_index_next_to_it(tmp_path):
+    features = make_features(n=4, dim=8)
+    pkl_file = str(tmp_path / 'features.pkl')
+    with open(pkl_file, 'wb') as f:
+        pickle.dump(features, f)
+    assert not isinstance(load_features(pkl_file).matrix, np.memmap)
+
+    save_index(features, index_path_for(pkl_file))
+    assert isinstance(load_features(pkl_file).matrix, np.memmap)
+    assert len(load_features(str(tmp_path / 'features.fidx'))) == 4
+
+
+def test_ivf_search_with_all_cells_probed_matches_exact(tmp_path):
+    features = make_features(n=400, dim=16, seed=1)
+    exact = FeatureIndex.from_dict(features)
+    ann_file = str(tmp_path / 'features.ivf.npz')
+    ann = build_ann(exact, ann_file, nlist=8)
+    assert IVFIndex.load(ann_file).fingerprint == ann.fingerprint
+
+    approx = FeatureIndex(exact.paths, exact.matrix)
+    approx.ann = IVFIndex.load(ann_file)
+    query = features['data/img_5.jpg']
+    approx.nprobe = ann.nlist
+    assert approx.search(query, threshold=0.8, k=10) == exact.search(query, threshold=0.8, k=10)
+    approx.nprobe = 1
+    assert approx.search(query, threshold=0.0, k=1)[0]['image_path'] == 'data/img_5.jpg'
+
+
+def test_compressed_encodings_search_on_codes(tmp_path):
+    features = make_features(n=300, dim=32, seed=2)
+    exact = FeatureIndex.from_dict(features)
+    for encoding, min_recall in (('float16', 0.99), ('int8', 0.9), ('pq', 0.5)):
+        index_file = str(tmp_path / f'{encoding}.fidx')
+        save_index(exact, index_file, encoding=encoding)
+        loaded = load_features(index_file)
+        assert loaded.encoding == encoding
+        assert loaded.matrix.nbytes < exact.matrix.nbytes
+        assert loaded['data/img_0.jpg'].shape == (32,)
+        assert measure_recall(exact, loaded, queries=50) >= min_recall
+
+
+def test_search_batch_matches_single_queries():
+    features = make_features(n=120, dim=16, seed=3)
+    index = FeatureIndex.from_dict(features)
+    queries = [features['data/img_1.jpg'], features['data/img_9.jpg'], np.ones(16)]
+    batch = index.search_batch(queries, threshold=0.5, k=5)
+    assert len(batch) == 3
+    for got, query in zip(batch, queries):
+        expected = index.search(query, threshold=0.5, k=5)
+        assert [r['image_path'] for r in got] == [r['image_path'] for r in expected]
+        assert np.allclose([r['similarity'] for r in got], [r['similarity'] for r in expected], atol=1e-6)
+    assert index.search_batch(np.zeros((0, 16))) == []
+
+
+def test_search_page_counts_all_matches_and_slices_ranking():
+    features = make_features(n=80, dim=16, seed=4)
+    index = FeatureIndex.from_dict(features)
+    query = features['data/img_4.jpg']
+    full = index.search(query, threshold=0.7)
+
+    page, total = index.search_page(query, threshold=0.7, offset=2, limit=3)
+    assert total == len(full)
+    assert page == full[2:5]
+    page, total = index.search_page(query, threshold=0.7, k=4, offset=2, limit=10)
+    assert page == full[2:4] and total == len(full)
+    assert index.search_page(query, threshold=0.7, offset=len(full)) == ([], len(full))
+    assert index.search_page(query, threshold=0.7) == (full, len(full))
+
+
+def test_search_page_total_under_ivf_counts_probed_cells_only(tmp_path):
+    features = make_features(n=300, dim=16, seed=5)
+    exact = FeatureIndex.from_dict(features)
+    query = features['data/img_7.jpg']
+    _, exact_total = exact.search_page(query, threshold=0.7)
+    approx = FeatureIndex(exact.paths, exact.matrix)
+    approx.ann = build_ann(exact, str(tmp_path / 'f.ivf.npz'), nlist=16)
+    approx.nprobe = 1
+    assert approx.search_page(query, threshold=0.7)[1] < exact_total
+    approx.nprobe = approx.ann.nlist
+    assert approx.search_page(query, threshold=0.7)[1] == exact_total
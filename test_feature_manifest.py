@@ -0,0 +1,99 @@
+import os
+
+import numpy as np
+
+from feature_index import load_features
+import feature_manifest
+from feature_manifest import content_hashes, file_sha256, manifest_path_for, update_features
+
+
+def write_image(path, content):
+    with open(path, 'wb') as f:
+        f.write(content)
+
+
+def make_extractor(calls):
+    def extract_batch(paths):
+        calls.append(list(paths))
+        out = {}
+        for path in paths:
+            with open(path, 'rb') as f:
+                data = f.read()
+            if data == b'broken':
+                print('skip', path)
+                continue
+            out[path] = np.frombuffer(data.ljust(8, b'\0')[:8], dtype=np.uint8).astype(np.float32) + 1
+        return out
+    return extract_batch
+
+
+def test_incremental_update_only_extracts_changes(tmp_path):
+    data_dir = tmp_path / 'data'
+    data_dir.mkdir()
+    for name in ('a', 'b', 'c'):
+        write_image(data_dir / f'{name}.jpg', name.encode() * 4)
+    out_file = str(tmp_path / 'features.pkl')
+    calls = []
+    extract = make_extractor(calls)
+
+    stats = update_features(str(data_dir), out_file, extract, 'test-v1')
+    assert stats['extracted'] == 3 and os.path.exists(manifest_path_for(out_file))
+
+    # nothing changed -> nothing extracted
+    stats = update_features(str(data_dir), out_file, extract, 'test-v1')
+    assert stats == {'total': 3, 'reused': 3, 'extracted': 0, 'failed': 0, 'removed': 0}
+
+    # new file, deleted file, touched-but-identical file, modified file
+    write_image(data_dir / 'd.jpg', b'dddd')
+    os.remove(data_dir / 'b.jpg')
+    os.utime(data_dir / 'a.jpg', ns=(1, 1))
+    write_image(data_dir / 'c.jpg', b'changed!')
+    calls.clear()
+    stats = update_features(str(data_dir), out_file, extract, 'test-v1')
+    assert sorted(os.path.basename(p) for p in calls[0]) == ['c.jpg', 'd.jpg']
+    assert stats['removed'] == 1 and stats['total'] == 3
+
+    index = load_features(out_file)
+    assert sorted(os.path.basename(p) for p in index.keys()) == ['a.jpg', 'c.jpg', 'd.jpg']
+
+
+def test_failed_files_are_retried_and_extractor_change_rebuilds(tmp_path):
+    data_dir = tmp_path / 'data'
+    data_dir.mkdir()
+    write_image(data_dir / 'ok.jpg', b'good')
+    write_image(data_dir / 'bad.jpg', b'broken')
+    out_file = str(tmp_path / 'features.pkl')
+    calls = []
+    extract = make_extractor(calls)
+
+    assert update_features(str(data_dir), out_file, extract, 'test-v1')['failed'] == 1
+    assert update_features(str(data_dir), out_file, extract, 'test-v1')['failed'] == 1
+    assert [os.path.basename(p) for p in calls[1]] == ['bad.jpg']
+
+    stats = update_features(str(data_dir), out_file, extract, 'test-v2')
+    assert stats['extracted'] == 1 and stats['reused'] == 0
+
+
+def test_content_hashes_are_swapped_in_with_the_index(tmp_path, monkeypatch):
+    data_dir = tmp_path / 'data'
+    data_dir.mkdir()
+    write_image(data_dir / 'a.jpg', b'old bytes')
+    out_file = str(tmp_path / 'features.pkl')
+    a = str(data_dir / 'a.jpg')
+    update_features(str(data_dir), out_file, make_extractor([]), 'test-v1')
+    old_hash = file_sha256(a)
+    write_image(data_dir / 'a.jpg', b'new bytes!')
+
+    seen = []
+    save_manifest = feature_manifest.save_manifest
+
+    def reload_first(manifest, manifest_file):
+        # a worker reloading after the index landed but before the manifest did
+        index = load_features(out_file)
+        seen.append(content_hashes(out_file, index))
+        save_manifest(manifest, manifest_file)
+
+    monkeypatch.setattr(feature_manifest, 'save_manifest', reload_first)
+    update_features(str(data_dir), out_file, make_extractor([]), 'test-v1')
+    assert seen == [{file_sha256(a): a}]
+    assert old_hash not in seen[0]
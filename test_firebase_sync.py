@@ -0,0 +1,72 @@
+import base64
+import hashlib
+import os
+
+from firebase_download import load_state, sync_images
+
+
+class FakeBlob:
+    def __init__(self, name, data, generation=1, content_type='image/jpeg'):
+        self.name = name
+        self.data = data
+        self.generation = generation
+        self.content_type = content_type
+        self.size = len(data)
+        self.md5_hash = base64.b64encode(hashlib.md5(data).digest()).decode()
+        self.downloads = 0
+
+    def download_to_filename(self, path):
+        self.downloads += 1
+        with open(path, 'wb') as f:
+            f.write(self.data)
+
+
+class FakeBucket:
+    def __init__(self, blobs):
+        self.blobs = {b.name: b for b in blobs}
+
+    def list_blobs(self):
+        return list(self.blobs.values())
+
+
+def test_sync_downloads_only_changes_and_mirrors_deletes(tmp_path):
+    data_dir, state_file = str(tmp_path / 'data'), str(tmp_path / 'state.json')
+    bucket = FakeBucket([FakeBlob('a.jpg', b'aaa'), FakeBlob('pets/b.png', b'bbbb'),
+                         FakeBlob('notes.txt', b'x', content_type='text/plain'),
+                         FakeBlob('../escape.jpg', b'x')])
+    stats = sync_images(bucket, data_dir, state_file, workers=4)
+    assert (stats['downloaded'], stats['bytes'], stats['listed']) == (2, 7, 2)
+    assert open(os.path.join(data_dir, 'pets', 'b.png'), 'rb').read() == b'bbbb'
+    assert not os.path.exists(tmp_path / 'escape.jpg')
+    assert set(load_state(state_file)) == {'a.jpg', 'pets/b.png'}
+
+    stats = sync_images(bucket, data_dir, state_file)
+    assert (stats['downloaded'], stats['unchanged']) == (0, 2)
+
+    bucket.blobs['a.jpg'] = FakeBlob('a.jpg', b'new!', generation=2)
+    del bucket.blobs['pets/b.png']
+    stats = sync_images(bucket, data_dir, state_file)
+    assert (stats['downloaded'], stats['deleted'], stats['unchanged']) == (1, 1, 0)
+    assert open(os.path.join(data_dir, 'a.jpg'), 'rb').read() == b'new!'
+    assert not os.path.exists(os.path.join(data_dir, 'pets', 'b.png'))
+
+    assert sync_images(bucket, data_dir, state_file, full=True)['downloaded'] == 1
+
+
+class BrokenBlob(FakeBlob):
+    def download_to_filename(self, path):
+        # connection dropped halfway through the file
+        with open(path, 'wb') as f:
+            f.write(self.data[:1])
+        raise ConnectionError('connection reset')
+
+
+def test_failed_download_leaves_no_partial_file(tmp_path):
+    data_dir, state_file = str(tmp_path / 'data'), str(tmp_path / 'state.json')
+    bucket = FakeBucket([FakeBlob('a.jpg', b'aaa'), BrokenBlob('pets/b.jpg', b'bbbb')])
+    stats = sync_images(bucket, data_dir, state_file)
+    assert stats['downloaded'] == 1 and stats['failed'] == 1
+    files = sorted(os.path.relpath(os.path.join(root, f), data_dir)
+                   for root, _, names in os.walk(data_dir) for f in names)
+    assert files == ['a.jpg']
+    assert 'pets/b.jpg' not in load_state(state_file)  # retried next time
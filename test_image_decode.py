@@ -0,0 +1,51 @@
+import cv2
+import numpy as np
+
+from image_decode import cv2_decode, pil_load, reduction_for
+from result_light import extract_features_from_array
+
+
+def write_jpeg(path, width=2048, height=1536):
+    y, x = np.mgrid[0:height, 0:width]
+    img = np.dstack([x * 255 // width, y * 255 // height, (x + y) % 256]).astype(np.uint8)
+    cv2.imwrite(path, img)
+    return path
+
+
+def test_reduction_keeps_shortest_side_above_target():
+    assert reduction_for((4000, 3000), 256) == 8
+    assert reduction_for((1024, 768), 256) == 2
+    assert reduction_for((300, 200), 256) == 1
+
+
+def test_reduced_cv2_decode_from_path_and_bytes(tmp_path):
+    path = write_jpeg(str(tmp_path / 'big.jpg'))
+    full = cv2_decode(path, reduced=False)
+    small = cv2_decode(path, target=256, reduced=True)
+    assert full.shape[:2] == (1536, 2048)
+    assert small.shape[:2] == (192 * 2, 256 * 2)
+    with open(path, 'rb') as f:
+        assert cv2_decode(f.read(), target=256, reduced=True).shape == small.shape
+    assert cv2_decode(b'not an image', reduced=True) is None
+
+    a, b = extract_features_from_array(full), extract_features_from_array(small)
+    assert a @ b / (np.linalg.norm(a) * np.linalg.norm(b)) > 0.99
+
+
+def test_pil_load_always_returns_target_size(tmp_path):
+    path = write_jpeg(str(tmp_path / 'big.jpg'))
+    for reduced in (False, True):
+        img = pil_load(path, reduced=reduced)
+        assert img.size == (224, 224) and img.mode == 'RGB'
+
+
+def test_default_decode_matches_the_shipped_index():
+    import os
+    import subprocess
+    import sys
+    # features_light.pkl was built from full-resolution decodes
+    env = {k: v for k, v in os.environ.items() if k != 'REDUCED_DECODE'}
+    out = subprocess.run([sys.executable, '-c', 'import result_light; print(result_light.EXTRACTOR_ID)'],
+                         env=env, check=True, capture_output=True, text=True,
+                         cwd=os.path.dirname(os.path.abspath(__file__))).stdout.split()
+    assert out[-1] == 'hsv-hist-8x8x8-v1'
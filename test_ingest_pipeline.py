@@ -0,0 +1,54 @@
+import os
+import time
+
+import numpy as np
+
+from feature_index import load_features
+from image_decode import cv2_decode
+from ingest_pipeline import DirectoryBucket, ingest, run_pipeline
+from result_light import extract_features, extract_features_batch
+
+
+def test_pipeline_overlaps_stages_and_keeps_every_item():
+    def fetch(i):
+        time.sleep(0.01)  # network
+        if i == 3:
+            raise IOError('gone')
+        return f'img_{i}'
+
+    def embed(arrays):
+        time.sleep(0.01)  # model
+        return [a * 2 for a in arrays]
+
+    start = time.perf_counter()
+    vectors, report = run_pipeline(range(20), fetch, lambda p: int(p[4:]), embed,
+                                   fetch_workers=4, batch_size=4, queue_size=2)
+    assert vectors == {f'img_{i}': 2 * i for i in range(20) if i != 3}
+    assert report['fetch']['errors'] == 1 and report['embed']['items'] == 19
+    assert time.perf_counter() - start < 20 * 0.01 + 0.2
+
+
+def test_ingest_from_directory_bucket_matches_direct_extraction(tmp_path, image_files):
+    remote, local = str(tmp_path / 'bucket'), str(tmp_path / 'data')
+    output, state = str(tmp_path / 'features.pkl'), str(tmp_path / 'state.json')
+    image_files(remote, 6, size=(80, 64), name='img_{}.jpg')
+    bucket = DirectoryBucket(remote)
+
+    def decode(path):
+        img = cv2_decode(path)
+        if img is None:
+            raise ValueError(f'Cannot read image: {path}')
+        return img
+
+    report = ingest(bucket, local, output, decode, extract_features_batch, 'test-v1',
+                    state_file=state, batch_size=4)
+    assert report['downloaded'] == 6 and report['features']['total'] == 6
+    index = load_features(output)
+    path = os.path.join(local, 'img_2.jpg')
+    expected = extract_features(path)
+    assert np.allclose(index[path], expected / np.linalg.norm(expected), atol=1e-5)
+
+    os.remove(os.path.join(remote, 'img_0.jpg'))
+    report = ingest(bucket, local, output, decode, extract_features_batch, 'test-v1', state_file=state)
+    assert report['downloaded'] == 0 and report['unchanged'] == 5
+    assert report['features']['removed'] == 1 and len(load_features(output)) == 5
@@ -0,0 +1,78 @@
+import os
+import subprocess
+import sys
+import textwrap
+
+import numpy as np
+from prometheus_client import REGISTRY
+
+import metrics
+from feature_index import FeatureIndex, l2_normalize
+from query_cache import QueryCache
+
+
+def sample(name, **labels):
+    return REGISTRY.get_sample_value(name, labels) or 0.0
+
+
+def test_stage_records_one_observation():
+    before = sample('petsearch_search_stage_seconds_count', stage='extract')
+    with metrics.stage('extract'):
+        pass
+    assert sample('petsearch_search_stage_seconds_count', stage='extract') == before + 1
+
+
+def test_search_page_timings_and_cache_events():
+    rng = np.random.default_rng(0)
+    index = FeatureIndex([f'data/{i}.jpg' for i in range(50)],
+                         l2_normalize(rng.standard_normal((50, 16), dtype=np.float32)))
+    timings = {}
+    index.search_page(index['data/3.jpg'], threshold=0.0, limit=5, timings=timings)
+    assert set(timings) == {'scan', 'select'} and all(t >= 0 for t in timings.values())
+
+    misses = sample('petsearch_cache_events_total', cache='test', outcome='miss')
+    hits = sample('petsearch_cache_events_total', cache='test', outcome='hit')
+    cache = QueryCache(on_event=metrics.cache_observer('test'))
+    cache.get_or_compute('k', lambda: 1)
+    cache.get_or_compute('k', lambda: 1)
+    assert sample('petsearch_cache_events_total', cache='test', outcome='miss') == misses + 1
+    assert sample('petsearch_cache_events_total', cache='test', outcome='hit') == hits + 1
+
+
+def test_render_lists_metrics():
+    body, content_type = metrics.render()
+    assert content_type.startswith('text/plain')
+    for name in ('petsearch_request_seconds', 'petsearch_search_stage_seconds',
+                 'petsearch_cache_events_total', 'petsearch_index_vectors'):
+        assert name.encode() in body
+
+
+def test_multiprocess_sum(tmp_path):
+    # two "workers" write into the same directory; render() in a third sums them
+    env = dict(os.environ, PROMETHEUS_MULTIPROC_DIR=str(tmp_path / 'prom'))
+    worker = textwrap.dedent('''
+        import metrics
+        metrics.TRAINING_RUNS.labels('light', 'succeeded').inc()
+    ''')
+    for _ in range(2):
+        subprocess.run([sys.executable, '-c', worker], env=env, check=True, cwd=os.path.dirname(__file__))
+    out = subprocess.run([sys.executable, '-c', 'import metrics; print(metrics.render()[0].decode())'],
+                         env=env, check=True, capture_output=True, text=True,
+                         cwd=os.path.dirname(__file__)).stdout
+    assert 'petsearch_training_runs_total{kind="light",status="succeeded"} 2.0' in out
+
+
+def test_index_size_forgets_dead_workers(tmp_path):
+    # a worker that served a bigger index exits; only live workers count
+    env = dict(os.environ, PROMETHEUS_MULTIPROC_DIR=str(tmp_path / 'prom'))
+    cwd = os.path.dirname(__file__)
+    old = subprocess.run(
+        [sys.executable, '-c', 'import os, metrics; metrics.INDEX_VECTORS.set(100); print(os.getpid())'],
+        env=env, check=True, capture_output=True, text=True, cwd=cwd).stdout.strip()
+    out = subprocess.run([sys.executable, '-c', textwrap.dedent(f'''
+        import metrics
+        metrics.mark_worker_dead({old})
+        metrics.INDEX_VECTORS.set(10)
+        print(metrics.render()[0].decode())
+    ''')], env=env, check=True, capture_output=True, text=True, cwd=cwd).stdout
+    assert 'petsearch_index_vectors 10.0' in out
@@ -0,0 +1,72 @@
+import json
+import threading
+
+from order_store import OrderStore
+
+
+def make_order(i, email='a@example.com'):
+    return {'order_id': f'order-{i}', 'payment_intent_id': f'pi_{i}',
+            'customer_info': {'email': email}, 'items': [], 'created_at': f'2024-01-01T00:00:{i:02d}'}
+
+
+def test_insert_and_indexed_lookups(tmp_path):
+    store = OrderStore(str(tmp_path / 'orders.db'), orders_file=None, sessions_file=None)
+    for i in range(5):
+        store.add_order(make_order(i, 'a@example.com' if i % 2 else 'b@example.com'))
+    assert store.get_order('order-3')['payment_intent_id'] == 'pi_3'
+    assert store.get_order('missing') is None
+    assert [o['order_id'] for o in store.find_by_payment_intent('pi_4')] == ['order-4']
+    assert [o['order_id'] for o in store.list_orders('a@example.com')] == ['order-1', 'order-3']
+    assert len(store.list_orders()) == 5
+    store.add_session({'session_id': 'cs_1', 'customer_info': {}, 'items': []})
+    assert store.get_session('cs_1')['session_id'] == 'cs_1'
+
+
+def test_json_files_are_migrated_once(tmp_path):
+    orders_file = tmp_path / 'orders.json'
+    sessions_file = tmp_path / 'checkout_sessions.json'
+    orders_file.write_text(json.dumps([make_order(1), make_order(2)]), encoding='utf-8')
+    sessions_file.write_text(json.dumps([{'session_id': 'cs_9'}]), encoding='utf-8')
+    db = str(tmp_path / 'orders.db')
+
+    store = OrderStore(db, str(orders_file), str(sessions_file))
+    assert [o['order_id'] for o in store.list_orders()] == ['order-1', 'order-2']
+    assert store.get_session('cs_9') is not None
+    store.add_order(make_order(3))
+    assert len(OrderStore(db, str(orders_file), str(sessions_file)).list_orders()) == 3
+
+
+def test_concurrent_inserts_are_not_lost(tmp_path):
+    store = OrderStore(str(tmp_path / 'orders.db'), orders_file=None, sessions_file=None)
+
+    def confirm(start):
+        for i in range(start, start + 25):
+            store.add_order(make_order(i))
+
+    threads = [threading.Thread(target=confirm, args=(n * 25,)) for n in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len(store.list_orders()) == 200
+
+
+def test_cursor_pages_cover_listing_and_version_tracks_inserts(tmp_path):
+    store = OrderStore(str(tmp_path / 'orders.db'), orders_file=None, sessions_file=None)
+    for i in range(7):
+        store.add_order(make_order(i, 'a@example.com' if i % 2 else 'b@example.com'))
+    seen, cursor = [], None
+    while True:
+        page, cursor = store.list_page(cursor=cursor, limit=3)
+        seen += [o['order_id'] for o in page]
+        if cursor is None:
+            break
+    assert seen == [f'order-{i}' for i in range(7)]
+    page, cursor = store.list_page('a@example.com', limit=10)
+    assert [o['order_id'] for o in page] == ['order-1', 'order-3', 'order-5'] and cursor is None
+
+    version = store.listing_version()
+    assert version == (7, 7)
+    assert store.listing_version('a@example.com') != version
+    store.add_order(make_order(8))
+    assert store.listing_version() != version
@@ -0,0 +1,92 @@
+import pstats
+import threading
+import time
+
+import pytest
+
+from profiler import Profiler, ProfilerBusy
+
+
+def busy(ms):
+    end = time.perf_counter() + ms / 1000
+    while time.perf_counter() < end:
+        pass
+
+
+def serve(profiler, endpoint='search_image', ms=20):
+    handle = profiler.begin(endpoint)
+    busy(ms)
+    if handle is not None:
+        profiler.end(handle)
+
+
+def test_idle_profiler_does_nothing(tmp_path):
+    profiler = Profiler(out_dir=str(tmp_path))
+    assert profiler.begin('search_image') is None
+    assert profiler.stop() is None
+    assert not list(tmp_path.iterdir())
+
+
+def test_cprofile_next_n_requests(tmp_path):
+    profiler = Profiler(out_dir=str(tmp_path))
+    profiler.start('cprofile', requests=2)
+    with pytest.raises(ProfilerBusy):
+        profiler.start('cprofile', requests=1)
+    serve(profiler, 'other_endpoint')
+    serve(profiler)
+    assert profiler.session is None  # finished after two requests
+    summary = profiler.history[-1]
+    assert summary['requests'] == 2
+    stats = pstats.Stats(summary['file'])
+    assert any(func[2] == 'busy' for func in stats.stats)
+
+
+def test_endpoint_filter_and_sampling(tmp_path):
+    profiler = Profiler(out_dir=str(tmp_path))
+    profiler.start('sampling', requests=1, endpoints=['search_image'])
+    assert profiler.begin('train_features') is None
+    serve(profiler, ms=100)
+    summary = profiler.history[-1]
+    assert summary['requests'] == 1 and summary['samples'] > 0
+    lines = open(summary['file'], encoding='utf-8').read().splitlines()
+    assert any('busy (' in line for line in lines)
+    stack, count = lines[0].rsplit(' ', 1)
+    assert int(count) > 0 and ';' in stack
+
+
+def test_time_window_samples_background_threads(tmp_path):
+    profiler = Profiler(out_dir=str(tmp_path))
+    profiler.start('sampling', seconds=0.2)
+    worker = threading.Thread(target=busy, args=(150,))
+    worker.start()
+    worker.join()
+    time.sleep(0.3)
+    assert profiler.session is None  # the window closed without any request
+    summary = profiler.history[-1]
+    assert 'busy (' in open(summary['file'], encoding='utf-8').read()
+
+
+def test_invalid_arguments(tmp_path):
+    profiler = Profiler(out_dir=str(tmp_path))
+    for kwargs in ({'mode': 'perf', 'requests': 1}, {'requests': 1, 'seconds': 1}, {},
+                   {'requests': 0}, {'seconds': 10 ** 6}):
+        with pytest.raises(ValueError):
+            profiler.start(**kwargs)
+    assert profiler.session is None
+
+
+@pytest.mark.parametrize('mode', ['cprofile', 'sampling'])
+def test_follow_profiles_work_handed_to_a_pool(tmp_path, mode):
+    from concurrent.futures import ThreadPoolExecutor
+    profiler = Profiler(out_dir=str(tmp_path))
+    profiler.start(mode, requests=1)
+    handle = profiler.begin('search_image')
+    with ThreadPoolExecutor(1) as pool:
+        # the request thread only waits; the work happens on the pool thread
+        pool.submit(profiler.follow(handle, busy), 100).result()
+    profiler.end(handle)
+    summary = profiler.history[-1]
+    if mode == 'cprofile':
+        assert any(func[2] == 'busy' for func in pstats.Stats(summary['file']).stats)
+    else:
+        assert 'busy (' in open(summary['file'], encoding='utf-8').read()
@@ -0,0 +1,99 @@
+import threading
+import time
+
+import pytest
+
+from query_cache import QueryCache
+
+
+def test_hit_miss_lru_and_ttl():
+    cache = QueryCache(max_entries=2, ttl=60)
+    calls = []
+
+    def compute(value):
+        calls.append(value)
+        return value
+
+    assert cache.get_or_compute('a', lambda: compute(1)) == 1
+    assert cache.get_or_compute('a', lambda: compute(2)) == 1
+    cache.get_or_compute('b', lambda: compute(3))
+    cache.get_or_compute('c', lambda: compute(4))  # evicts 'a'
+    assert cache.get_or_compute('a', lambda: compute(5)) == 5
+    assert calls == [1, 3, 4, 5]
+    assert cache.stats()['hits'] == 1 and cache.stats()['misses'] == 4
+
+    expiring = QueryCache(ttl=0)
+    expiring.get_or_compute('a', lambda: 1)
+    assert expiring.get_or_compute('a', lambda: 2) == 2
+
+
+def test_invalidate_and_errors_are_not_cached():
+    cache = QueryCache()
+    cache.get_or_compute('a', lambda: 1)
+    cache.invalidate()
+    assert cache.get_or_compute('a', lambda: 2) == 2
+
+    with pytest.raises(ValueError):
+        cache.get_or_compute('bad', lambda: (_ for _ in ()).throw(ValueError('nope')))
+    assert cache.get_or_compute('bad', lambda: 3) == 3
+
+
+def test_concurrent_identical_queries_are_coalesced():
+    cache = QueryCache()
+    started = threading.Event()
+    calls = []
+
+    def slow():
+        calls.append(1)
+        started.set()
+        time.sleep(0.2)
+        return 'result'
+
+    results = []
+    first = threading.Thread(target=lambda: results.append(cache.get_or_compute('k', slow)))
+    first.start()
+    started.wait(5)
+    others = [threading.Thread(target=lambda: results.append(cache.get_or_compute('k', slow)))
+              for _ in range(3)]
+    for t in others:
+        t.start()
+    for t in [first, *others]:
+        t.join(5)
+    assert results == ['result'] * 4
+    assert len(calls) == 1
+    assert cache.stats()['coalesced'] == 3
+
+
+def test_lookups_after_invalidate_do_not_join_old_work():
+    cache = QueryCache()
+    old_started, release_old = threading.Event(), threading.Event()
+    new_started, release_new = threading.Event(), threading.Event()
+
+    def old_index():
+        old_started.set()
+        release_old.wait(5)
+        return 'old'
+
+    def new_index():
+        new_started.set()
+        release_new.wait(5)
+        return 'new'
+
+    results = {}
+    first = threading.Thread(target=lambda: results.update(first=cache.get_or_compute('k', old_index)))
+    first.start()
+    old_started.wait(5)
+    cache.invalidate()  # the index was reloaded while 'old' is still running
+    second = threading.Thread(target=lambda: results.update(second=cache.get_or_compute('k', new_index)))
+    second.start()
+    new_started.wait(5)
+    # the old computation finishing must not unregister the new one
+    release_old.set()
+    first.join(5)
+    third = threading.Thread(target=lambda: results.update(third=cache.get_or_compute('k', old_index)))
+    third.start()
+    release_new.set()
+    for t in (second, third):
+        t.join(5)
+    assert results == {'first': 'old', 'second': 'new', 'third': 'new'}
+    assert cache.get_or_compute('k', old_index) == 'new'
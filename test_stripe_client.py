@@ -0,0 +1,105 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from stripe_client import StripeClient, StripeError
+
+
+class MockStripe(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # keep-alive
+    calls = []
+    failures_left = {}
+
+    def _reply(self, status, body, headers=None):
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_GET(self):
+        self.calls.append(('GET', self.path, self.client_address[1], self.headers.get('Idempotency-Key')))
+        if self.path.endswith('/pi_slow'):
+            time.sleep(0.5)
+        status = 'succeeded' if self.path.endswith('/pi_ok') else 'processing'
+        self._reply(200, {'id': self.path.rsplit('/', 1)[1], 'status': status})
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        self.calls.append(('POST', self.path, self.client_address[1], self.headers.get('Idempotency-Key')))
+        if self.failures_left.get(self.path, 0) > 0:
+            self.failures_left[self.path] -= 1
+            return self._reply(503, {'error': 'try again'})
+        if self.path.endswith('/refunds'):
+            return self._reply(429, {'error': 'slow down'}, {'Retry-After': '3600'})
+        if self.path.endswith('/checkout/sessions'):
+            return self._reply(400, {'error': {'message': 'bad request'}})
+        self._reply(200, {'id': 'pi_new', 'client_secret': 'secret'})
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def stripe_server():
+    MockStripe.calls = []
+    MockStripe.failures_left = {}
+    server = ThreadingHTTPServer(('127.0.0.1', 0), MockStripe)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f'http://127.0.0.1:{server.server_address[1]}/v1'
+    server.shutdown()
+
+
+def test_posts_retry_with_one_idempotency_key_over_a_pooled_connection(stripe_server):
+    client = StripeClient('sk_test', stripe_server, backoff_factor=0)
+    MockStripe.failures_left['/v1/payment_intents'] = 1
+    assert client.create_payment_intent({'amount': '100'})['id'] == 'pi_new'
+    client.retrieve_payment_intent('pi_other')
+    posts = [c for c in MockStripe.calls if c[0] == 'POST']
+    assert len(posts) == 2 and posts[0][3] and posts[0][3] == posts[1][3]
+    assert len({c[2] for c in MockStripe.calls}) == 1  # one kept-alive connection
+
+    with pytest.raises(StripeError) as err:
+        client.create_checkout_session({'mode': 'payment'})
+    assert err.value.status_code == 400 and 'bad request' in err.value.details
+
+
+def test_succeeded_intents_are_cached_and_slow_calls_time_out(stripe_server):
+    client = StripeClient('sk_test', stripe_server, timeout=(1, 0.2), max_retries=0)
+    for _ in range(3):
+        assert client.retrieve_payment_intent('pi_ok')['status'] == 'succeeded'
+        client.retrieve_payment_intent('pi_pending')
+    gets = [c[1] for c in MockStripe.calls]
+    assert gets.count('/v1/payment_intents/pi_ok') == 1
+    assert gets.count('/v1/payment_intents/pi_pending') == 3
+    assert client.intent_cache_hits == 2
+
+    with pytest.raises(StripeError) as err:
+        client.retrieve_payment_intent('pi_slow')
+    assert err.value.status_code is None
+
+
+def test_retries_stay_within_the_call_deadline(stripe_server):
+    client = StripeClient('sk_test', stripe_server, timeout=(1, 0.2), max_retries=10,
+                          backoff_factor=0.05, deadline=0.6, retry_after_max=0.1)
+    start = time.perf_counter()
+    with pytest.raises(StripeError) as err:
+        client.retrieve_payment_intent('pi_slow')
+    assert err.value.status_code is None
+    assert time.perf_counter() - start < 1.0
+    assert 1 < len(MockStripe.calls) < 11
+
+    # an hour-long Retry-After is capped, not slept through
+    MockStripe.calls = []
+    start = time.perf_counter()
+    with pytest.raises(StripeError) as err:
+        client.post('/refunds', {'payment_intent': 'pi_ok'})
+    assert err.value.status_code == 429
+    assert time.perf_counter() - start < 1.0
+    assert len(MockStripe.calls) > 1
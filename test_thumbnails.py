@@ -0,0 +1,39 @@
+import os
+import time
+
+from PIL import Image
+
+from thumbnails import ThumbnailCache
+
+
+def test_thumbnails_are_generated_once_and_track_the_source(tmp_path, image_files):
+    source, = image_files(str(tmp_path), 1, size=(800, 600), name='pet.png')
+    cache = ThumbnailCache(str(tmp_path / 'thumbs'))
+    path, etag = cache.get(source, 200)
+    with Image.open(path) as thumb:
+        assert thumb.size == (256, 192) and thumb.format == 'JPEG'
+    assert cache.get(source, 250) == (path, etag)
+    assert cache.stats()['generated'] == 1 and cache.stats()['hits'] == 1
+
+    with Image.open(cache.get(source, 5000)[0]) as thumb:
+        assert thumb.size == (800, 600)  # never upscaled
+
+    time.sleep(0.01)
+    image_files(str(tmp_path), 1, size=(800, 600), seed=1, name='pet.png')
+    assert cache.get(source, 200)[1] != etag
+
+
+def test_cache_evicts_least_recently_used(tmp_path, image_files):
+    sources = image_files(str(tmp_path), 4, size=(800, 600), name='{}.png')
+    probe = ThumbnailCache(str(tmp_path / 'probe'))
+    one = os.path.getsize(probe.get(sources[0], 256)[0])
+
+    cache = ThumbnailCache(str(tmp_path / 'thumbs'), max_bytes=int(one * 2.5))
+    first = cache.get(sources[0], 256)[0]
+    second = cache.get(sources[1], 256)[0]
+    os.utime(first, (time.time() - 100, time.time() - 100))
+    os.utime(second, (time.time() - 50, time.time() - 50))
+    cache.get(sources[0], 256)  # served again: now the most recent
+    cache.get(sources[2], 256)
+    assert os.path.exists(first) and not os.path.exists(second)
+    assert cache.stats()['bytes'] <= cache.max_bytes
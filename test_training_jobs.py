@@ -0,0 +1,43 @@
+import threading
+
+import pytest
+
+from training_jobs import TrainingInProgress, TrainingJobs
+
+
+def test_job_runs_in_background_and_reports_result(tmp_path):
+    jobs = TrainingJobs(str(tmp_path))
+    stages = []
+
+    def target(progress):
+        progress('extracting')
+        stages.append('extracting')
+        return {'features_count': 3}
+
+    job = jobs.start('LIGHT_MODE', target)
+    done = jobs.wait(job['job_id'], timeout=5)
+    assert done['status'] == 'succeeded'
+    assert done['features_count'] == 3
+    assert stages == ['extracting']
+    # visible to other workers through the job file
+    assert TrainingJobs(str(tmp_path)).get(job['job_id'])['status'] == 'succeeded'
+
+
+def test_single_flight_and_failure(tmp_path):
+    jobs = TrainingJobs(str(tmp_path))
+    release = threading.Event()
+
+    def slow(progress):
+        release.wait(5)
+        raise RuntimeError('build failed')
+
+    job = jobs.start('LIGHT_MODE', slow)
+    with pytest.raises(TrainingInProgress) as exc:
+        jobs.start('LIGHT_MODE', slow)
+    assert exc.value.job_id == job['job_id']
+
+    release.set()
+    done = jobs.wait(job['job_id'], timeout=5)
+    assert done['status'] == 'failed' and done['error'] == 'build failed'
+    # the slot is free again once the job finished
+    jobs.wait(jobs.start('LIGHT_MODE', lambda progress: {})['job_id'], timeout=5)
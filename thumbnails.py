@@ -0,0 +1,115 @@
+import hashlib
+import os
+import threading
+
+from PIL import Image, ImageOps
+
+# Resized copies of corpus images for /image?w=..., kept on disk and shared by
+# every worker. The cache is bounded; least recently served files go first.
+THUMB_CACHE_DIR = os.environ.get('THUMB_CACHE_DIR', '.thumbs')
+THUMB_CACHE_MAX_BYTES = int(float(os.environ.get('THUMB_CACHE_MB', '256')) * 1024 * 1024)
+# requested widths are rounded up to one of these, so the cache can't be
+# filled with one variant per pixel width
+THUMB_WIDTHS = (64, 128, 256, 512, 1024)
+THUMB_QUALITY = 82
+
+
+def source_version(path):
+    """Short token that changes whenever the file does (mtime + size)."""
+    st = os.stat(path)
+    return hashlib.sha1(f'{st.st_mtime_ns}:{st.st_size}'.encode()).hexdigest()[:16]
+
+
+def snap_width(width):
+    for w in THUMB_WIDTHS:
+        if width <= w:
+            return w
+    return THUMB_WIDTHS[-1]
+
+
+class ThumbnailCache:
+    """On-disk JPEG thumbnails keyed by (source path, version, width).
+
+    A thumbnail's key only changes when its source does, so the key doubles
+    as a strong ETag. Serving a thumbnail bumps its mtime; when the cache
+    grows past `max_bytes` the oldest files are removed down to 90%.
+    """
+
+    def __init__(self, cache_dir=THUMB_CACHE_DIR, max_bytes=THUMB_CACHE_MAX_BYTES):
+        self.cache_dir = os.path.abspath(cache_dir)
+        self.max_bytes = max_bytes
+        self.generated = 0
+        self.hits = 0
+        self._lock = threading.Lock()
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self._bytes = sum(size for _, _, size in self._entries())
+
+    def _entries(self):
+        for root, _, files in os.walk(self.cache_dir):
+            for fname in files:
+                if fname.endswith('.jpg'):
+                    path = os.path.join(root, fname)
+                    try:
+                        st = os.stat(path)
+                    except OSError:
+                        continue
+                    yield path, st.st_mtime, st.st_size
+
+    def get(self, source, width):
+        """(thumbnail path, etag) for `source` at most `width` pixels wide."""
+        width = snap_width(width)
+        key = hashlib.sha1(
+            f'{os.path.abspath(source)}:{source_version(source)}:{width}:{THUMB_QUALITY}'.encode()
+        ).hexdigest()
+        path = os.path.join(self.cache_dir, key[:2], key + '.jpg')
+        try:
+            os.utime(path)  # mark as recently used
+            with self._lock:
+                self.hits += 1
+            return path, key
+        except FileNotFoundError:
+            pass
+        size = self._generate(source, path, width)
+        with self._lock:
+            self.generated += 1
+            self._bytes += size
+            over = self._bytes > self.max_bytes
+        if over:
+            self.evict()
+        return path, key
+
+    def _generate(self, source, path, width):
+        with Image.open(source) as img:
+            if img.format == 'JPEG':
+                img.draft('RGB', (width, width))  # DCT-scaled decode
+            img = ImageOps.exif_transpose(img)
+            if img.width > width:
+                img = img.resize((width, max(1, round(img.height * width / img.width))),
+                                 Image.LANCZOS)
+            img = img.convert('RGB')
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_file = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+            img.save(tmp_file, 'JPEG', quality=THUMB_QUALITY, optimize=True)
+        os.replace(tmp_file, path)
+        return os.path.getsize(path)
+
+    def evict(self):
+        """Drop least recently used thumbnails until the cache is at 90% of its limit."""
+        with self._lock:
+            entries = sorted(self._entries(), key=lambda e: e[1])
+            total = sum(size for _, _, size in entries)
+            target = self.max_bytes * 0.9
+            for path, _, size in entries:
+                if total <= target:
+                    break
+                try:
+                    os.remove(path)
+                except OSError:
+                    continue
+                total -= size
+            self._bytes = total
+
+    def stats(self):
+        with self._lock:
+            return {'bytes': self._bytes, 'max_bytes': self.max_bytes,
+                    'generated': self.generated, 'hits': self.hits}
@@ -0,0 +1,141 @@
+import json
+import os
+import threading
+import uuid
+from datetime import datetime
+
+try:
+    import fcntl
+except ImportError:  # Windows: single-flight is only enforced inside one process
+    fcntl = None
+
+JOBS_DIR = os.environ.get('TRAIN_JOBS_DIR', '.train_jobs')
+MAX_JOBS = 50
+
+
+class TrainingInProgress(Exception):
+    def __init__(self, job_id):
+        super().__init__(f'Training job {job_id} is already running')
+        self.job_id = job_id
+
+
+class TrainingJobs:
+    """Runs training in a background thread, one job at a time.
+
+    Job state is mirrored to `<jobs_dir>/<id>.json` so any gunicorn worker can
+    answer `/train/jobs/<id>`, and an flock on `<jobs_dir>/train.lock` keeps
+    two workers from building the same feature file concurrently.
+    """
+
+    def __init__(self, jobs_dir=JOBS_DIR):
+        self.jobs_dir = jobs_dir
+        self._jobs = {}
+        self._threads = {}
+        self._active = None
+        self._lock = threading.Lock()
+        os.makedirs(jobs_dir, exist_ok=True)
+
+    def start(self, kind, target):
+        """Start `target(progress)` as a job; raises TrainingInProgress if busy.
+
+        `target` receives a `progress(stage)` callback and returns a dict of
+        result fields merged into the finished job.
+        """
+        with self._lock:
+            if self._active is not None:
+                raise TrainingInProgress(self._active)
+            job_id = uuid.uuid4().hex[:12]
+            lock_fd = self._acquire_file_lock(job_id)
+            job = {
+                'job_id': job_id,
+                'kind': kind,
+                'status': 'running',
+                'stage': 'starting',
+                'created_at': datetime.now().isoformat(),
+                'finished_at': None,
+            }
+            self._jobs[job_id] = job
+            self._active = job_id
+            self._save(job)
+            thread = threading.Thread(target=self._run, args=(job, target, lock_fd),
+                                      name=f'train-{job_id}', daemon=True)
+            self._threads[job_id] = thread
+        thread.start()
+        return dict(job)
+
+    def get(self, job_id):
+        job = self._jobs.get(job_id)
+        if job is not None:
+            return dict(job)
+        try:
+            with open(self._job_file(job_id), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def wait(self, job_id, timeout=None):
+        thread = self._threads.get(job_id)
+        if thread is not None:
+            thread.join(timeout)
+        return self.get(job_id)
+
+    def _run(self, job, target, lock_fd):
+        def progress(stage):
+            job['stage'] = stage
+            self._save(job)
+
+        try:
+            result = target(progress) or {}
+            job.update(result, status='succeeded', stage='done')
+        except Exception as e:
+            job.update(status='failed', error=str(e))
+        finally:
+            job['finished_at'] = datetime.now().isoformat()
+            self._save(job)
+            self._release_file_lock(lock_fd)
+            with self._lock:
+                self._active = None
+                self._threads.pop(job['job_id'], None)
+                self._prune()
+
+    def _job_file(self, job_id):
+        return os.path.join(self.jobs_dir, f'{os.path.basename(job_id)}.json')
+
+    def _save(self, job):
+        tmp_file = self._job_file(job['job_id']) + '.tmp'
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump(job, f, ensure_ascii=False)
+        os.replace(tmp_file, self._job_file(job['job_id']))
+
+    def _prune(self):
+        finished = [j for j in self._jobs if j != self._active]
+        for job_id in finished[:-MAX_JOBS]:
+            self._jobs.pop(job_id, None)
+        files = sorted((f for f in os.listdir(self.jobs_dir) if f.endswith('.json')),
+                       key=lambda f: os.path.getmtime(os.path.join(self.jobs_dir, f)))
+        for fname in files[:-MAX_JOBS]:
+            try:
+                os.remove(os.path.join(self.jobs_dir, fname))
+            except OSError:
+                pass
+
+    def _acquire_file_lock(self, job_id):
+        if fcntl is None:
+            return None
+        fd = os.open(os.path.join(self.jobs_dir, 'train.lock'), os.O_RDWR | os.O_CREAT)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            other = os.read(fd, 64).decode('utf-8', 'replace').strip()
+            os.close(fd)
+            raise TrainingInProgress(other or 'unknown')
+        os.ftruncate(fd, 0)
+        os.write(fd, job_id.encode('utf-8'))
+        return fd
+
+    def _release_file_lock(self, fd):
+        if fd is None:
+            return
+        os.ftruncate(fd, 0)
+        fcntl.flock(fd, fcntl.LOCK_UN)
+        os.close(fd)